@@ -0,0 +1,208 @@
+import datetime
+import logging
+from decimal import Decimal
+
+from django.contrib.auth.models import User
+from django.db import IntegrityError, transaction
+from django.db.models import Count, DecimalField, F, Q, Sum
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+
+from .models import Category, DailyProductSales, DailySales, OrderItem, Product
+
+logger = logging.getLogger(__name__)
+
+# ----------------------------
+# Sales rollups
+# ----------------------------
+# Revenue and units per day (DailySales) and per day and product, tagged with
+# the product's category and seller (DailyProductSales). Checkouts add their
+# lines once their transaction commits, in a short transaction of their own:
+# every checkout of the day updates the same DailySales row, and locking it
+# from inside the checkout would queue all checkouts behind each other. An
+# order that rolls back is never added. A rollup that fails, or a worker
+# that dies between the two commits, leaves the day short: the
+# rebuild_sales_rollups command recomputes any range from OrderItem.
+
+# Orders in these states are not sales
+EXCLUDED_STATUSES = ('pending', 'cancelled')
+GROUPINGS = ('day', 'product', 'category', 'seller')
+
+LINE_REVENUE = F('quantity') * F('unit_price')
+MONEY = DecimalField(max_digits=14, decimal_places=2)
+CENTS = Decimal('0.01')
+
+
+def _bump(model, lookup, deltas, defaults=None):
+    """Add `deltas` to the row identified by `lookup`, creating it if needed."""
+    updates = {field: F(field) + value for field, value in deltas.items()}
+    if model.objects.filter(**lookup).update(**updates):
+        return
+    try:
+        with transaction.atomic():
+            model.objects.create(**lookup, **(defaults or {}), **deltas)
+    except IntegrityError:
+        # Another checkout created the row first
+        model.objects.filter(**lookup).update(**updates)
+
+
+def apply_sale(day, lines, sign=1):
+    """
+    Add one order's lines (dicts with product_id, quantity, unit_price) to
+    the rollups for `day`; sign=-1 takes them back out.
+    """
+    per_product = {}
+    for line in lines:
+        units, revenue = per_product.get(line['product_id'], (0, Decimal('0.00')))
+        per_product[line['product_id']] = (units + line['quantity'],
+                                           revenue + line['unit_price'] * line['quantity'])
+    tags = {
+        pk: (category_id, seller_id)
+        for pk, category_id, seller_id in Product.objects.filter(pk__in=[pk for pk in per_product if pk])
+        .values_list('id', 'category_id', 'created_by_id')
+    }
+    with transaction.atomic():
+        # Same order as every other checkout: products by id, then the day row
+        for product_id in sorted(pk for pk in per_product if pk):
+            units, revenue = per_product[product_id]
+            category_id, seller_id = tags.get(product_id, (None, None))
+            _bump(DailyProductSales, {'day': day, 'product_id': product_id},
+                  {'orders': sign, 'units': sign * units, 'revenue': sign * revenue},
+                  defaults={'category_id': category_id, 'seller_id': seller_id})
+        _bump(DailySales, {'day': day}, {
+            'orders': sign,
+            'units': sign * sum(units for units, _ in per_product.values()),
+            'revenue': sign * sum((revenue for _, revenue in per_product.values()), Decimal('0.00')),
+        })
+
+
+def _apply_after_commit(day, lines, sign=1):
+    def apply():
+        try:
+            apply_sale(day, lines, sign)
+        except Exception:
+            logger.exception("Updating the sales rollups for %s failed; rebuild_sales_rollups repairs them", day)
+    transaction.on_commit(apply)
+
+
+def record_order(order, lines):
+    """Add a new order's lines to the rollups once the checkout's transaction commits."""
+    if order.status.lower() in EXCLUDED_STATUSES:
+        return
+    day = timezone.localdate(order.created_at)
+    lines = [{'product_id': l['product_id'], 'quantity': l['quantity'], 'unit_price': l['unit_price']}
+             for l in lines]
+    _apply_after_commit(day, lines)
+
+
+def forget_order(order):
+    """Take a deleted order back out of the rollups once it is gone. Call before deleting it."""
+    if order.status.lower() in EXCLUDED_STATUSES:
+        return
+    day = timezone.localdate(order.created_at)
+    lines = list(OrderItem.objects.filter(order=order).values('product_id', 'quantity', 'unit_price'))
+    _apply_after_commit(day, lines, sign=-1)
+
+
+# --- Backfill ---
+
+def _sold_items(start, end):
+    # Statuses are not stored in one case ('paid' and 'Paid' both occur)
+    excluded = Q()
+    for status in EXCLUDED_STATUSES:
+        excluded |= Q(order__status__iexact=status)
+    items = OrderItem.objects.exclude(excluded).annotate(day=TruncDate('order__created_at'))
+    if start:
+        items = items.filter(day__gte=start)
+    if end:
+        items = items.filter(day__lte=end)
+    return items
+
+
+def rebuild(start=None, end=None):
+    """Recompute the rollups for [start, end] (inclusive, open-ended if None)."""
+    items = _sold_items(start, end)
+    days = list(items.values('day').annotate(
+        orders=Count('order_id', distinct=True), units=Sum('quantity'),
+        revenue=Sum(LINE_REVENUE, output_field=MONEY),
+    ).order_by('day'))
+    products = list(items.exclude(product_id=None).values('day', 'product_id').annotate(
+        orders=Count('order_id', distinct=True), units=Sum('quantity'),
+        revenue=Sum(LINE_REVENUE, output_field=MONEY),
+    ).order_by('day', 'product_id'))
+    tags = {
+        pk: (category_id, seller_id)
+        for pk, category_id, seller_id in Product.objects.filter(pk__in={row['product_id'] for row in products})
+        .values_list('id', 'category_id', 'created_by_id')
+    }
+
+    with transaction.atomic():
+        for model in (DailySales, DailyProductSales):
+            stale = model.objects.all()
+            if start:
+                stale = stale.filter(day__gte=start)
+            if end:
+                stale = stale.filter(day__lte=end)
+            stale.delete()
+        DailySales.objects.bulk_create(
+            [DailySales(day=row['day'], orders=row['orders'], units=row['units'], revenue=row['revenue'])
+             for row in days],
+            batch_size=1000,
+        )
+        DailyProductSales.objects.bulk_create(
+            [DailyProductSales(day=row['day'], product_id=row['product_id'],
+                               category_id=tags.get(row['product_id'], (None, None))[0],
+                               seller_id=tags.get(row['product_id'], (None, None))[1],
+                               orders=row['orders'], units=row['units'], revenue=row['revenue'])
+             for row in products],
+            batch_size=1000,
+        )
+    return len(days), len(products)
+
+
+# --- Reporting ---
+
+def sales_report(start, end, group_by='day', limit=50):
+    """Totals and one breakdown for [start, end], read from the rollups only."""
+    totals = DailySales.objects.filter(day__gte=start, day__lte=end).aggregate(
+        orders=Sum('orders'), units=Sum('units'), revenue=Sum('revenue'))
+    report = {
+        'from': start, 'to': end, 'group_by': group_by,
+        'totals': {
+            'orders': totals['orders'] or 0,
+            'units': totals['units'] or 0,
+            'revenue': Decimal(totals['revenue'] or 0).quantize(CENTS),
+        },
+    }
+
+    if group_by == 'day':
+        report['results'] = list(DailySales.objects.filter(day__gte=start, day__lte=end)
+                                 .values('day', 'orders', 'units', 'revenue').order_by('day'))
+        return report
+
+    key = {'product': 'product_id', 'category': 'category_id', 'seller': 'seller_id'}[group_by]
+    sums = {'units': Sum('units'), 'revenue': Sum('revenue')}
+    if group_by == 'product':
+        # An order holds a product once, so per-product order counts add up
+        sums['orders'] = Sum('orders')
+    rows = list(DailyProductSales.objects.filter(day__gte=start, day__lte=end)
+                .values(key).annotate(**sums).order_by('-revenue', key)[:limit])
+
+    ids = [row[key] for row in rows if row[key] is not None]
+    if group_by == 'product':
+        names = dict(Product.objects.filter(pk__in=ids).values_list('id', 'title'))
+    elif group_by == 'category':
+        names = dict(Category.objects.filter(pk__in=ids).values_list('id', 'name'))
+    else:
+        names = dict(User.objects.filter(pk__in=ids).values_list('id', 'username'))
+    report['results'] = [
+        {'id': row[key], 'name': names.get(row[key]), **{f: row[f] for f in sums},
+         'revenue': Decimal(row['revenue'] or 0).quantize(CENTS)}
+        for row in rows
+    ]
+    return report
+
+
+def default_range(days=30):
+    end = timezone.localdate()
+    return end - datetime.timedelta(days=days - 1), end
@@ -0,0 +1,107 @@
+from functools import wraps
+
+from asgiref.sync import sync_to_async
+from django.shortcuts import aget_object_or_404
+from django.views.decorators.csrf import csrf_exempt
+
+from . import conditional, views
+from .conditional import async_condition
+from .cards import cards, image_rows, product_rows
+from .models import Category, Product
+from .pagination import InvalidCursor, akeyset_paginate, get_page_size, paginate_ranked
+from .serializers import CategorySerializer, ProductSerializer
+from .renderers import LeanJsonResponse
+from .replicas import replica_reads
+from .timing import TimedJsonResponse as JsonResponse
+
+# ----------------------------
+# Async read path (ASGI only)
+# ----------------------------
+# Native async versions of the public catalog reads, routed by
+# api/async_urls.py when the app is served through backend/asgi.py. GETs query
+# through the async ORM and never hold a thread while waiting on the database;
+# every other method falls through to the sync view in api/views.py, so
+# responses are identical to the WSGI ones. Work that is synchronous by nature
+# (validator lookups, the in-memory search/facet indexes, which may rebuild
+# from the database) runs via sync_to_async.
+
+
+def read_only(sync_view):
+    """Serve GET from the decorated async view and anything else from sync_view."""
+    def decorator(view):
+        @wraps(view)
+        async def inner(request, *args, **kwargs):
+            if request.method != 'GET':
+                return await sync_to_async(sync_view)(request, *args, **kwargs)
+            return await view(request, *args, **kwargs)
+        return inner
+    return decorator
+
+
+# ----------------------------
+# CATEGORY endpoints
+# ----------------------------
+@csrf_exempt
+@read_only(views.categories)
+@replica_reads
+@async_condition(etag_func=conditional.categories_etag, last_modified_func=conditional.categories_last_modified)
+async def categories(request):
+    qs = [c async for c in Category.objects.all()]
+    return JsonResponse(CategorySerializer(qs, many=True).data, safe=False)
+
+# ----------------------------
+# PRODUCT endpoints
+# ----------------------------
+async def _product_page(plan, request):
+    """views._product_page() through the async ORM."""
+    cursor, limit = request.GET.get('cursor'), get_page_size(request)
+    rows = product_rows(plan.qs)
+    if plan.ranked is not None:
+        ids, next_cursor = paginate_ranked(plan.ranked, cursor, limit)
+        found = {r['id']: r async for r in rows.filter(id__in=ids)}
+        return [found[pk] for pk in ids if pk in found], next_cursor
+    return await akeyset_paginate(rows, plan.ordering, cursor, limit)
+
+@csrf_exempt
+@read_only(views.products_list_create)
+@replica_reads
+@async_condition(etag_func=conditional.product_list_etag, last_modified_func=conditional.product_list_last_modified)
+async def products_list_create(request):
+    plan = await sync_to_async(views._product_list_plan)(request)
+    if not isinstance(plan, views.ProductListPlan):
+        return plan
+    try:
+        page, next_cursor = await _product_page(plan, request)
+    except InvalidCursor as e:
+        return JsonResponse({'error': str(e)}, status=400)
+    images = [img async for img in image_rows([r['id'] for r in page])]
+    return LeanJsonResponse({'results': cards(page, images), 'next_cursor': next_cursor, 'facets': plan.facets})
+
+@csrf_exempt
+@read_only(views.product_detail)
+@replica_reads
+@async_condition(etag_func=conditional.product_etag, last_modified_func=conditional.product_last_modified)
+async def product_detail(request, pk):
+    # Images are prefetched: serializing must not fall back to lazy queries
+    p = await aget_object_or_404(
+        Product.objects.select_related('category', 'rating_summary').prefetch_related('images'), pk=pk)
+    return JsonResponse(ProductSerializer(p).data)
+
+# ----------------------------
+# REVIEW endpoints
+# ----------------------------
+@csrf_exempt
+@read_only(views.product_reviews)
+@replica_reads
+@async_condition(etag_func=conditional.reviews_etag, last_modified_func=conditional.reviews_last_modified)
+async def product_reviews(request, product_id):
+    product = await aget_object_or_404(Product, pk=product_id)
+    ordering = views.REVIEW_SORTS.get(request.GET.get('sort', 'newest'))
+    if not ordering:
+        return JsonResponse({"error": "Invalid sort"}, status=400)
+    try:
+        page, next_cursor = await akeyset_paginate(views._review_rows(product), ordering, request.GET.get('cursor'),
+                                                   get_page_size(request, default=10, maximum=50))
+    except InvalidCursor as e:
+        return JsonResponse({"error": str(e)}, status=400)
+    return JsonResponse({"results": views._review_data(page), "next_cursor": next_cursor})
@@ -0,0 +1,705 @@
+import asyncio
+import datetime
+import io
+import json
+import math
+import os
+import random
+import sys
+import time
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlencode
+from decimal import Decimal
+from pathlib import Path
+
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.handlers.wsgi import WSGIHandler
+from django.db import connection
+from django.test import Client
+from django.test.utils import CaptureQueriesContext, override_settings
+from django.urls import reverse
+from django.utils import timezone
+
+from . import analytics, cards, carts, views
+from .facets import product_facets
+from .models import (Address, Cart, CartItem, Category, ImageUploadJob, Order, OrderItem, Product,
+                     ProductImage, ProductImportJob, ProductRating, Review, UserProfile, Wishlist, WishlistItem)
+from .search import product_search
+from .timing import observe_queries
+
+# ----------------------------
+# Endpoint benchmarks
+# ----------------------------
+# Seeds a catalog of configurable size, drives every route in api/urls.py
+# through the test client and records, per scenario, the worst query count,
+# p50/p95 latency and response size. Results are checked against the budgets
+# in benchmark_budgets.json. Query budgets hold at any data volume; size
+# budgets are only compared when the run used the volumes they were recorded
+# with. Latency depends on the machine and its load, so it is reported against
+# its budget but only fails a run on request (--fail-on-latency). Entry points:
+# `manage.py benchmark` and api/tests.py.
+
+DEFAULT_VOLUMES = {
+    'products': 2000,
+    'images': 2,        # per product
+    'reviews': 5000,
+    'users': 200,
+    'orders': 2000,
+}
+DEFAULT_ITERATIONS = 20
+BUDGET_FILE = Path(__file__).with_name('benchmark_budgets.json')
+
+# Headroom applied by --update-budgets to measured latency and size
+LATENCY_HEADROOM = 2.0
+SIZE_HEADROOM = 1.25
+
+SEED_PASSWORD = 'bench-pass'
+METRICS_TOKEN = 'bench-metrics'
+SEED_DAYS = 90
+ITEMS_PER_ORDER = 3
+BATCH = 1000
+
+
+# --- Seeding ---
+
+class Fixtures:
+    """Ids and tokens the scenarios need, filled in by seed()."""
+
+    def __init__(self):
+        self.counter = 0
+
+    def unique(self, prefix):
+        self.counter += 1
+        return f"{prefix}-{self.counter}"
+
+    def headers(self, user):
+        return {'HTTP_AUTHORIZATION': f"Bearer {self.tokens[user.pk]}"}
+
+    def fill_cart(self, user, size=3):
+        """Replace user's cart with one of each of `size` seeded products."""
+        carts.clear(user.pk)
+        for pk in self.product_ids[5:5 + size]:
+            carts.add_line(user.pk, pk, 1)
+
+
+def _user(username, password_hash, **extra):
+    user = User.objects.create(username=username, password=password_hash, email=f"{username}@example.com", **extra)
+    UserProfile.objects.create(user=user)
+    return user
+
+
+def seed(volumes=None, rng_seed=0):
+    """Populate an empty database and return the Fixtures."""
+    volumes = {**DEFAULT_VOLUMES, **(volumes or {})}
+    rng = random.Random(rng_seed)
+    cache.clear()  # carts and stamps cached for an earlier database
+    fx = Fixtures()
+    # One hash for every seeded account; hashing per user would dominate seeding
+    password_hash = make_password(SEED_PASSWORD)
+
+    fx.admin = _user('bench-admin', password_hash, is_staff=True)
+    fx.shopper = _user('bench-shopper', password_hash)
+    fx.buyer = _user('bench-buyer', password_hash)       # checkouts, so the shopper's cart stays put
+    fx.reviewer = _user('bench-reviewer', password_hash)
+    fx.password = SEED_PASSWORD
+    fx.password_hash = password_hash
+
+    User.objects.bulk_create(
+        [User(username=f"user{n}", email=f"user{n}@example.com", password=password_hash)
+         for n in range(volumes['users'])],
+        batch_size=BATCH,
+    )
+    users = list(User.objects.filter(username__startswith='user').order_by('id'))
+    UserProfile.objects.bulk_create([UserProfile(user=u) for u in users], batch_size=BATCH)
+
+    Category.objects.bulk_create(
+        [Category(name=f"Category {n}", slug=f"category-{n}") for n in range(20)])
+    categories = list(Category.objects.order_by('id'))
+    brands = [f"Brand {n}" for n in range(30)]
+    words = ['phone', 'laptop', 'cable', 'charger', 'speaker', 'camera', 'watch', 'headphones',
+             'keyboard', 'mouse', 'monitor', 'tablet', 'router', 'printer', 'lamp', 'bottle']
+    sellers = users[:4] or [fx.admin]
+
+    Product.objects.bulk_create([
+        Product(
+            title=f"{rng.choice(brands)} {rng.choice(words)} {rng.choice(words)} {n}",
+            slug=f"bench-product-{n}",
+            description=' '.join(rng.choice(words) for _ in range(30)),
+            price=Decimal(rng.randint(100, 3000000)) / 100,
+            brand=rng.choice(brands),
+            category=rng.choice(categories),
+            created_by=fx.admin if n % 10 == 0 else rng.choice(sellers),
+            stock=1_000_000,
+        )
+        for n in range(volumes['products'])
+    ], batch_size=BATCH)
+    product_ids = list(Product.objects.order_by('id').values_list('id', flat=True))
+    fx.product_ids = product_ids
+
+    ProductImage.objects.bulk_create([
+        ProductImage(product_id=pk, image_url=f"https://img.example.com/{pk}/{n}.jpg", is_featured=n == 0)
+        for pk in product_ids for n in range(volumes['images'])
+    ], batch_size=BATCH)
+
+    # Reviews: distinct (product, user) pairs, skewed towards the first products
+    pairs = set()
+    reviewers = users or [fx.shopper]
+    attempts = 0
+    while len(pairs) < min(volumes['reviews'], len(product_ids) * len(reviewers)) and attempts < volumes['reviews'] * 10:
+        attempts += 1
+        product_id = product_ids[min(int(rng.expovariate(10 / len(product_ids))), len(product_ids) - 1)]
+        pairs.add((product_id, rng.choice(reviewers).pk))
+    reviews = [Review(product_id=p, user_id=u, rating=rng.randint(1, 5), title='Review', body='Bench review body')
+               for p, u in pairs]
+    Review.objects.bulk_create(reviews, batch_size=BATCH)
+
+    ratings = {pk: ProductRating(product_id=pk) for pk in product_ids}
+    for review in reviews:
+        ratings[review.product_id].apply(added=review.rating)
+    ProductRating.objects.bulk_create(ratings.values(), batch_size=BATCH)
+    fx.review_ids = list(Review.objects.order_by('id').values_list('id', flat=True))
+    fx.own_review_id = Review.objects.create(product_id=product_ids[-1], user=fx.reviewer, rating=4).pk
+    fx.reviewed_product_id = max(product_ids[:50], key=lambda pk: ratings[pk].count)
+
+    # Shopper: addresses, a cart, a wishlist and a long order history
+    for user in (fx.shopper, fx.buyer):
+        Address.objects.create(user=user, full_name=user.username, address_line1='1 Bench Street',
+                               city='Bench City', state='BS', postal_code='100001', country='IN')
+    fx.address_id = Address.objects.filter(user=fx.shopper).values_list('id', flat=True).first()
+    fx.buyer_address_id = Address.objects.filter(user=fx.buyer).values_list('id', flat=True).first()
+    cart = Cart.objects.create(user=fx.shopper)
+    CartItem.objects.bulk_create([CartItem(cart=cart, product_id=pk, quantity=2) for pk in product_ids[:5]])
+    fx.cart_line_id = product_ids[0]  # cart/lines/ and batches take product ids
+    fx.cart_item_id = CartItem.objects.get(cart=cart, product_id=product_ids[0]).pk  # cart/items/ takes CartItem ids
+    Cart.objects.create(user=fx.buyer)
+    wishlist = Wishlist.objects.create(user=fx.shopper)
+    WishlistItem.objects.bulk_create([WishlistItem(wishlist=wishlist, product_id=pk) for pk in product_ids[:20]])
+
+    customers = [fx.shopper] * 60 + users
+    prices = dict(Product.objects.values_list('id', 'price'))
+    Order.objects.bulk_create([
+        Order(user=customers[n % len(customers)], total_amount=0, status='paid', payment_id=f"seed{n}")
+        for n in range(volumes['orders'])
+    ], batch_size=BATCH)
+    orders = list(Order.objects.order_by('id'))
+    items = []
+    now = timezone.now()
+    for n, order in enumerate(orders):
+        total = Decimal('0.00')
+        for pk in rng.sample(product_ids, min(ITEMS_PER_ORDER, len(product_ids))):
+            quantity = rng.randint(1, 3)
+            items.append(OrderItem(order=order, product_id=pk, quantity=quantity, unit_price=prices[pk]))
+            total += prices[pk] * quantity
+        order.total_amount = total
+        order.created_at = now - datetime.timedelta(days=n % SEED_DAYS, minutes=n)
+    OrderItem.objects.bulk_create(items, batch_size=BATCH)
+    Order.objects.bulk_update(orders, ['total_amount', 'created_at'], batch_size=BATCH)
+    fx.order_id = Order.objects.filter(user=fx.shopper).values_list('id', flat=True).first()
+    analytics.rebuild()
+
+    fx.upload_job_id = ImageUploadJob.objects.create(
+        product_id=product_ids[0], spool_path='/dev/null', file_name='bench.jpg', status='done').pk
+    fx.import_job_id = ProductImportJob.objects.create(
+        created_by=fx.admin, spool_path='/dev/null', file_name='bench.csv', format='csv', status='done').pk
+    fx.image_id = ProductImage.objects.filter(product_id=product_ids[0]).values_list('id', flat=True).first()
+    fx.category_id = categories[0].pk
+    fx.own_product_id = Product.objects.filter(created_by=fx.admin).values_list('id', flat=True).first()
+
+    fx.tokens = {u.pk: views.generate_token(u) for u in (fx.admin, fx.shopper, fx.buyer, fx.reviewer)}
+    fx.volumes = volumes
+
+    # The bulk writes skipped signals
+    product_search.mark_stale()
+    product_facets.mark_stale()
+    return fx
+
+
+# --- Scenarios ---
+# build(fx) prepares any per-iteration rows (not timed) and returns
+# (path, client kwargs) for the measured request.
+
+Scenario = namedtuple('Scenario', 'name route method build status')
+
+
+def _json(data, **extra):
+    return {'data': json.dumps(data), 'content_type': 'application/json', **extra}
+
+
+def _fresh_category(fx):
+    return Category.objects.create(name=fx.unique('Bench category'), slug=fx.unique('bench-category')).pk
+
+
+def _fresh_product(fx):
+    return Product.objects.create(title='Disposable', slug=fx.unique('disposable'), price=1,
+                                  created_by=fx.admin, stock=1).pk
+
+
+def _fresh_cart_line(fx):
+    product_id = _fresh_product(fx)
+    carts.add_line(fx.shopper.pk, product_id, 1)
+    return product_id
+
+
+def _fresh_cart_item(fx):
+    product_id = _fresh_cart_line(fx)
+    carts.flush(fx.shopper.pk)
+    return CartItem.objects.get(cart__user=fx.shopper, product_id=product_id).pk
+
+
+def _fresh_order(fx):
+    order = Order.objects.create(user=fx.shopper, total_amount=10, status='paid', payment_id=fx.unique('txn'))
+    OrderItem.objects.create(order=order, product_id=fx.product_ids[0], quantity=1, unit_price=10)
+    return order.pk
+
+
+def _next_review(fx):
+    fx.unique('vote')
+    return fx.review_ids[fx.counter % len(fx.review_ids)]
+
+
+def _import_file(fx):
+    rows = ['title,slug,price,brand,stock,category']
+    rows += [f"Imported {n},bench-import-{n},{n}.99,Brand 1,5,Category 1" for n in range(50)]
+    return SimpleUploadedFile('bench.csv', '\n'.join(rows).encode(), content_type='text/csv')
+
+
+def _product_form(fx):
+    return {'title': 'Bench product', 'slug': fx.unique('bench-new'), 'description': 'New', 'price': '99.99',
+            'brand': 'Brand 1', 'stock': '10', 'category_name': 'Category 1'}
+
+
+def _fresh_user(fx):
+    return _user(fx.unique('bench-account'), fx.password_hash)
+
+
+def _fresh_session(fx):
+    """Headers for a new account's token, for scenarios that revoke it."""
+    return {'HTTP_AUTHORIZATION': f"Bearer {views.generate_token(_fresh_user(fx))}"}
+
+
+def _admin(fx):
+    return fx.headers(fx.admin)
+
+
+def _shopper(fx):
+    return fx.headers(fx.shopper)
+
+
+def _since(days):
+    return (timezone.localdate() - datetime.timedelta(days=days)).isoformat()
+
+
+SCENARIOS = [
+    # Auth
+    Scenario('register', 'user_register', 'post', lambda fx: (
+        reverse('user_register'),
+        _json({'username': fx.unique('bench-user'), 'email': 'b@example.com', 'password': 'pw-123456'})), 201),
+    Scenario('login', 'user_login', 'post', lambda fx: (
+        reverse('user_login'), _json({'username': fx.shopper.username, 'password': fx.password})), 200),
+    Scenario('admin register', 'admin_register', 'post', lambda fx: (
+        reverse('admin_register'),
+        _json({'username': fx.unique('bench-admin'), 'password': 'pw-123456',
+               'secret_key': os.environ.get('MASTER_KEY', 'CREATE_ADMIN_123')})), 201),
+    Scenario('admin login', 'admin_login', 'post', lambda fx: (
+        reverse('admin_login'), _json({'username': fx.admin.username, 'password': fx.password})), 200),
+    Scenario('logout', 'user_logout', 'post', lambda fx: (reverse('user_logout'), _fresh_session(fx)), 200),
+    Scenario('change password', 'change_password', 'post', lambda fx: (
+        reverse('change_password'),
+        _json({'old_password': fx.password, 'new_password': 'pw-654321'}, **_fresh_session(fx))), 200),
+    Scenario('admin deactivate user', 'admin_deactivate_user', 'post', lambda fx: (
+        reverse('admin_deactivate_user', args=[_fresh_user(fx).pk]), _admin(fx)), 200),
+
+    # Categories
+    Scenario('categories', 'category_list_create', 'get', lambda fx: (reverse('category_list_create'), {}), 200),
+    Scenario('category create', 'category_list_create', 'post', lambda fx: (
+        reverse('category_list_create'), _json({'name': fx.unique('New category')}, **_admin(fx))), 201),
+    Scenario('category', 'category_detail', 'get', lambda fx: (
+        reverse('category_detail', args=[fx.category_id]), {}), 200),
+    Scenario('category update', 'category_detail', 'put', lambda fx: (
+        reverse('category_detail', args=[fx.category_id]), _json({'description': 'Updated'}, **_admin(fx))), 200),
+    Scenario('category delete', 'category_detail', 'delete', lambda fx: (
+        reverse('category_detail', args=[_fresh_category(fx)]), _admin(fx)), 200),
+
+    # Products
+    Scenario('products', 'products_list_create', 'get', lambda fx: (reverse('products_list_create'), {}), 200),
+    Scenario('products search', 'products_list_create', 'get', lambda fx: (
+        reverse('products_list_create'), {'data': {'q': 'phone charger'}}), 200),
+    Scenario('products filtered', 'products_list_create', 'get', lambda fx: (
+        reverse('products_list_create'),
+        {'data': {'category': 'category-1,category-2', 'min_price': '500', 'max_price': '20000', 'sort': 'price_asc'}}), 200),
+    Scenario('products by rating', 'products_list_create', 'get', lambda fx: (
+        reverse('products_list_create'), {'data': {'sort': 'rating'}}), 200),
+    Scenario('product create', 'products_list_create', 'post', lambda fx: (
+        reverse('products_list_create'), {'data': _product_form(fx), **_admin(fx)}), 201),
+    Scenario('product', 'product_detail', 'get', lambda fx: (
+        reverse('product_detail', args=[fx.product_ids[0]]), {}), 200),
+    Scenario('product update', 'product_detail', 'put', lambda fx: (
+        reverse('product_detail', args=[fx.own_product_id]), _json({'description': 'Updated', 'is_active': 'true'}, **_admin(fx))), 200),
+    Scenario('product delete', 'product_detail', 'delete', lambda fx: (
+        reverse('product_detail', args=[_fresh_product(fx)]), _admin(fx)), 200),
+    Scenario('product image update', 'product_image_detail', 'put', lambda fx: (
+        reverse('product_image_detail', args=[fx.image_id]), _json({'alt_text': 'Bench', 'is_featured': 'true'}, **_admin(fx))), 200),
+    Scenario('product image delete', 'product_image_detail', 'delete', lambda fx: (
+        reverse('product_image_detail', args=[ProductImage.objects.create(
+            product_id=fx.product_ids[0], image_url='https://img.example.com/tmp.jpg').pk]), _admin(fx)), 200),
+    Scenario('products batch', 'products_batch', 'get', lambda fx: (
+        reverse('products_batch'), {'data': {'ids': ','.join(map(str, fx.product_ids[:24]))}}), 200),
+    Scenario('products batch cold', 'products_batch', 'get', lambda fx: (
+        cards.invalidate_cards(fx.product_ids[24:48]) or reverse('products_batch'),
+        {'data': {'ids': ','.join(map(str, fx.product_ids[24:48]))}}), 200),
+    Scenario('my products', 'my_products', 'get', lambda fx: (reverse('my_products'), _admin(fx)), 200),
+    Scenario('products import', 'products_import', 'post', lambda fx: (
+        reverse('products_import'), {'data': {'file': _import_file(fx)}, **_admin(fx)}), 202),
+    Scenario('import job', 'import_job_detail', 'get', lambda fx: (
+        reverse('import_job_detail', args=[fx.import_job_id]), _admin(fx)), 200),
+    Scenario('upload job', 'upload_job_detail', 'get', lambda fx: (
+        reverse('upload_job_detail', args=[fx.upload_job_id]), _admin(fx)), 200),
+
+    # Cart
+    Scenario('cart', 'cart_view', 'get', lambda fx: (reverse('cart_view'), _shopper(fx)), 200),
+    Scenario('cart add', 'cart_view', 'post', lambda fx: (
+        reverse('cart_view'), _json({'product_id': fx.product_ids[0], 'quantity': 1}, **_shopper(fx))), 200),
+    Scenario('cart remove', 'cart_view', 'delete', lambda fx: (
+        reverse('cart_view'), _json({'item_id': _fresh_cart_item(fx)}, **_shopper(fx))), 200),
+    Scenario('cart item', 'cart_item_detail', 'get', lambda fx: (
+        reverse('cart_item_detail', args=[fx.cart_item_id]), _shopper(fx)), 200),
+    Scenario('cart item update', 'cart_item_detail', 'put', lambda fx: (
+        reverse('cart_item_detail', args=[fx.cart_item_id]), _json({'quantity': 2}, **_shopper(fx))), 200),
+    Scenario('cart item delete', 'cart_item_detail', 'delete', lambda fx: (
+        reverse('cart_item_detail', args=[_fresh_cart_item(fx)]), _shopper(fx)), 200),
+    Scenario('cart line', 'cart_line_detail', 'get', lambda fx: (
+        reverse('cart_line_detail', args=[fx.cart_line_id]), _shopper(fx)), 200),
+    Scenario('cart line update', 'cart_line_detail', 'put', lambda fx: (
+        reverse('cart_line_detail', args=[fx.cart_line_id]), _json({'quantity': 2}, **_shopper(fx))), 200),
+    Scenario('cart line delete', 'cart_line_detail', 'delete', lambda fx: (
+        reverse('cart_line_detail', args=[_fresh_cart_line(fx)]), _shopper(fx)), 200),
+    Scenario('cart summary', 'cart_summary', 'get', lambda fx: (reverse('cart_summary'), _shopper(fx)), 200),
+    Scenario('cart batch', 'cart_batch', 'post', lambda fx: (
+        reverse('cart_batch'), _json({'operations': [
+            {'op': 'add', 'product_id': _fresh_product(fx), 'quantity': 1},
+            {'op': 'add', 'product_id': _fresh_product(fx), 'quantity': 2},
+            {'op': 'set', 'product_id': fx.cart_line_id, 'quantity': 3},
+            {'op': 'remove', 'product_id': _fresh_cart_line(fx)},
+        ]}, **_shopper(fx))), 200),
+
+    # Wishlist
+    Scenario('wishlist', 'wishlist_view', 'get', lambda fx: (reverse('wishlist_view'), _shopper(fx)), 200),
+    Scenario('wishlist page', 'wishlist_items', 'get', lambda fx: (
+        reverse('wishlist_items'), {'data': {'limit': 12}, **_shopper(fx)}), 200),
+    Scenario('wishlist ids', 'wishlist_ids', 'get', lambda fx: (reverse('wishlist_ids'), _shopper(fx)), 200),
+    Scenario('wishlist add', 'wishlist_add', 'post', lambda fx: (
+        reverse('wishlist_add'), _json({'product_id': _fresh_product(fx)}, **_shopper(fx))), 200),
+    Scenario('wishlist remove', 'wishlist_remove', 'delete', lambda fx: (
+        reverse('wishlist_remove', args=[WishlistItem.objects.create(
+            wishlist=Wishlist.objects.get(user=fx.shopper), product_id=_fresh_product(fx)).product_id]),
+        _shopper(fx)), 200),
+
+    # Addresses
+    Scenario('addresses', 'address_list_create', 'get', lambda fx: (reverse('address_list_create'), _shopper(fx)), 200),
+    Scenario('address create', 'address_list_create', 'post', lambda fx: (
+        reverse('address_list_create'),
+        _json({'line1': '2 Bench Street', 'city': 'Bench City', 'state': 'BS', 'zip_code': '100002', 'country': 'IN'},
+              **_shopper(fx))), 201),
+    Scenario('address', 'address_detail', 'get', lambda fx: (
+        reverse('address_detail', args=[fx.address_id]), _shopper(fx)), 200),
+    Scenario('address update', 'address_detail', 'put', lambda fx: (
+        reverse('address_detail', args=[fx.address_id]), _json({'city': 'Bench Town'}, **_shopper(fx))), 200),
+    Scenario('address delete', 'address_detail', 'delete', lambda fx: (
+        reverse('address_detail', args=[Address.objects.create(
+            user=fx.shopper, full_name='Tmp', address_line1='x', city='x', state='x', postal_code='1', country='IN').pk]),
+        _shopper(fx)), 200),
+
+    # Orders
+    Scenario('order create', 'create_order', 'post', lambda fx: (
+        fx.fill_cart(fx.buyer) or reverse('create_order'),
+        _json({'address_id': fx.buyer_address_id, 'transaction_id': fx.unique('txn')}, **fx.headers(fx.buyer))), 201),
+    Scenario('orders', 'orders_list', 'get', lambda fx: (reverse('orders_list'), _shopper(fx)), 200),
+    Scenario('order', 'order_detail', 'get', lambda fx: (reverse('order_detail', args=[fx.order_id]), _shopper(fx)), 200),
+    Scenario('order delete', 'order_detail', 'delete', lambda fx: (
+        reverse('order_detail', args=[_fresh_order(fx)]), _shopper(fx)), 200),
+    Scenario('sales by day', 'sales_analytics', 'get', lambda fx: (
+        reverse('sales_analytics'), {'data': {'from': _since(SEED_DAYS)}, **_admin(fx)}), 200),
+    Scenario('sales by product', 'sales_analytics', 'get', lambda fx: (
+        reverse('sales_analytics'), {'data': {'from': _since(SEED_DAYS), 'group_by': 'product'}, **_admin(fx)}), 200),
+
+    # Payments
+    Scenario('payu initiate', 'payu_init', 'post', lambda fx: (
+        fx.fill_cart(fx.buyer) or reverse('payu_init'),
+        _json({'address_id': fx.buyer_address_id}, **fx.headers(fx.buyer))), 200),
+    Scenario('payu success', 'payu_success', 'post', lambda fx: (
+        fx.fill_cart(fx.buyer) or reverse('payu_success'),
+        {'data': {'udf1': fx.buyer.pk, 'udf2': fx.buyer_address_id, 'txnid': fx.unique('payu'),
+                  'status': 'success'}}), 302),
+    Scenario('payu failure', 'payu_failure', 'post', lambda fx: (reverse('payu_failure'), {}), 302),
+
+    # Reviews
+    Scenario('review add', 'add_review', 'post', lambda fx: (
+        reverse('add_review'),
+        _json({'product_id': _fresh_product(fx), 'rating': 4, 'body': 'Bench'}, **fx.headers(fx.reviewer))), 200),
+    Scenario('review', 'review_detail', 'get', lambda fx: (
+        reverse('review_detail', args=[fx.own_review_id]), fx.headers(fx.reviewer)), 200),
+    Scenario('review update', 'review_detail', 'put', lambda fx: (
+        reverse('review_detail', args=[fx.own_review_id]), _json({'rating': 3}, **fx.headers(fx.reviewer))), 200),
+    Scenario('review delete', 'review_detail', 'delete', lambda fx: (
+        reverse('review_detail', args=[Review.objects.create(
+            product_id=_fresh_product(fx), user=fx.reviewer, rating=5).pk]), fx.headers(fx.reviewer)), 200),
+    Scenario('review helpful', 'review_helpful', 'post', lambda fx: (
+        reverse('review_helpful', args=[_next_review(fx)]), _shopper(fx)), 200),
+    Scenario('product reviews', 'product_reviews_list', 'get', lambda fx: (
+        reverse('product_reviews_list', args=[fx.reviewed_product_id]), {}), 200),
+    Scenario('product reviews helpful', 'product_reviews_list', 'get', lambda fx: (
+        reverse('product_reviews_list', args=[fx.reviewed_product_id]), {'data': {'sort': 'helpful'}}), 200),
+
+    # Monitoring
+    Scenario('metrics', 'metrics', 'get', lambda fx: (
+        reverse('metrics'), {'HTTP_AUTHORIZATION': f"Bearer {METRICS_TOKEN}"}), 200),
+]
+
+
+def uncovered_routes(scenarios=SCENARIOS):
+    """Named api routes that no scenario exercises."""
+    from . import urls
+    covered = {s.route for s in scenarios}
+    return sorted(p.name for p in urls.urlpatterns if p.name and p.name not in covered)
+
+
+# --- Measuring ---
+
+def percentile(samples, q):
+    ordered = sorted(samples)
+    return ordered[max(0, math.ceil(q * len(ordered)) - 1)]
+
+
+def measure(client, fx, scenario, iterations):
+    """Warm up once, then time `iterations` requests of one scenario."""
+    timings, queries, sizes, statuses = [], [], [], set()
+    for n in range(iterations + 1):
+        path, kwargs = scenario.build(fx)
+        call = getattr(client, scenario.method)
+        with CaptureQueriesContext(connection) as ctx:
+            started = time.perf_counter()
+            response = call(path, **kwargs)
+            elapsed = time.perf_counter() - started
+        if n == 0:
+            continue  # warm-up: in-process indexes and auth cache
+        timings.append(elapsed * 1000)
+        queries.append(len(ctx))
+        sizes.append(len(response.content))
+        statuses.add(response.status_code)
+    return {
+        'queries': max(queries),
+        'p50_ms': round(percentile(timings, 0.50), 2),
+        'p95_ms': round(percentile(timings, 0.95), 2),
+        'bytes': max(sizes),
+        'status': sorted(statuses),
+    }
+
+
+def run(fx, iterations=DEFAULT_ITERATIONS, only=None, scenarios=SCENARIOS):
+    # A crashing view is reported as a 500 status, not raised
+    client = Client(raise_request_exception=False)
+    results = {}
+    # No background cart writes: checkouts write carts inside their measured
+    # requests. Token checks stay cached for the whole run so query counts do
+    # not depend on how long the run takes. Queued imports, and the index
+    # rebuilds after them, run inside the request that triggers them rather
+    # than in a thread that reads while the next request writes, and never on
+    # a timer.
+    with override_settings(CART_FLUSH_DELAY=None, CART_FLUSH_EAGER=False, AUTH_CACHE_TTL=24 * 3600,
+                           PRODUCT_IMPORT_EAGER=True, INDEX_REBUILD_EAGER=True, SEARCH_INDEX_TTL=None,
+                           FACET_INDEX_TTL=None, METRICS_TOKEN=METRICS_TOKEN):
+        for scenario in scenarios:
+            if only and scenario.name not in only and scenario.route not in only:
+                continue
+            results[scenario.name] = measure(client, fx, scenario, iterations)
+    return results
+
+
+# --- Budgets ---
+
+def load_budgets(path=BUDGET_FILE):
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {'volumes': None, 'routes': {}}
+
+
+def save_budgets(results, volumes, path=BUDGET_FILE):
+    budgets = {
+        'volumes': volumes,
+        'routes': {
+            name: {
+                'queries': r['queries'],
+                'p95_ms': round(max(r['p95_ms'] * LATENCY_HEADROOM, 5.0), 1),
+                'bytes': math.ceil(r['bytes'] * SIZE_HEADROOM),
+            }
+            for name, r in sorted(results.items())
+        },
+    }
+    with open(path, 'w') as f:
+        json.dump(budgets, f, indent=2)
+        f.write('\n')
+    return budgets
+
+
+def check(results, budgets, volumes, scenarios=SCENARIOS):
+    """Return a list of human-readable violations of the status, query and size budgets."""
+    failures = []
+    expected = {s.name: s.status for s in scenarios}
+    same_volumes = budgets.get('volumes') == volumes
+    for name, result in results.items():
+        if result['status'] != [expected[name]]:
+            failures.append(f"{name}: status {result['status']}, expected {expected[name]}")
+        budget = budgets['routes'].get(name)
+        if budget is None:
+            failures.append(f"{name}: no budget recorded")
+            continue
+        if result['queries'] > budget['queries']:
+            failures.append(f"{name}: {result['queries']} queries > budget {budget['queries']}")
+        if same_volumes and result['bytes'] > budget['bytes']:
+            failures.append(f"{name}: {result['bytes']} bytes > budget {budget['bytes']}")
+    return failures
+
+
+def slow_scenarios(results, budgets, volumes):
+    """Return a list of p95 latencies over budget (only at the budgets' volumes)."""
+    if budgets.get('volumes') != volumes:
+        return []
+    return [
+        f"{name}: p95 {result['p95_ms']}ms > budget {budgets['routes'][name]['p95_ms']}ms"
+        for name, result in results.items()
+        if name in budgets['routes'] and result['p95_ms'] > budgets['routes'][name]['p95_ms']
+    ]
+
+
+# --- WSGI vs ASGI ---
+# The catalog reads served by api/async_views.py, driven concurrently through
+# one in-process WSGI handler on a thread pool (a gthread worker with
+# wsgi_threads threads) and through backend/asgi.py on a single event loop.
+# db_latency_ms sleeps after every statement to stand in for the network round
+# trip to a remote database.
+
+ASGI_SCENARIOS = ('categories', 'products', 'products search', 'product', 'product reviews')
+DEFAULT_CONCURRENCY = 32
+DEFAULT_REQUESTS = 400
+DEFAULT_WSGI_THREADS = 8
+
+
+def _read_request(fx, scenario):
+    path, kwargs = scenario.build(fx)
+    return path, urlencode(kwargs.get('data', {}))
+
+
+def _db_latency(seconds):
+    def observer(sql, elapsed):
+        time.sleep(seconds)
+    return observe_queries(observer)
+
+
+def _wsgi_get(app, path, query, latency):
+    environ = {
+        'REQUEST_METHOD': 'GET', 'PATH_INFO': path, 'QUERY_STRING': query, 'SCRIPT_NAME': '',
+        'SERVER_NAME': 'testserver', 'SERVER_PORT': '80', 'SERVER_PROTOCOL': 'HTTP/1.1',
+        'HTTP_HOST': 'testserver', 'wsgi.version': (1, 0), 'wsgi.url_scheme': 'http',
+        'wsgi.input': io.BytesIO(), 'wsgi.errors': sys.stderr, 'wsgi.multithread': True,
+        'wsgi.multiprocess': False, 'wsgi.run_once': False,
+    }
+    status = []
+    started = time.perf_counter()
+    with _db_latency(latency):
+        response = app(environ, lambda s, headers: status.append(int(s.split()[0])))
+        body = b''.join(response)
+        response.close()
+    return status[0], body, time.perf_counter() - started
+
+
+async def _asgi_get(app, path, query):
+    scope = {
+        'type': 'http', 'asgi': {'version': '3.0'}, 'http_version': '1.1', 'method': 'GET',
+        'scheme': 'http', 'path': path, 'raw_path': path.encode(), 'query_string': query.encode(),
+        'root_path': '', 'headers': [(b'host', b'testserver')],
+        'client': ('127.0.0.1', 0), 'server': ('testserver', 80),
+    }
+    requested, disconnected = False, asyncio.Event()
+    status, chunks = [], []
+
+    async def receive():
+        nonlocal requested
+        if not requested:
+            requested = True
+            return {'type': 'http.request', 'body': b'', 'more_body': False}
+        await disconnected.wait()
+        return {'type': 'http.disconnect'}
+
+    async def send(message):
+        if message['type'] == 'http.response.start':
+            status.append(message['status'])
+        elif message['type'] == 'http.response.body':
+            chunks.append(message.get('body', b''))
+            if not message.get('more_body'):
+                disconnected.set()
+
+    started = time.perf_counter()
+    await app(scope, receive, send)
+    return status[0], b''.join(chunks), time.perf_counter() - started
+
+
+def _summary(results, wall):
+    latencies = [elapsed * 1000 for _, _, elapsed in results]
+    return {
+        'rps': round(len(results) / wall, 1),
+        'p50_ms': round(percentile(latencies, 0.50), 2),
+        'p95_ms': round(percentile(latencies, 0.95), 2),
+        'status': sorted({status for status, _, _ in results}),
+    }
+
+
+def compare_servers(fx, concurrency=DEFAULT_CONCURRENCY, requests=DEFAULT_REQUESTS, db_latency_ms=0,
+                    wsgi_threads=DEFAULT_WSGI_THREADS):
+    """
+    Throughput and latency of each async-served scenario under WSGI and ASGI,
+    plus whether both returned the same body. Returns {name: {'wsgi': ...,
+    'asgi': ..., 'identical': bool}}.
+    """
+    from backend.asgi import CatalogASGIHandler
+
+    wsgi, asgi = WSGIHandler(), CatalogASGIHandler()
+    latency = db_latency_ms / 1000
+    results = {}
+    with override_settings(AUTH_CACHE_TTL=24 * 3600):
+        for scenario in SCENARIOS:
+            if scenario.name not in ASGI_SCENARIOS:
+                continue
+            path, query = _read_request(fx, scenario)
+
+            # Warm-up: in-process indexes, auth cache, and the body to compare
+            _, wsgi_body, _ = _wsgi_get(wsgi, path, query, 0)
+            _, asgi_body, _ = asyncio.run(_asgi_get(asgi, path, query))
+
+            with ThreadPoolExecutor(min(wsgi_threads, concurrency)) as pool:
+                started = time.perf_counter()
+                done = list(pool.map(lambda _: _wsgi_get(wsgi, path, query, latency), range(requests)))
+                wsgi_result = _summary(done, time.perf_counter() - started)
+
+            async def drive():
+                gate = asyncio.Semaphore(concurrency)
+
+                async def one():
+                    async with gate:
+                        return await _asgi_get(asgi, path, query)
+                with _db_latency(latency):
+                    started = time.perf_counter()
+                    done = await asyncio.gather(*(one() for _ in range(requests)))
+                    return _summary(done, time.perf_counter() - started)
+
+            results[scenario.name] = {
+                'wsgi': wsgi_result,
+                'asgi': asyncio.run(drive()),
+                'identical': wsgi_body == asgi_body,
+            }
+    return results
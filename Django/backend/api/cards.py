@@ -0,0 +1,142 @@
+import json
+from collections import defaultdict
+from decimal import Decimal
+
+from django.conf import settings
+from django.core.cache import cache
+
+from .conditional import get_stamp
+from .models import Product, ProductImage
+from .renderers import FastJSONEncoder
+from .timing import phase
+
+# ----------------------------
+# Lean product cards
+# ----------------------------
+# values()-based equivalent of ProductSerializer for list endpoints: one
+# projection query for the products (category and rating summary joined in)
+# and one for their images, assembled into dicts with the serializer's keys in
+# the serializer's order. Rendered with renderers.LeanJsonResponse the JSON is
+# byte for byte what ProductSerializer + JsonResponse produce, without any
+# per-field DRF machinery.
+
+CENTS = Decimal('0.01')  # Product.price decimal_places
+
+PRODUCT_FIELDS = (
+    'id', 'title', 'slug', 'description', 'price', 'brand', 'stock', 'is_active', 'created_at',
+    'category_id', 'category__name', 'category__slug', 'category__description',
+    'rating_summary__count', 'rating_summary__average',
+    'rating_summary__stars_1', 'rating_summary__stars_2', 'rating_summary__stars_3',
+    'rating_summary__stars_4', 'rating_summary__stars_5',
+)
+IMAGE_FIELDS = ('id', 'product_id', 'image_url', 'alt_text', 'is_featured')
+STARS = ('1', '2', '3', '4', '5')
+
+
+def product_fields(prefix=''):
+    """PRODUCT_FIELDS as seen from a related model, e.g. prefix='product__'."""
+    return tuple(prefix + f for f in PRODUCT_FIELDS)
+
+
+def product_rows(qs, prefix=''):
+    return qs.values(*product_fields(prefix))
+
+
+def image_rows(product_ids):
+    # (product_id, id) is the order the FK index already delivers: no sort
+    return (ProductImage.objects.filter(product_id__in=product_ids)
+            .order_by('product_id', 'id').values(*IMAGE_FIELDS))
+
+
+def group_images(rows):
+    images = defaultdict(list)
+    for img in rows:
+        images[img['product_id']].append({
+            'id': img['id'],
+            'image_url': img['image_url'],
+            'alt_text': img['alt_text'],
+            'is_featured': img['is_featured'],
+        })
+    return images
+
+
+def card(row, images, prefix=''):
+    """One ProductSerializer-shaped dict from a product_rows() row."""
+    p = prefix
+    pk = row[p + 'id']
+    category = None
+    if row[p + 'category_id'] is not None:
+        category = {
+            'id': row[p + 'category_id'],
+            'name': row[p + 'category__name'],
+            'slug': row[p + 'category__slug'],
+            'description': row[p + 'category__description'],
+        }
+    if row[p + 'rating_summary__count'] is None:
+        rating = {'count': 0, 'average': 0, 'histogram': dict.fromkeys(STARS, 0)}
+    else:
+        rating = {
+            'count': row[p + 'rating_summary__count'],
+            'average': row[p + 'rating_summary__average'],
+            'histogram': {n: row[f'{p}rating_summary__stars_{n}'] for n in STARS},
+        }
+    return {
+        'id': pk,
+        'title': row[p + 'title'],
+        'slug': row[p + 'slug'],
+        'description': row[p + 'description'],
+        'price': row[p + 'price'].quantize(CENTS),
+        'brand': row[p + 'brand'],
+        'category': category,
+        'stock': row[p + 'stock'],
+        'is_active': row[p + 'is_active'],
+        'created_at': row[p + 'created_at'],
+        'images': images.get(pk, []),
+        'rating_summary': rating,
+    }
+
+
+def cards(rows, images, prefix=''):
+    with phase('serialize'):
+        grouped = group_images(images)
+        return [card(row, grouped, prefix) for row in rows]
+
+
+def load_cards(qs):
+    """Cards for every product in qs, in qs order: two queries."""
+    rows = list(product_rows(qs))
+    return cards(rows, image_rows([r['id'] for r in rows]))
+
+
+# --- Per-product card cache ---
+# Lookups by id (products/batch) keep each card's JSON in the cache, keyed by
+# product id and the category stamp: category fields are part of every card,
+# and bulk imports bump that stamp too. Writes to a product, its images, its
+# rating summary or its stock drop the product's entry on commit (signals.py,
+# inventory.py). That reaches every worker because the cache is shared
+# (settings.py requires REDIS_URL outside DEBUG); PRODUCT_CARD_TTL only bounds
+# a card refilled by a read that raced a write.
+
+def _card_key(pk, generation):
+    return f"card:{generation}:{pk}"
+
+
+def card_json(ids):
+    """{id: card JSON} for those of ids that exist: one cache multi-get, two queries for the misses."""
+    generation = get_stamp('category')[0]
+    keys = {pk: _card_key(pk, generation) for pk in ids}
+    found = cache.get_many(keys.values())
+    cached = {pk: found[key] for pk, key in keys.items() if key in found}
+    misses = [pk for pk in ids if pk not in cached]
+    if misses:
+        with phase('render'):
+            filled = {c['id']: json.dumps(c, cls=FastJSONEncoder, check_circular=False)
+                      for c in load_cards(Product.objects.filter(pk__in=misses))}
+        cache.set_many({keys[pk]: body for pk, body in filled.items()}, getattr(settings, 'PRODUCT_CARD_TTL', 300))
+        cached.update(filled)
+    return cached
+
+
+def invalidate_cards(pks):
+    generation = get_stamp('category')[0]
+    cache.delete_many([_card_key(pk, generation) for pk in pks])
@@ -0,0 +1,383 @@
+import logging
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import close_old_connections, connection, transaction
+
+from .models import Cart, CartItem, Product
+
+logger = logging.getLogger(__name__)
+
+# ----------------------------
+# Cache-backed carts (write-behind)
+# ----------------------------
+# The cart endpoints read and change carts in the Django cache instead of the
+# database: a cart is {'cart_id', 'lines': {product_id: quantity}, 'version'},
+# loaded from Cart/CartItem on first use. Every change bumps the version and
+# appends the user id to a journal kept in the cache; flushing a cart makes its
+# CartItem rows match the cached lines (one upsert, one delete) and records the
+# version it wrote, so flushing twice, or from two processes, is harmless.
+#
+# A worker thread drains the journal CART_FLUSH_DELAY seconds after a change.
+# Whatever a crashed worker left behind stays journaled in the cache until the
+# next drain by any worker or by `manage.py flush_carts`. Checkout flushes the
+# cart itself before reading it from the database.
+#
+# The cache is the source of truth for carts, so with several workers it must
+# be shared and must not evict: CART_WRITE_BEHIND is only on when REDIS_URL is
+# set. Without it carts are read from and written to the database on every
+# request, under a lock on the Cart row.
+
+LOCK_TIMEOUT = 10   # seconds before a lock left by a crashed holder expires
+LOCK_WAIT = LOCK_TIMEOUT + 1  # outlast a crashed holder's lock before giving up
+JOURNAL_BATCH = 500
+
+SEQ_KEY = 'cart_journal:seq'
+DONE_KEY = 'cart_journal:done'
+DRAIN_LOCK = 'cart_journal:lock'
+
+
+class CartBusy(Exception):
+    """The cart's lock could not be taken in time; the request should be retried."""
+
+
+def write_behind():
+    return getattr(settings, 'CART_WRITE_BEHIND', False)
+
+
+def _ttl():
+    return getattr(settings, 'CART_CACHE_TTL', 60 * 60 * 24 * 7)
+
+
+def _cart_key(user_id):
+    return f"cart:{user_id}"
+
+
+def _synced_key(user_id):
+    return f"cart_synced:{user_id}"
+
+
+def _lock_key(user_id):
+    return f"cart_lock:{user_id}"
+
+
+def _entry_key(n):
+    return f"cart_journal:{n}"
+
+
+# --- Locks (cache.add is atomic in Redis and locmem) ---
+
+def _acquire(key, wait=True):
+    deadline = time.monotonic() + LOCK_WAIT
+    token = uuid.uuid4().hex
+    while not cache.add(key, token, LOCK_TIMEOUT):
+        if not wait or time.monotonic() > deadline:
+            return None
+        time.sleep(0.001)
+    return token
+
+
+def _release(key, token):
+    if cache.get(key) == token:
+        cache.delete(key)
+
+
+class _locked:
+    def __init__(self, user_id):
+        self.key = _lock_key(user_id)
+
+    def __enter__(self):
+        self.token = _acquire(self.key)
+        if self.token is None:
+            raise CartBusy(self.key)
+
+    def __exit__(self, *exc):
+        _release(self.key, self.token)
+
+
+# --- Reading ---
+
+def _stored_lines(cart_id):
+    return dict(CartItem.objects.filter(cart_id=cart_id).order_by('id').values_list('product_id', 'quantity'))
+
+
+def _load(user_id):
+    cart, _ = Cart.objects.get_or_create(user_id=user_id)
+    return {'cart_id': cart.id, 'lines': _stored_lines(cart.id), 'version': 0}
+
+
+def get_cart(user_id):
+    """The user's cart from the cache; loaded from the database on a miss."""
+    if not write_behind():
+        return _load(user_id)
+    state = cache.get(_cart_key(user_id))
+    if state is None:
+        state = _load(user_id)
+        # add, not set: a change made meanwhile wins over what was just read
+        if cache.add(_cart_key(user_id), state, _ttl()):
+            cache.set(_synced_key(user_id), state['version'], _ttl())
+        else:
+            state = cache.get(_cart_key(user_id)) or state
+    return state
+
+
+def get_lines(user_id):
+    return get_cart(user_id)['lines']
+
+
+# --- Changing ---
+
+def change(user_id, apply):
+    """
+    Run apply(lines) on the user's cart lines under the cart's lock, store
+    the result and journal the cart for writing. Returns apply's result; if
+    it returns None the cart is left unchanged. Raises CartBusy if the lock
+    cannot be taken.
+    """
+    if not write_behind():
+        return _change_in_database(user_id, apply)
+    with _locked(user_id):
+        state = cache.get(_cart_key(user_id))
+        if state is None:
+            state = _load(user_id)
+            cache.set(_synced_key(user_id), state['version'], _ttl())
+        result = apply(state['lines'])
+        if result is None:
+            return None
+        state['version'] += 1
+        cache.set(_cart_key(user_id), state, _ttl())
+        _journal(user_id)
+    _schedule(user_id)
+    return result
+
+
+def _change_in_database(user_id, apply):
+    with transaction.atomic():
+        # The Cart row lock serializes changes to one cart across workers
+        cart, _ = Cart.objects.select_for_update().get_or_create(user_id=user_id)
+        stored = _stored_lines(cart.id)
+        lines = dict(stored)
+        result = apply(lines)
+        if result is not None:
+            _write(cart.id, lines, stored)
+    return result
+
+
+def add_line(user_id, product_id, quantity):
+    """Add quantity to a line (created if missing); returns the new quantity."""
+    def apply(lines):
+        lines[product_id] = lines.get(product_id, 0) + quantity
+        return lines[product_id]
+    return change(user_id, apply)
+
+
+def set_line(user_id, product_id, quantity):
+    """Set the quantity of an existing line; None if the cart has no such line."""
+    def apply(lines):
+        if product_id not in lines:
+            return None
+        lines[product_id] = quantity
+        return quantity
+    return change(user_id, apply)
+
+
+def remove_line(user_id, product_id):
+    """Drop a line; False if the cart has no such line."""
+    def apply(lines):
+        if product_id not in lines:
+            return None
+        del lines[product_id]
+        return True
+    return bool(change(user_id, apply))
+
+
+def apply_operations(user_id, operations):
+    """
+    Apply (op, product_id, quantity) operations in order as one change:
+    'add' adds to a line, 'set' sets it (0 drops it), 'remove' drops it.
+    Returns the resulting lines.
+    """
+    def apply(lines):
+        for op, product_id, quantity in operations:
+            if op == 'add':
+                lines[product_id] = lines.get(product_id, 0) + quantity
+            elif op == 'set' and quantity:
+                lines[product_id] = quantity
+            else:
+                lines.pop(product_id, None)
+        return dict(lines)
+    return change(user_id, apply)
+
+
+def clear(user_id):
+    def apply(lines):
+        lines.clear()
+        return True
+    return change(user_id, apply)
+
+
+@contextmanager
+def checkout(user_id):
+    """
+    Hold the user's cart still for a checkout. The cart is written to the
+    database first, so the checkout can read it from there, and no change
+    can land until the block ends. Call the yielded function once the order
+    is placed and the CartItem rows are deleted, to empty the cached cart.
+    Raises CartBusy if the lock cannot be taken.
+    """
+    if not write_behind():
+        yield lambda: None
+        return
+    with _locked(user_id):
+        _flush_locked(user_id)
+        yield lambda: _empty_locked(user_id)
+
+
+def _empty_locked(user_id):
+    state = cache.get(_cart_key(user_id))
+    if state is None:
+        return
+    state['lines'] = {}
+    state['version'] += 1
+    # Nothing left to write: the checkout deleted the rows itself
+    cache.set_many({_cart_key(user_id): state, _synced_key(user_id): state['version']}, _ttl())
+
+
+# --- Writing to the database ---
+
+def upsert_lines(cart_id, lines):
+    """Insert or update CartItem rows for {product_id: quantity} in one statement."""
+    # MySQL's ON DUPLICATE KEY UPDATE takes no conflict target
+    unique_fields = ['cart', 'product'] if connection.features.supports_update_conflicts_with_target else None
+    CartItem.objects.bulk_create(
+        [CartItem(cart_id=cart_id, product_id=pk, quantity=qty) for pk, qty in lines.items()],
+        update_conflicts=True, unique_fields=unique_fields, update_fields=['quantity'],
+    )
+
+
+def _write(cart_id, lines, stored=None):
+    """Make the cart's CartItem rows match lines; stored is what they hold now, if known."""
+    with transaction.atomic():
+        if stored is None:
+            stored = _stored_lines(cart_id)
+        gone = stored.keys() - lines.keys()
+        if gone:
+            CartItem.objects.filter(cart_id=cart_id, product_id__in=gone).delete()
+        changed = {pk: qty for pk, qty in lines.items() if stored.get(pk) != qty}
+        if changed:
+            # Products deleted since they were added would fail the foreign key
+            live = set(Product.objects.filter(pk__in=changed).values_list('pk', flat=True))
+            upsert_lines(cart_id, {pk: qty for pk, qty in changed.items() if pk in live})
+
+
+def flush(user_id):
+    """Write the user's cart to the database if it changed since the last flush; True if written."""
+    if not write_behind():
+        return False
+    with _locked(user_id):
+        return _flush_locked(user_id)
+
+
+def _flush_locked(user_id):
+    found = cache.get_many([_cart_key(user_id), _synced_key(user_id)])
+    state = found.get(_cart_key(user_id))
+    if state is None or found.get(_synced_key(user_id)) == state['version']:
+        return False
+    _write(state['cart_id'], state['lines'])
+    cache.set(_synced_key(user_id), state['version'], _ttl())
+    return True
+
+
+def _flush_logged(user_id):
+    try:
+        return flush(user_id)
+    except Exception:
+        logger.exception("Writing cart of user %s failed", user_id)
+        # Journal it again so a later drain retries instead of skipping it
+        _journal(user_id)
+        return False
+
+
+# --- Journal ---
+
+def _journal(user_id):
+    cache.add(SEQ_KEY, 0, None)
+    cache.set(_entry_key(cache.incr(SEQ_KEY)), user_id, _ttl())
+
+
+def drain():
+    """
+    Flush every cart journaled since the last drain. Returns the number of
+    carts written, or None if another process is draining.
+    """
+    if not write_behind():
+        return 0
+    token = _acquire(DRAIN_LOCK, wait=False)
+    if token is None:
+        return None
+    written = 0
+    try:
+        done, end = cache.get(DONE_KEY, 0), cache.get(SEQ_KEY, 0)
+        while done < end:
+            keys = [_entry_key(n) for n in range(done + 1, min(done + JOURNAL_BATCH, end) + 1)]
+            entries = cache.get_many(keys)
+            user_ids = set(entries.values())
+            for user_id in user_ids:
+                written += _flush_logged(user_id)
+            # An entry numbered but not yet stored when we read the batch is
+            # there by now; one still missing has expired
+            late = [k for k in keys if k not in entries]
+            if late:
+                for user_id in set(cache.get_many(late).values()) - user_ids:
+                    written += _flush_logged(user_id)
+            done += len(keys)
+            cache.set(DONE_KEY, done, None)
+            cache.delete_many(keys)
+    finally:
+        _release(DRAIN_LOCK, token)
+    return written
+
+
+# --- Background flusher ---
+
+_timer = None
+_timer_lock = threading.Lock()
+
+
+def _schedule(user_id):
+    if getattr(settings, 'CART_FLUSH_EAGER', False):
+        flush(user_id)
+        return
+    _start_timer()
+
+
+def _start_timer():
+    delay = getattr(settings, 'CART_FLUSH_DELAY', 2)
+    if delay is None:
+        return
+    global _timer
+    with _timer_lock:
+        if _timer is None:
+            _timer = threading.Timer(delay, _worker)
+            _timer.daemon = True
+            _timer.start()
+
+
+def _worker():
+    global _timer
+    with _timer_lock:
+        _timer = None
+    # Timer threads keep their own DB connections; recycle them like a request would
+    close_old_connections()
+    try:
+        if drain() is None:
+            # Another process holds the journal; make sure our changes get a later turn
+            _start_timer()
+    except Exception:
+        logger.exception("Draining the cart journal failed")
+    finally:
+        close_old_connections()
@@ -0,0 +1,118 @@
+import hashlib
+import uuid
+from functools import wraps
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import cache
+from django.utils import timezone
+from django.views.decorators.http import condition
+
+from .models import Product
+
+# ----------------------------
+# Change stamps for conditional GET
+# ----------------------------
+# A stamp is (version, changed_at) for a scope such as 'category' or
+# 'reviews:12'. Signals bump it on every write; views turn it into ETag and
+# Last-Modified headers so repeat requests get a 304 without touching the
+# serializers. Stamps live in the Django cache, so validators are only sent
+# with CONDITIONAL_GET, which settings.py turns on with the shared cache
+# (REDIS_URL): with per-process caches each worker would hold its own stamp
+# and answer the same resource with different validators. (api/cards.py
+# keys cached cards by the category stamp either way.)
+
+def _key(scope):
+    return f"stamp:{scope}"
+
+def _ttl():
+    return getattr(settings, 'CONDITIONAL_STAMP_TTL', 300)
+
+def get_stamp(scope):
+    stamp = cache.get(_key(scope))
+    if stamp is None:
+        stamp = (uuid.uuid4().hex[:12], timezone.now())
+        if not cache.add(_key(scope), stamp, _ttl()):
+            stamp = cache.get(_key(scope)) or stamp
+    return stamp
+
+def bump_stamp(scope):
+    cache.set(_key(scope), (uuid.uuid4().hex[:12], timezone.now()), _ttl())
+
+def _etag(*parts):
+    return '"%s"' % hashlib.md5('|'.join(str(p) for p in parts).encode('utf-8')).hexdigest()
+
+def _is_read(request):
+    """Whether to send validators: a GET or HEAD, with CONDITIONAL_GET on."""
+    return request.method in ('GET', 'HEAD') and getattr(settings, 'CONDITIONAL_GET', False)
+
+# --- etag_func / last_modified_func pairs for django's @condition ---
+
+def categories_etag(request, *args, **kwargs):
+    if _is_read(request):
+        return _etag('categories', request.path, get_stamp('category')[0])
+
+def categories_last_modified(request, *args, **kwargs):
+    if _is_read(request):
+        return get_stamp('category')[1]
+
+def product_list_etag(request, *args, **kwargs):
+    if _is_read(request):
+        return _etag('products', request.get_full_path(), get_stamp('product')[0], get_stamp('category')[0])
+
+def product_list_last_modified(request, *args, **kwargs):
+    if _is_read(request):
+        return max(get_stamp('product')[1], get_stamp('category')[1])
+
+def _product_updated_at(request, pk):
+    # Shared by the etag and last-modified callbacks: one query per request
+    if not hasattr(request, '_product_updated_at'):
+        request._product_updated_at = Product.objects.filter(pk=pk).values_list('updated_at', flat=True).first()
+    return request._product_updated_at
+
+def product_etag(request, pk):
+    if _is_read(request):
+        updated_at = _product_updated_at(request, pk)
+        if updated_at:
+            # The nested category is part of the payload too
+            return _etag('product', pk, updated_at.isoformat(), get_stamp('category')[0])
+
+def product_last_modified(request, pk):
+    if _is_read(request):
+        updated_at = _product_updated_at(request, pk)
+        if updated_at:
+            return max(updated_at, get_stamp('category')[1])
+
+def reviews_etag(request, product_id):
+    if _is_read(request):
+        return _etag('reviews', product_id, request.get_full_path(), get_stamp(f'reviews:{product_id}')[0])
+
+def reviews_last_modified(request, product_id):
+    if _is_read(request):
+        return get_stamp(f'reviews:{product_id}')[1]
+
+# --- async views ---
+
+def async_condition(etag_func=None, last_modified_func=None):
+    """
+    django's @condition for async views. @condition calls the validator
+    functions directly, which is not allowed on the event loop once they touch
+    the database (product_etag does), so they run in a worker thread first and
+    @condition gets the precomputed values.
+    """
+    def _validators(request, args, kwargs):
+        return (etag_func(request, *args, **kwargs) if etag_func else None,
+                last_modified_func(request, *args, **kwargs) if last_modified_func else None)
+
+    def decorator(view):
+        conditional = condition(
+            etag_func=lambda request, *args, **kwargs: request._validators[0],
+            last_modified_func=lambda request, *args, **kwargs: request._validators[1],
+        )(view)
+
+        @wraps(view)
+        async def inner(request, *args, **kwargs):
+            request._validators = await sync_to_async(_validators)(request, args, kwargs)
+            return await conditional(request, *args, **kwargs)
+        return inner
+    return decorator
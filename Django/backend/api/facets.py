@@ -0,0 +1,196 @@
+from bisect import bisect_right
+from collections import Counter, defaultdict
+
+from django.conf import settings
+
+from .indexes import InMemoryIndex
+
+# ----------------------------
+# In-process catalog facets
+# ----------------------------
+# Per-category, per-brand and price-bucket membership of every active product,
+# with running totals. Counts are "disjunctive": each facet is counted under
+# all active filters except its own, so selecting a category still shows the
+# other categories' counts. Kept current by the signals in signals.py and
+# rebuilt in the background every FACET_INDEX_TTL seconds to pick up other
+# workers' writes (api/indexes.py).
+
+DEFAULT_PRICE_BUCKETS = [0, 500, 1000, 2500, 5000, 10000, 25000]
+
+
+def _price_edges():
+    return getattr(settings, 'FACET_PRICE_BUCKETS', DEFAULT_PRICE_BUCKETS)
+
+
+class ProductFacetIndex(InMemoryIndex):
+    ttl_setting = 'FACET_INDEX_TTL'
+
+    def _reset(self):
+        self._docs = {}                       # id -> (category_id, brand, bucket, price)
+        self._by_category = defaultdict(set)
+        self._by_brand = defaultdict(set)
+        self._by_bucket = defaultdict(set)
+        self._categories = {}                 # id -> {'name', 'slug'}
+        self._built_at = None
+
+    # --- Maintenance ---
+    def _load(self):
+        from .models import Category, Product
+        for pk, name, slug in Category.objects.values_list('id', 'name', 'slug'):
+            self._categories[pk] = {'name': name, 'slug': slug}
+        rows = (Product.objects.filter(is_active=True)
+                .values_list('id', 'category_id', 'brand', 'price')
+                .iterator(chunk_size=5000))
+        for pk, category_id, brand, price in rows:
+            self._add(pk, category_id, brand, price)
+
+    def add_product(self, product):
+        if not self._tracking:
+            return
+        self._apply('_replace', product.pk, product.is_active, product.category_id, product.brand, product.price)
+
+    def remove(self, pk):
+        self._apply('_remove', pk)
+
+    def update_category(self, category):
+        if not self._tracking:
+            return
+        self._apply('_set_category', category.pk, category.name, category.slug)
+
+    def delete_category(self, pk):
+        """Products of a deleted category are SET_NULL; mirror that here."""
+        if not self._tracking:
+            return
+        self._apply('_delete_category', pk)
+
+    def _replace(self, pk, is_active, category_id, brand, price):
+        self._remove(pk)
+        if is_active:
+            self._add(pk, category_id, brand, price)
+
+    def _set_category(self, pk, name, slug):
+        self._categories[pk] = {'name': name, 'slug': slug}
+
+    def _delete_category(self, pk):
+        self._categories.pop(pk, None)
+        for doc_id in list(self._by_category.pop(pk, ())):
+            _, brand, _, price = self._docs[doc_id]
+            self._remove(doc_id)
+            self._add(doc_id, None, brand, price)
+
+    def _add(self, pk, category_id, brand, price):
+        brand = (brand or '').strip()
+        bucket = bisect_right(_price_edges(), price) - 1
+        self._docs[pk] = (category_id, brand, bucket, price)
+        self._by_category[category_id].add(pk)
+        if brand:
+            self._by_brand[brand].add(pk)
+        self._by_bucket[bucket].add(pk)
+
+    def _remove(self, pk):
+        doc = self._docs.pop(pk, None)
+        if doc is None:
+            return
+        category_id, brand, bucket, _ = doc
+        for index, key in ((self._by_category, category_id), (self._by_brand, brand), (self._by_bucket, bucket)):
+            ids = index.get(key)
+            if ids is not None:
+                ids.discard(pk)
+                if not ids:
+                    del index[key]
+
+    # --- Querying ---
+    def resolve_categories(self, values):
+        """Map ids or slugs from the query string to category ids."""
+        by_slug = {c['slug']: pk for pk, c in self._categories.items()}
+        ids = set()
+        for value in values:
+            if value.isdigit():
+                ids.add(int(value))
+            elif value in by_slug:
+                ids.add(by_slug[value])
+        return ids
+
+    def _price_set(self, min_price, max_price):
+        edges = _price_edges()
+        ids = set()
+        for bucket, members in self._by_bucket.items():
+            low = edges[bucket] if bucket >= 0 else None
+            high = edges[bucket + 1] if 0 <= bucket + 1 < len(edges) else None
+            if max_price is not None and low is not None and low > max_price:
+                continue
+            if min_price is not None and high is not None and high <= min_price:
+                continue
+            inside = ((min_price is None or (low is not None and low >= min_price))
+                      and (max_price is None or (high is not None and high <= max_price)))
+            if inside:
+                ids |= members
+            else:
+                ids.update(pk for pk in members
+                           if (min_price is None or self._docs[pk][3] >= min_price)
+                           and (max_price is None or self._docs[pk][3] <= max_price))
+        return ids
+
+    def query(self, categories=(), brands=(), min_price=None, max_price=None, candidates=None):
+        """
+        Returns (matched_ids, facets). `matched_ids` is None when nothing is
+        filtered (every active product matches). `candidates` narrows the
+        universe, e.g. to full-text search hits.
+        """
+        self.ensure_fresh()
+        with self._lock:
+            category_ids = self.resolve_categories(categories) if categories else None
+            sets = {
+                'category': (set().union(*(self._by_category.get(c, ()) for c in category_ids))
+                             if category_ids is not None else None),
+                'brand': (set().union(*(self._by_brand.get(b, ()) for b in brands))
+                          if brands else None),
+                'price': (self._price_set(min_price, max_price)
+                          if min_price is not None or max_price is not None else None),
+                'candidates': set(candidates) if candidates is not None else None,
+            }
+
+            def matching(*exclude):
+                active = [s for name, s in sets.items() if s is not None and name not in exclude]
+                if not active:
+                    return None
+                active.sort(key=len)
+                return active[0].intersection(*active[1:])
+
+            facets = {
+                'categories': self._category_counts(matching('category')),
+                'brands': self._brand_counts(matching('brand')),
+                'price': self._price_counts(matching('price')),
+            }
+            return matching(), facets
+
+    def _count(self, ids, field, totals):
+        if ids is None:
+            return {key: len(members) for key, members in totals.items()}
+        return Counter(self._docs[pk][field] for pk in ids if pk in self._docs)
+
+    def _category_counts(self, ids):
+        counts = self._count(ids, 0, self._by_category)
+        return [
+            {'id': pk, 'name': self._categories.get(pk, {}).get('name'),
+             'slug': self._categories.get(pk, {}).get('slug'), 'count': n}
+            for pk, n in sorted(counts.items(), key=lambda kv: -kv[1])
+            if pk is not None and n
+        ]
+
+    def _brand_counts(self, ids):
+        counts = self._count(ids, 1, self._by_brand)
+        return [{'value': b, 'count': n} for b, n in sorted(counts.items(), key=lambda kv: -kv[1]) if b and n]
+
+    def _price_counts(self, ids):
+        edges = _price_edges()
+        counts = self._count(ids, 2, self._by_bucket)
+        return [
+            {'min': edges[b] if b >= 0 else None,
+             'max': edges[b + 1] if b + 1 < len(edges) else None,
+             'count': counts.get(b, 0)}
+            for b in range(len(edges))
+        ]
+
+
+product_facets = ProductFacetIndex()
@@ -0,0 +1,358 @@
+import csv
+import json
+import logging
+import os
+import tempfile
+import threading
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from decimal import Decimal, InvalidOperation
+
+from django.conf import settings
+from django.db import IntegrityError, close_old_connections, connections, router, transaction
+from django.db.models import Q
+from django.utils import timezone
+from django.utils.text import slugify
+
+from .conditional import bump_stamp
+from .facets import product_facets
+from .models import Category, Product, ProductImage, ProductImportJob, ProductRating
+from .search import product_search
+
+logger = logging.getLogger(__name__)
+
+# ----------------------------
+# Bulk product import
+# ----------------------------
+# Streams CSV or JSONL supplier catalogs and upserts products by slug in
+# chunks. Only one chunk is held in memory at a time. Recognised columns:
+# title (required), slug, description, price, brand, stock, is_active,
+# category (name) and image_urls (comma separated, or a list in JSONL).
+# Existing products only take the columns the file has, and of those only the
+# non-blank cells; the rest keep their values.
+
+DEFAULT_CHUNK_SIZE = 1000
+MAX_REPORTED_ERRORS = 1000
+_price = Product._meta.get_field('price')
+MAX_PRICE = Decimal(10) ** (_price.max_digits - _price.decimal_places)  # exclusive
+MAX_STOCK = 2 ** 31 - 1  # IntegerField on every backend
+UPSERT_FIELDS = ['title', 'description', 'price', 'brand', 'category', 'stock', 'is_active', 'updated_at']
+ALWAYS_UPSERTED = {'title', 'updated_at'}
+COLUMN_FIELDS = {'description': 'description', 'price': 'price', 'brand': 'brand', 'stock': 'stock',
+                 'is_active': 'is_active', 'category': 'category', 'category_name': 'category'}
+
+
+class ImportRowError(ValueError):
+    pass
+
+
+def iter_rows(stream, fmt):
+    """Yield dict rows from a text stream without reading it all."""
+    if fmt == 'csv':
+        yield from csv.DictReader(stream)
+    elif fmt == 'jsonl':
+        for line in stream:
+            line = line.strip()
+            if line:
+                try:
+                    yield json.loads(line)
+                except json.JSONDecodeError as e:
+                    yield ImportRowError(f"Invalid JSON: {e.msg}")
+    else:
+        raise ValueError(f"Unsupported format: {fmt}")
+
+
+def detect_format(name, default='csv'):
+    name = (name or '').lower()
+    if name.endswith(('.jsonl', '.ndjson')):
+        return 'jsonl'
+    if name.endswith('.csv'):
+        return 'csv'
+    return default
+
+
+class CategoryCache:
+    """Category name -> id, loaded once and extended as new names appear."""
+
+    def __init__(self):
+        self._ids = {name.lower(): pk for pk, name in Category.objects.values_list('id', 'name')}
+
+    def resolve(self, name):
+        """The category id for a name, created if missing; raises ImportRowError."""
+        name = (name or '').strip()
+        if not name:
+            return None
+        key = name.lower()
+        if key not in self._ids:
+            self._ids[key] = self._find_or_create(name)
+        return self._ids[key]
+
+    def _find_or_create(self, name):
+        slug = slugify(name)[:Category._meta.get_field('slug').max_length]
+        if not slug or len(name) > Category._meta.get_field('name').max_length:
+            raise ImportRowError(f"Invalid category name: {name[:50]}")
+        # Names that differ only in case or punctuation share a slug: one category
+        existing = Category.objects.filter(Q(slug=slug) | Q(name__iexact=name)).values_list('id', flat=True)
+        pk = existing.first()
+        if pk is None:
+            try:
+                with transaction.atomic():
+                    pk = Category.objects.create(name=name, slug=slug, description='').pk
+            except IntegrityError:
+                # Created meanwhile by another import
+                pk = existing.first()
+                if pk is None:
+                    raise ImportRowError(f"Could not create category: {name[:50]}")
+        return pk
+
+
+def _bool(value, default=True):
+    if value in (None, ''):
+        return default
+    if isinstance(value, bool):
+        return value
+    return str(value).strip().lower() in ('1', 'true', 'yes', 'y')
+
+
+def _image_urls(value):
+    if not value:
+        return []
+    if isinstance(value, (list, tuple)):
+        return [str(v).strip() for v in value if str(v).strip()]
+    return [u.strip() for u in str(value).split(',') if u.strip()]
+
+
+def _blank(value):
+    return value is None or (isinstance(value, str) and not value.strip())
+
+
+def update_fields(row):
+    """The UPSERT_FIELDS an existing product takes from this row: its non-blank columns."""
+    present = ALWAYS_UPSERTED | {COLUMN_FIELDS[k] for k, v in row.items() if k in COLUMN_FIELDS and not _blank(v)}
+    return tuple(f for f in UPSERT_FIELDS if f in present)
+
+
+def parse_row(row, categories):
+    """Turn one input row into (Product, image_urls, update_fields) or raise ImportRowError."""
+    if isinstance(row, ImportRowError):
+        raise row
+    if not isinstance(row, dict):
+        raise ImportRowError('Row is not an object')
+    title = (row.get('title') or '').strip()
+    if not title:
+        raise ImportRowError('Title required')
+    slug = (row.get('slug') or '').strip() or slugify(title)
+    if not slug:
+        raise ImportRowError('Could not derive a slug')
+    try:
+        # A blank cell is absent: 0 for a new product, left alone on an existing one
+        price = Decimal(0 if _blank(row.get('price')) else str(row['price'])).quantize(Decimal('0.01'))
+        stock = 0 if _blank(row.get('stock')) else int(row['stock'])
+    except (InvalidOperation, ValueError):
+        raise ImportRowError('Invalid number format')
+    if not 0 <= price < MAX_PRICE:
+        raise ImportRowError('Price out of range')
+    if not 0 <= stock <= MAX_STOCK:
+        raise ImportRowError('Stock out of range')
+    product = Product(
+        title=title[:255], slug=slug[:255], description=row.get('description') or '',
+        price=price, brand=(row.get('brand') or '')[:120], stock=stock,
+        is_active=_bool(row.get('is_active')),
+        category_id=categories.resolve(row.get('category') or row.get('category_name')),
+    )
+    images = _image_urls(row.get('image_urls'))
+    if any(len(url) > ProductImage._meta.get_field('image_url').max_length for url in images):
+        raise ImportRowError('Image URL too long')
+    return product, images, update_fields(row)
+
+
+class ProductImporter:
+    def __init__(self, user=None, chunk_size=DEFAULT_CHUNK_SIZE, progress=None):
+        self.user = user
+        self.chunk_size = chunk_size
+        self.progress = progress
+        self.report = {'rows': 0, 'created': 0, 'updated': 0, 'failed': 0, 'errors': []}
+
+    def _error(self, line, message):
+        self.report['failed'] += 1
+        if len(self.report['errors']) < MAX_REPORTED_ERRORS:
+            self.report['errors'].append({'row': line, 'error': message})
+
+    def run(self, rows):
+        categories = CategoryCache()
+        chunk = {}
+        for line, row in enumerate(rows, start=1):
+            self.report['rows'] += 1
+            try:
+                product, images, fields = parse_row(row, categories)
+            except ImportRowError as e:
+                self._error(line, str(e))
+                continue
+            # A later row for the same slug wins within a chunk
+            chunk[product.slug] = (line, product, images, fields)
+            if len(chunk) >= self.chunk_size:
+                self._flush(chunk)
+                chunk = {}
+        if chunk:
+            self._flush(chunk)
+        self._after_import()
+        return self.report
+
+    def _flush(self, chunk):
+        slugs = list(chunk)
+        db = router.db_for_write(Product)
+        features = connections[db].features
+        try:
+            with transaction.atomic(using=db):
+                existing = set(Product.objects.filter(slug__in=slugs).values_list('slug', flat=True))
+                # One upsert per set of columns: a single one for a CSV file
+                groups = {}
+                for _, product, _, fields in chunk.values():
+                    if product.slug not in existing:
+                        product.created_by = self.user
+                    groups.setdefault(fields, []).append(product)
+                for fields, objs in groups.items():
+                    Product.objects.bulk_create(
+                        objs, update_conflicts=True, update_fields=fields,
+                        # MySQL resolves ON DUPLICATE KEY itself and rejects a target
+                        unique_fields=['slug'] if features.supports_update_conflicts_with_target else None,
+                    )
+                ids = dict(Product.objects.filter(slug__in=slugs).values_list('slug', 'id'))
+
+                # New products need their rating summary row (no signals here)
+                ProductRating.objects.bulk_create(
+                    [ProductRating(product_id=ids[s]) for s in slugs if s not in existing],
+                    ignore_conflicts=True,
+                )
+
+                # Rows that list images replace that product's images
+                with_images = [s for s in slugs if chunk[s][2]]
+                if with_images:
+                    # Raw delete: no per-image signals, the upsert already moved updated_at
+                    ProductImage.objects.filter(product_id__in=[ids[s] for s in with_images])._raw_delete(db)
+                    ProductImage.objects.bulk_create([
+                        ProductImage(product_id=ids[s], image_url=url)
+                        for s in with_images for url in chunk[s][2]
+                    ])
+        except Exception as e:
+            if len(chunk) == 1:
+                line = next(iter(chunk.values()))[0]
+                self._error(line, str(e))
+            else:
+                # Find the rows at fault: the others still go in, one at a time
+                for slug, entry in chunk.items():
+                    self._flush({slug: entry})
+            return
+
+        self.report['created'] += len(slugs) - len(existing)
+        self.report['updated'] += len(existing)
+        if self.progress:
+            self.progress(self.report)
+
+    def _after_import(self):
+        # bulk_create skips signals: refresh the in-process indexes and stamps
+        product_search.refresh()
+        product_facets.refresh()
+        bump_stamp('product')
+        bump_stamp('category')
+
+
+# ----------------------------
+# Background imports
+# ----------------------------
+# POST /api/products/import/ only spools the uploaded file to local disk and
+# records a ProductImportJob; a single worker thread runs the imports one at a
+# time (they upsert the same products) and saves the report after every
+# chunk. Clients poll GET /api/imports/<id>/ for the outcome.
+#
+# Imports upsert by slug, so running one again is harmless: `manage.py
+# resume_product_imports` puts jobs running for longer than
+# PRODUCT_IMPORT_STALE_AFTER back to pending and runs every pending job.
+
+_executor = None
+_executor_lock = threading.Lock()
+
+def _get_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='product-import')
+    return _executor
+
+def _spool_dir():
+    path = getattr(settings, 'PRODUCT_IMPORT_SPOOL_DIR', None) or os.path.join(tempfile.gettempdir(), 'product-import-spool')
+    os.makedirs(path, exist_ok=True)
+    return path
+
+def _spool(uploaded):
+    path = os.path.join(_spool_dir(), f"{uuid.uuid4().hex}.{detect_format(uploaded.name)}")
+    with open(path, 'wb') as out:
+        for chunk in uploaded.chunks():
+            out.write(chunk)
+    return path
+
+def enqueue_import(user, uploaded, fmt):
+    """Spool `uploaded` and queue its import once the current transaction commits. Returns the job."""
+    job = ProductImportJob.objects.create(created_by=user, spool_path=_spool(uploaded),
+                                         file_name=(uploaded.name or '')[:255], format=fmt)
+    transaction.on_commit(lambda: submit(job.pk))
+    return job
+
+def submit(job_id):
+    if getattr(settings, 'PRODUCT_IMPORT_EAGER', False):
+        run_job(job_id)
+    else:
+        _get_executor().submit(_worker, job_id)
+
+def _worker(job_id):
+    # Pool threads keep their own DB connections; recycle them like a request would
+    close_old_connections()
+    try:
+        run_job(job_id)
+    finally:
+        close_old_connections()
+
+def run_job(job_id):
+    # Claim the job so it never runs twice (e.g. when resumed after a restart)
+    claimed = (ProductImportJob.objects.filter(pk=job_id, status='pending')
+               .update(status='running', started_at=timezone.now()))
+    if not claimed:
+        return
+    job = ProductImportJob.objects.select_related('created_by').get(pk=job_id)
+
+    def progress(report):
+        ProductImportJob.objects.filter(pk=job_id).update(report=report)
+
+    try:
+        with open(job.spool_path, encoding='utf-8-sig', newline='') as f:
+            report = ProductImporter(user=job.created_by, progress=progress).run(iter_rows(f, job.format))
+        ProductImportJob.objects.filter(pk=job_id).update(status='done', report=report, finished_at=timezone.now())
+    except Exception as e:
+        logger.exception("Product import %s failed", job_id)
+        ProductImportJob.objects.filter(pk=job_id).update(status='failed', error=str(e), finished_at=timezone.now())
+    finally:
+        # Done or failed, the job is finished with its local copy
+        try:
+            os.remove(job.spool_path)
+        except OSError:
+            pass
+
+def reset_stale_jobs():
+    """Put jobs left 'running' by a dead worker back to pending; returns how many."""
+    cutoff = timezone.now() - timedelta(seconds=getattr(settings, 'PRODUCT_IMPORT_STALE_AFTER', 60 * 60))
+    stale = Q(started_at__lt=cutoff) | Q(started_at__isnull=True)
+    return ProductImportJob.objects.filter(stale, status='running').update(status='pending', started_at=None)
+
+def job_data(job):
+    return {
+        'id': job.id,
+        'file_name': job.file_name,
+        'format': job.format,
+        'status': job.status,
+        'error': job.error,
+        'report': job.report,
+        'created_at': job.created_at,
+        'started_at': job.started_at,
+        'finished_at': job.finished_at,
+    }
@@ -0,0 +1,117 @@
+import logging
+import threading
+import time
+
+from django.conf import settings
+from django.db import connections
+
+logger = logging.getLogger(__name__)
+
+# ----------------------------
+# In-process index rebuilds
+# ----------------------------
+# Shared by the search and facet indexes. The first query of a process builds
+# the index (and waits for it). After that a rebuild every `ttl_setting`
+# seconds picks up other workers' writes: it runs in a background thread that
+# loads a new copy without holding the lock, so queries keep reading the
+# current copy, and swaps it in at the end. Updates applied while a copy is
+# loading are replayed onto it before the swap, so none is lost.
+
+
+class InMemoryIndex:
+    ttl_setting = None  # setting with the seconds between rebuilds (None: never)
+
+    def __init__(self):
+        self._lock = threading.RLock()          # guards the index data
+        self._build_lock = threading.Lock()     # one load at a time
+        self._pending = None                    # [(method, args)] applied during a load
+        self._rebuilding = False
+        self._reset()
+
+    _OWN = ('_lock', '_build_lock', '_pending', '_rebuilding')
+
+    @property
+    def is_built(self):
+        return self._built_at is not None
+
+    @property
+    def _tracking(self):
+        """Whether updates matter: the index is built, or a copy is loading."""
+        return self._built_at is not None or self._pending is not None
+
+    def mark_stale(self):
+        """Drop the index: the next query builds it again, e.g. between tests."""
+        with self._lock:
+            self._reset()
+
+    def build(self):
+        """Load a new copy from the database and swap it in."""
+        with self._build_lock:
+            self._build()
+
+    def _build(self):
+        with self._lock:
+            self._pending = []
+        try:
+            fresh = type(self)()
+            fresh._load()
+            fresh._built_at = time.monotonic()
+        except BaseException:
+            with self._lock:
+                self._pending = None
+            raise
+        with self._lock:
+            for method, args in self._pending:
+                getattr(fresh, method)(*args)
+            self._pending = None
+            for name, value in vars(fresh).items():
+                if name not in self._OWN:
+                    setattr(self, name, value)
+
+    def ensure_fresh(self):
+        if not self.is_built:
+            with self._build_lock:
+                if not self.is_built:
+                    self._build()
+            return
+        ttl = getattr(settings, self.ttl_setting, 300) if self.ttl_setting else None
+        if ttl is not None and time.monotonic() - self._built_at > ttl:
+            self.refresh()
+
+    def refresh(self):
+        """
+        Rebuild in the background while queries keep reading the current copy
+        (inline with INDEX_REBUILD_EAGER). Nothing to do before the first build.
+        """
+        with self._lock:
+            if self._rebuilding or not self.is_built:
+                return
+            self._rebuilding = True
+        if getattr(settings, 'INDEX_REBUILD_EAGER', False):
+            self._rebuild()
+        else:
+            threading.Thread(target=self._rebuild_in_thread, name=f'{type(self).__name__}-rebuild',
+                             daemon=True).start()
+
+    def _rebuild(self):
+        try:
+            self.build()
+        except Exception:
+            # The current copy stays; the next query past the TTL tries again
+            logger.exception("Rebuilding the %s failed", type(self).__name__)
+        finally:
+            self._rebuilding = False
+
+    def _rebuild_in_thread(self):
+        try:
+            self._rebuild()
+        finally:
+            # The thread opened its own connections
+            connections.close_all()
+
+    def _apply(self, method, *args):
+        """Run an update (a private method) under the lock, and again on a copy being loaded."""
+        with self._lock:
+            getattr(self, method)(*args)
+            if self._pending is not None:
+                self._pending.append((method, args))
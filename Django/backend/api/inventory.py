@@ -0,0 +1,66 @@
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+
+from .cards import invalidate_cards
+from .conditional import bump_stamp
+from .models import Product
+
+# ----------------------------
+# Stock reservation at checkout
+# ----------------------------
+# Each cart line is one guarded UPDATE (stock = stock - qty WHERE stock >= qty).
+# The row lock is held only by that statement's transaction, there is no
+# global lock, and lines are always applied in product_id order so two
+# checkouts touching the same SKUs cannot deadlock.
+
+class OutOfStock(Exception):
+    def __init__(self, shortages):
+        super().__init__('Insufficient stock')
+        self.shortages = shortages
+
+    def as_dict(self):
+        return {'error': 'Insufficient stock', 'shortages': self.shortages}
+
+
+def _requested(lines):
+    wanted = {}
+    for line in lines:
+        wanted[line['product_id']] = wanted.get(line['product_id'], 0) + line['quantity']
+    return sorted(wanted.items())
+
+
+def _shortages(wanted):
+    available = dict(Product.objects.filter(pk__in=[pk for pk, _ in wanted]).values_list('pk', 'stock'))
+    return [
+        {'product_id': pk, 'requested': qty, 'available': max(available.get(pk, 0), 0)}
+        for pk, qty in wanted
+        if available.get(pk, 0) < qty
+    ]
+
+
+def reserve_stock(lines):
+    """
+    Decrement stock for every cart line or raise OutOfStock listing each
+    short line. Must run inside transaction.atomic() so a shortage on one line
+    rolls back the decrements already applied to the others.
+    """
+    wanted = _requested(lines)
+    now = timezone.now()
+    failed = [
+        (pk, qty) for pk, qty in wanted
+        if not Product.objects.filter(pk=pk, stock__gte=qty).update(stock=F('stock') - qty, updated_at=now)
+    ]
+    if failed:
+        raise OutOfStock(_shortages(failed))
+    # Stock is part of every product payload: the list stamp and the cached
+    # cards move with it (the product page follows updated_at above)
+    transaction.on_commit(lambda: bump_stamp('product'))
+    transaction.on_commit(lambda: invalidate_cards([pk for pk, _ in wanted]))
+
+
+def check_stock(lines):
+    """Read-only availability check, used before sending the shopper to pay."""
+    shortages = _shortages(_requested(lines))
+    if shortages:
+        raise OutOfStock(shortages)
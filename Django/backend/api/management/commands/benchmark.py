@@ -0,0 +1,112 @@
+import tempfile
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test.utils import override_settings, setup_test_environment, teardown_test_environment
+
+from api import benchmark
+
+
+class Command(BaseCommand):
+    help = ("Seed a throwaway test database and benchmark every API route: query count and payload "
+            "size are checked against api/benchmark_budgets.json, p50/p95 latency is reported against it.")
+
+    def add_arguments(self, parser):
+        for name, default in benchmark.DEFAULT_VOLUMES.items():
+            parser.add_argument(f'--{name}', type=int, default=default,
+                                help=f"Seed volume (default {default}{' per product' if name == 'images' else ''})")
+        parser.add_argument('--iterations', type=int, default=benchmark.DEFAULT_ITERATIONS,
+                            help="Timed requests per scenario, after one warm-up request")
+        parser.add_argument('--only', action='append', help="Scenario or URL name to run (repeatable)")
+        parser.add_argument('--update-budgets', action='store_true',
+                            help="Record this run (with headroom) as the new budgets instead of checking")
+        parser.add_argument('--fail-on-latency', action='store_true',
+                            help="Fail when a p95 latency exceeds its budget (reported only by default)")
+        parser.add_argument('--keepdb', action='store_true', help="Keep the test database afterwards")
+        parser.add_argument('--asgi', action='store_true',
+                            help="Compare WSGI and ASGI throughput on the async catalog reads instead")
+        parser.add_argument('--concurrency', type=int, default=benchmark.DEFAULT_CONCURRENCY,
+                            help="--asgi: requests in flight")
+        parser.add_argument('--threads', type=int, default=benchmark.DEFAULT_WSGI_THREADS,
+                            help="--asgi: WSGI worker threads")
+        parser.add_argument('--requests', type=int, default=benchmark.DEFAULT_REQUESTS,
+                            help="--asgi: requests per scenario and server")
+        parser.add_argument('--db-latency', type=float, default=0,
+                            help="--asgi: milliseconds added to every SQL statement (simulated network round trip)")
+
+    def handle(self, *args, **options):
+        missing = benchmark.uncovered_routes()
+        if missing:
+            raise CommandError(f"Routes without a benchmark scenario: {', '.join(missing)}")
+        volumes = {name: options[name] for name in benchmark.DEFAULT_VOLUMES}
+
+        setup_test_environment()
+        old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True, keepdb=options['keepdb'])
+        try:
+            # Uploads go to a temp dir instead of Cloudinary
+            with tempfile.TemporaryDirectory() as media, override_settings(
+                IMAGE_UPLOAD_BACKEND='api.uploads.LocalFileStorage', IMAGE_UPLOAD_EAGER=True,
+                MEDIA_ROOT=media, IMAGE_UPLOAD_SPOOL_DIR=media,
+                # Budgets describe the deployed setup, with carts in the shared cache
+                CART_WRITE_BEHIND=True,
+            ):
+                self.stdout.write(f"Seeding {connection.vendor} database: " +
+                                  ', '.join(f"{k}={v}" for k, v in volumes.items()))
+                fx = benchmark.seed(volumes)
+                if options['asgi']:
+                    results = benchmark.compare_servers(fx, options['concurrency'], options['requests'],
+                                                        options['db_latency'], options['threads'])
+                else:
+                    results = benchmark.run(fx, options['iterations'], options['only'])
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0, keepdb=options['keepdb'])
+            teardown_test_environment()
+
+        if options['asgi']:
+            return self.report_servers(results, options)
+
+        self.stdout.write(f"{'scenario':<26}{'status':>8}{'queries':>9}{'p50 ms':>10}{'p95 ms':>10}{'bytes':>10}")
+        for name, r in results.items():
+            status = ','.join(str(s) for s in r['status'])
+            self.stdout.write(f"{name:<26}{status:>8}{r['queries']:>9}{r['p50_ms']:>10}{r['p95_ms']:>10}{r['bytes']:>10}")
+
+        if options['update_budgets']:
+            if options['only']:
+                raise CommandError("--update-budgets needs a full run (drop --only)")
+            benchmark.save_budgets(results, volumes)
+            self.stdout.write(self.style.SUCCESS(f"Budgets written to {benchmark.BUDGET_FILE}"))
+            return
+
+        budgets = benchmark.load_budgets()
+        if budgets.get('volumes') != volumes:
+            self.stdout.write(self.style.WARNING(
+                "Volumes differ from the recorded budgets: only query counts and statuses are checked"))
+        failures = benchmark.check(results, budgets, volumes)
+        slow = benchmark.slow_scenarios(results, budgets, volumes)
+        for line in slow:
+            self.stdout.write(self.style.WARNING(line))
+        if options['fail_on_latency']:
+            failures += slow
+        if failures:
+            for failure in failures:
+                self.stderr.write(failure)
+            raise CommandError(f"{len(failures)} budget violation(s)")
+        self.stdout.write(self.style.SUCCESS(f"All {len(results)} scenarios within budget"
+                                             + (f" ({len(slow)} over their latency budget)" if slow else "")))
+
+
+    def report_servers(self, results, options):
+        self.stdout.write(f"{options['requests']} requests per scenario, concurrency {options['concurrency']}, "
+                          f"{options['threads']} WSGI threads, {options['db_latency']}ms added per query")
+        self.stdout.write(f"{'scenario':<20}{'server':>7}{'req/s':>9}{'p50 ms':>10}{'p95 ms':>10}{'status':>8}")
+        mismatched = []
+        for name, r in results.items():
+            for server in ('wsgi', 'asgi'):
+                m = r[server]
+                status = ','.join(str(s) for s in m['status'])
+                self.stdout.write(f"{name:<20}{server:>7}{m['rps']:>9}{m['p50_ms']:>10}{m['p95_ms']:>10}{status:>8}")
+            if not r['identical']:
+                mismatched.append(name)
+        if mismatched:
+            raise CommandError(f"ASGI and WSGI responses differ: {', '.join(mismatched)}")
+        self.stdout.write(self.style.SUCCESS("ASGI and WSGI responses are identical"))
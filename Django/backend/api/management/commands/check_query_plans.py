@@ -0,0 +1,62 @@
+import tempfile
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test.utils import override_settings, setup_test_environment, teardown_test_environment
+
+from api import benchmark, query_plans
+
+
+class Command(BaseCommand):
+    help = ("EXPLAIN the main query of each hot view and fail if a plan scans a whole table "
+            "or sorts rows an index should deliver in order (api/query_plans.py).")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--live', action='store_true',
+                            help="Explain against the configured database instead of a seeded test database")
+        for name, default in benchmark.DEFAULT_VOLUMES.items():
+            parser.add_argument(f'--{name}', type=int, default=default,
+                                help=f"Seed volume (default {default}{' per product' if name == 'images' else ''})")
+        parser.add_argument('--only', action='append', help="Check name to run (repeatable)")
+        parser.add_argument('--plans', action='store_true', help="Print every plan, not just failing ones")
+
+    def handle(self, *args, **options):
+        if not query_plans.supported():
+            self.stdout.write(self.style.WARNING(
+                f"No query plan reader for {connection.vendor} (supported: {', '.join(query_plans.READERS)}); "
+                "plan checks skipped"))
+            return
+        if options['live']:
+            results = query_plans.run(options['only'])
+        else:
+            results = self.seeded_run(options)
+
+        failures = 0
+        for name, r in results.items():
+            problems = ', '.join(f"{kind} {table or ''}".strip() for kind, table in r['problems'])
+            self.stdout.write(f"{name:<24}{problems or 'ok'}")
+            if r['problems'] or options['plans']:
+                for line in r['plan'].splitlines():
+                    self.stdout.write(f"    {line}")
+            failures += bool(r['problems'])
+        if failures:
+            raise CommandError(f"{failures} query plan regression(s) on {connection.vendor}")
+        self.stdout.write(self.style.SUCCESS(f"All {len(results)} plans use indexes ({connection.vendor})"))
+
+    def seeded_run(self, options):
+        # Planners pick differently on empty tables: plan against realistic volumes
+        volumes = {name: options[name] for name in benchmark.DEFAULT_VOLUMES}
+        setup_test_environment()
+        old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True)
+        try:
+            with tempfile.TemporaryDirectory() as media, override_settings(
+                IMAGE_UPLOAD_BACKEND='api.uploads.LocalFileStorage', IMAGE_UPLOAD_EAGER=True,
+                MEDIA_ROOT=media, IMAGE_UPLOAD_SPOOL_DIR=media,
+            ):
+                self.stdout.write(f"Seeding {connection.vendor} database: " +
+                                  ', '.join(f"{k}={v}" for k, v in volumes.items()))
+                benchmark.seed(volumes)
+                return query_plans.run(options['only'])
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+            teardown_test_environment()
@@ -0,0 +1,13 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from api.carts import drain
+
+
+class Command(BaseCommand):
+    help = "Write carts changed in the cache to the database (e.g. after a worker crash); safe to run from cron."
+
+    def handle(self, *args, **options):
+        written = drain()
+        if written is None:
+            raise CommandError("Another process is draining the cart journal")
+        self.stdout.write(self.style.SUCCESS(f"Wrote {written} carts"))
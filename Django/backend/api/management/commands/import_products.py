@@ -0,0 +1,44 @@
+import sys
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+
+from api.importer import DEFAULT_CHUNK_SIZE, ProductImporter, detect_format, iter_rows
+
+
+class Command(BaseCommand):
+    help = "Stream a CSV or JSONL supplier catalog into Product, upserting by slug."
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help="CSV or JSONL file ('-' for stdin)")
+        parser.add_argument('--format', choices=['csv', 'jsonl'], help="Defaults to the file extension")
+        parser.add_argument('--chunk-size', type=int, default=DEFAULT_CHUNK_SIZE)
+        parser.add_argument('--user', help="Username recorded as created_by on new products")
+
+    def handle(self, *args, **options):
+        user = None
+        if options['user']:
+            user = User.objects.filter(username=options['user']).first()
+            if not user:
+                raise CommandError(f"Unknown user {options['user']}")
+
+        def progress(report):
+            self.stdout.write(
+                f"{report['rows']} rows: {report['created']} created, "
+                f"{report['updated']} updated, {report['failed']} failed"
+            )
+
+        fmt = options['format'] or detect_format(options['path'])
+        importer = ProductImporter(user=user, chunk_size=options['chunk_size'], progress=progress)
+        if options['path'] == '-':
+            report = importer.run(iter_rows(sys.stdin, fmt))
+        else:
+            with open(options['path'], encoding='utf-8-sig', newline='') as f:
+                report = importer.run(iter_rows(f, fmt))
+
+        for error in report['errors']:
+            self.stderr.write(f"row {error['row']}: {error['error']}")
+        self.stdout.write(self.style.SUCCESS(
+            f"Done: {report['rows']} rows, {report['created']} created, "
+            f"{report['updated']} updated, {report['failed']} failed"
+        ))
@@ -0,0 +1,27 @@
+import datetime
+
+from django.core.management.base import BaseCommand, CommandError
+
+from api.analytics import rebuild
+
+
+def _date(value):
+    try:
+        return datetime.date.fromisoformat(value)
+    except ValueError:
+        raise CommandError(f"Invalid date {value!r}, expected YYYY-MM-DD")
+
+
+class Command(BaseCommand):
+    help = "Recompute the daily sales rollups from OrderItem (all history, or a date range)."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--from', dest='start', type=_date, help="First day to rebuild (YYYY-MM-DD)")
+        parser.add_argument('--to', dest='end', type=_date, help="Last day to rebuild (YYYY-MM-DD)")
+
+    def handle(self, *args, **options):
+        start, end = options['start'], options['end']
+        if start and end and start > end:
+            raise CommandError("--from must not be after --to")
+        days, rows = rebuild(start, end)
+        self.stdout.write(self.style.SUCCESS(f"Rebuilt {days} days, {rows} product-day rows"))
@@ -0,0 +1,22 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from api.replicas import beat
+
+
+class Command(BaseCommand):
+    help = "Stamp the primary's heartbeat row that replica lag is measured against."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--loop', action='store_true',
+                            help="Keep beating every REPLICA_CHECK_INTERVAL seconds (run one per deployment)")
+
+    def handle(self, *args, **options):
+        while True:
+            beat()
+            if not options['loop']:
+                break
+            time.sleep(getattr(settings, 'REPLICA_CHECK_INTERVAL', None) or 5)
+        self.stdout.write(self.style.SUCCESS("Heartbeat written"))
@@ -0,0 +1,19 @@
+from django.core.management.base import BaseCommand
+
+from api.models import ImageUploadJob
+from api.uploads import remove_orphaned_spool_files, reset_stale_jobs, run_job
+
+
+class Command(BaseCommand):
+    help = "Run image upload jobs left pending or stuck running (e.g. after a worker crash) and clean the spool."
+
+    def handle(self, *args, **options):
+        reset = reset_stale_jobs()
+        ids = list(ImageUploadJob.objects.filter(status='pending').values_list('pk', flat=True))
+        for job_id in ids:
+            run_job(job_id)
+        done = ImageUploadJob.objects.filter(pk__in=ids, status='done').count()
+        removed = remove_orphaned_spool_files()
+        self.stdout.write(self.style.SUCCESS(
+            f"Processed {len(ids)} pending jobs ({reset} stuck running), {done} uploaded; "
+            f"removed {removed} orphaned spool files"))
@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand
+
+from api.importer import reset_stale_jobs, run_job
+from api.models import ProductImportJob
+
+
+class Command(BaseCommand):
+    help = "Run product import jobs left pending or stuck running (e.g. after a worker crash)."
+
+    def handle(self, *args, **options):
+        reset = reset_stale_jobs()
+        ids = list(ProductImportJob.objects.filter(status='pending').values_list('pk', flat=True))
+        for job_id in ids:
+            run_job(job_id)
+        done = ProductImportJob.objects.filter(pk__in=ids, status='done').count()
+        self.stdout.write(self.style.SUCCESS(
+            f"Processed {len(ids)} pending imports ({reset} stuck running), {done} imported"))
@@ -0,0 +1,100 @@
+import os
+import time
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from prometheus_client import CONTENT_TYPE_LATEST, CollectorRegistry, Counter, Gauge, Histogram, generate_latest
+from prometheus_client import REGISTRY, multiprocess
+
+from .timing import observe_queries
+
+# ----------------------------
+# Prometheus metrics
+# ----------------------------
+# Per-view request counts, latency and DB query histograms (MetricsMiddleware)
+# plus business counters incremented by the views. Served at /api/_metrics.
+#
+# With several worker processes (gunicorn), point PROMETHEUS_MULTIPROC_DIR at
+# an empty, writable directory before the workers start: every process then
+# writes its samples to its own mmap'd file, without cross-process locks, and
+# the endpoint merges all files on scrape. Clear the directory on deploy.
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100, 250)
+METHODS = {'GET', 'HEAD', 'POST', 'PUT', 'PATCH', 'DELETE', 'OPTIONS'}
+
+REQUESTS = Counter('api_requests_total', 'HTTP requests by view, method and status',
+                   ['view', 'method', 'status'])
+LATENCY = Histogram('api_request_duration_seconds', 'Request latency by view',
+                    ['view'], buckets=LATENCY_BUCKETS)
+DB_QUERIES = Histogram('api_request_db_queries', 'SQL statements per request by view',
+                       ['view'], buckets=QUERY_BUCKETS)
+
+ORDERS_CREATED = Counter('shop_orders_created_total', 'Orders created', ['source'])  # checkout | payu
+PAYU_CALLBACKS = Counter('shop_payu_callbacks_total', 'PayU success callbacks by outcome', ['outcome'])
+CART_ADDS = Counter('shop_cart_adds_total', 'Products added to carts')
+PAID_OUT_OF_STOCK = Counter('shop_paid_out_of_stock_total', 'Paid PayU transactions left without an order for lack of stock (to refund)')
+
+# Set by the replica health checks (replicas.py)
+REPLICA_LAG = Gauge('db_replica_lag_seconds', 'Replication lag by replica alias', ['alias'],
+                    multiprocess_mode='livemax')
+REPLICA_HEALTHY = Gauge('db_replica_healthy', '1 while the replica is in rotation', ['alias'],
+                        multiprocess_mode='livemin')
+
+
+def render():
+    """(body, content type) for a scrape, merged across processes when configured."""
+    if os.environ.get('PROMETHEUS_MULTIPROC_DIR'):
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = REGISTRY
+    return generate_latest(registry), CONTENT_TYPE_LATEST
+
+
+class _QueryCounter:
+    def __init__(self):
+        self.count = 0
+
+    def __call__(self, sql, elapsed):
+        self.count += 1
+
+
+class MetricsMiddleware:
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        if not getattr(settings, 'METRICS_ENABLED', True):
+            return self.get_response(request)
+        queries = _QueryCounter()
+        started = time.perf_counter()
+        with observe_queries(queries):
+            response = self.get_response(request)
+        return self._record(request, response, time.perf_counter() - started, queries.count)
+
+    async def __acall__(self, request):
+        if not getattr(settings, 'METRICS_ENABLED', True):
+            return await self.get_response(request)
+        queries = _QueryCounter()
+        started = time.perf_counter()
+        with observe_queries(queries):
+            response = await self.get_response(request)
+        return self._record(request, response, time.perf_counter() - started, queries.count)
+
+    def _record(self, request, response, elapsed, query_count):
+        # URL names keep the label set bounded; anything unrouted shares one label
+        match = request.resolver_match
+        view = match.url_name if match and match.url_name else 'unmatched'
+        method = request.method if request.method in METHODS else 'OTHER'
+        REQUESTS.labels(view, method, str(response.status_code)).inc()
+        LATENCY.labels(view).observe(elapsed)
+        DB_QUERIES.labels(view).observe(query_count)
+        return response
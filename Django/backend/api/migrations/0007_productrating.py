@@ -0,0 +1,49 @@
+# Generated by Django 5.2.8 on 2026-10-18 18:16
+
+import django.db.models.deletion
+from django.db import migrations, models
+from django.db.models import Count, Q, Sum
+
+
+def backfill_ratings(apps, schema_editor):
+    Product = apps.get_model('api', 'Product')
+    ProductRating = apps.get_model('api', 'ProductRating')
+    stars = {f'stars_{n}': Count('reviews', filter=Q(reviews__rating=n)) for n in range(1, 6)}
+    rows = Product.objects.annotate(n=Count('reviews'), s=Sum('reviews__rating'), **stars).iterator(chunk_size=2000)
+    batch = []
+    for p in rows:
+        total = p.s or 0
+        batch.append(ProductRating(
+            product_id=p.pk, count=p.n, total=total,
+            average=round(total / p.n, 2) if p.n else 0,
+            **{f'stars_{n}': getattr(p, f'stars_{n}') for n in range(1, 6)},
+        ))
+        if len(batch) >= 2000:
+            ProductRating.objects.bulk_create(batch)
+            batch = []
+    ProductRating.objects.bulk_create(batch)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0006_product_updated_at'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ProductRating',
+            fields=[
+                ('product', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='rating_summary', serialize=False, to='api.product')),
+                ('count', models.PositiveIntegerField(default=0)),
+                ('total', models.PositiveIntegerField(default=0)),
+                ('average', models.FloatField(db_index=True, default=0)),
+                ('stars_1', models.PositiveIntegerField(default=0)),
+                ('stars_2', models.PositiveIntegerField(default=0)),
+                ('stars_3', models.PositiveIntegerField(default=0)),
+                ('stars_4', models.PositiveIntegerField(default=0)),
+                ('stars_5', models.PositiveIntegerField(default=0)),
+            ],
+        ),
+        migrations.RunPython(backfill_ratings, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,24 @@
+# Generated by Django 5.2.8 on 2026-10-18 18:19
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0008_review_sorting'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PaymentCallback',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('txnid', models.CharField(max_length=100, unique=True)),
+                ('status', models.CharField(choices=[('processed', 'Processed'), ('out_of_stock', 'Out of stock')], default='processed', max_length=20)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('order', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='payment_callbacks', to='api.order')),
+            ],
+        ),
+    ]
@@ -20,10 +20,55 @@ class Product(models.Model):
     stock = models.IntegerField(default=0)
     is_active = models.BooleanField(default=True)
     created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        # Back the keyset orderings used by the public catalog
+        indexes = [
+            models.Index(fields=['is_active', '-created_at', '-id'], name='product_active_recent_idx'),
+            models.Index(fields=['is_active', 'price', 'id'], name='product_active_price_idx'),
+            # Admin "my products", newest first
+            models.Index(fields=['created_by', '-created_at'], name='product_owner_recent_idx'),
+        ]
 
     def __str__(self):
         return self.title
 
+class ProductRating(models.Model):
+    """
+    Denormalized review aggregate, kept in step with Review writes by the
+    signals in signals.py so catalog pages never have to load reviews.
+    """
+    product = models.OneToOneField(Product, related_name='rating_summary', on_delete=models.CASCADE, primary_key=True)
+    count = models.PositiveIntegerField(default=0)
+    total = models.PositiveIntegerField(default=0)
+    average = models.FloatField(default=0, db_index=True)
+    stars_1 = models.PositiveIntegerField(default=0)
+    stars_2 = models.PositiveIntegerField(default=0)
+    stars_3 = models.PositiveIntegerField(default=0)
+    stars_4 = models.PositiveIntegerField(default=0)
+    stars_5 = models.PositiveIntegerField(default=0)
+
+    def apply(self, removed=None, added=None):
+        """Move one review's rating out of and/or into the aggregate."""
+        if removed is not None:
+            self.count -= 1
+            self.total -= removed
+            if 1 <= removed <= 5:
+                setattr(self, f'stars_{removed}', getattr(self, f'stars_{removed}') - 1)
+        if added is not None:
+            self.count += 1
+            self.total += added
+            if 1 <= added <= 5:
+                setattr(self, f'stars_{added}', getattr(self, f'stars_{added}') + 1)
+        self.average = round(self.total / self.count, 2) if self.count else 0
+
+    def histogram(self):
+        return {str(n): getattr(self, f'stars_{n}') for n in range(1, 6)}
+
+    def __str__(self):
+        return f"{self.product_id} rating"
+
 class ProductImage(models.Model):
     product = models.ForeignKey(Product, related_name='images', on_delete=models.CASCADE)
     image_url = models.URLField()
@@ -33,10 +78,49 @@ class ProductImage(models.Model):
     def __str__(self):
         return f"{self.product.title} image"
 
+UPLOAD_JOB_STATUS_CHOICES = [
+    ('pending', 'Pending'),
+    ('running', 'Running'),
+    ('done', 'Done'),
+    ('failed', 'Failed'),
+]
+
+class ImageUploadJob(models.Model):
+    """A product image waiting to be pushed to storage by the upload workers."""
+    product = models.ForeignKey(Product, related_name='upload_jobs', on_delete=models.CASCADE)
+    spool_path = models.CharField(max_length=500)  # local copy of the uploaded file
+    file_name = models.CharField(max_length=255, blank=True)
+    status = models.CharField(max_length=20, choices=UPLOAD_JOB_STATUS_CHOICES, default='pending', db_index=True)
+    error = models.TextField(blank=True)
+    image = models.ForeignKey(ProductImage, on_delete=models.SET_NULL, null=True, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(null=True, blank=True)  # when a worker claimed it
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    def __str__(self):
+        return f"Upload {self.id} ({self.status})"
+
+class ProductImportJob(models.Model):
+    """An uploaded catalog file waiting to be imported by the import worker."""
+    created_by = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True)
+    spool_path = models.CharField(max_length=500)  # local copy of the uploaded file
+    file_name = models.CharField(max_length=255, blank=True)
+    format = models.CharField(max_length=10)  # 'csv' or 'jsonl'
+    status = models.CharField(max_length=20, choices=UPLOAD_JOB_STATUS_CHOICES, default='pending', db_index=True)
+    error = models.TextField(blank=True)
+    report = models.JSONField(null=True, blank=True)  # ProductImporter's report, updated per chunk
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(null=True, blank=True)  # when a worker claimed it
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    def __str__(self):
+        return f"Import {self.id} ({self.status})"
+
 class UserProfile(models.Model):
     user = models.OneToOneField(User, on_delete=models.CASCADE, related_name='profile')
     phone = models.CharField(max_length=30, blank=True)
     is_verified = models.BooleanField(default=False)
+    token_version = models.PositiveIntegerField(default=0)  # bump to revoke every issued JWT
 
     def __str__(self):
         return self.user.username
@@ -61,7 +145,7 @@ class Cart(models.Model):
     updated_at = models.DateTimeField(auto_now=True)
 
     def total_items(self):
-        return sum([item.quantity for item in self.items.all()])
+        return self.items.aggregate(total=models.Sum('quantity'))['total'] or 0
 
 class CartItem(models.Model):
     cart = models.ForeignKey(Cart, related_name='items', on_delete=models.CASCADE)
@@ -108,9 +192,31 @@ class Order(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     payment_id = models.CharField(max_length=255, blank=True)  # store gateway payment id if any
 
+    class Meta:
+        # Keyset order history per customer
+        indexes = [models.Index(fields=['user', '-created_at', '-id'], name='order_user_recent_idx')]
+
     def __str__(self):
         return f"Order {self.id} - {self.user.username}"
 
+PAYMENT_CALLBACK_STATUS_CHOICES = [
+    ('processed', 'Processed'),
+    ('out_of_stock', 'Out of stock'),
+]
+
+class PaymentCallback(models.Model):
+    """
+    One row per gateway transaction id. The unique txnid makes retried or
+    concurrent PayU callbacks idempotent: only the first one creates an order.
+    """
+    txnid = models.CharField(max_length=100, unique=True)
+    order = models.ForeignKey(Order, related_name='payment_callbacks', on_delete=models.SET_NULL, null=True, blank=True)
+    status = models.CharField(max_length=20, choices=PAYMENT_CALLBACK_STATUS_CHOICES, default='processed')
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"{self.txnid} ({self.status})"
+
 class OrderItem(models.Model):
     order = models.ForeignKey(Order, related_name='order_items', on_delete=models.CASCADE)
     product = models.ForeignKey(Product, on_delete=models.SET_NULL, null=True)
@@ -120,6 +226,35 @@ class OrderItem(models.Model):
     def line_total(self):
         return self.unit_price * self.quantity
 
+# Sales rollups (api/analytics.py). Ids are kept without FK constraints so the
+# history survives deleted products, categories and sellers.
+
+class DailySales(models.Model):
+    day = models.DateField(unique=True)
+    orders = models.IntegerField(default=0)
+    units = models.IntegerField(default=0)
+    revenue = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+
+    def __str__(self):
+        return f"{self.day}: {self.revenue}"
+
+class DailyProductSales(models.Model):
+    day = models.DateField()
+    product = models.ForeignKey(Product, related_name='+', on_delete=models.DO_NOTHING, db_constraint=False)
+    category = models.ForeignKey(Category, related_name='+', on_delete=models.DO_NOTHING, db_constraint=False, null=True)
+    seller = models.ForeignKey(User, related_name='+', on_delete=models.DO_NOTHING, db_constraint=False, null=True)
+    orders = models.IntegerField(default=0)
+    units = models.IntegerField(default=0)
+    revenue = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+
+    class Meta:
+        unique_together = ('day', 'product')
+        # Date-range breakdowns by category and by seller
+        indexes = [
+            models.Index(fields=['day', 'category'], name='sales_day_category_idx'),
+            models.Index(fields=['day', 'seller'], name='sales_day_seller_idx'),
+        ]
+
 class Review(models.Model):
     product = models.ForeignKey(Product, related_name='reviews', on_delete=models.CASCADE)
     user = models.ForeignKey(User, related_name='reviews', on_delete=models.CASCADE)
@@ -127,6 +262,28 @@ class Review(models.Model):
     title = models.CharField(max_length=200, blank=True)
     body = models.TextField(blank=True)
     created_at = models.DateTimeField(auto_now_add=True)
+    helpful_count = models.PositiveIntegerField(default=0)
 
     class Meta:
         unique_together = ('product', 'user')
+        # One per product_reviews sort mode
+        indexes = [
+            models.Index(fields=['product', '-created_at', '-id'], name='review_product_recent_idx'),
+            models.Index(fields=['product', 'rating', 'id'], name='review_product_rating_idx'),
+            models.Index(fields=['product', '-helpful_count', '-id'], name='review_product_helpful_idx'),
+        ]
+
+class ReviewVote(models.Model):
+    review = models.ForeignKey(Review, related_name='votes', on_delete=models.CASCADE)
+    user = models.ForeignKey(User, related_name='review_votes', on_delete=models.CASCADE)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        unique_together = ('review', 'user')
+
+class ReplicaHeartbeat(models.Model):
+    """
+    A single row the primary stamps periodically; how old a replica's copy is
+    gives its replication lag (see replicas.py).
+    """
+    beat_at = models.DateTimeField()
@@ -0,0 +1,151 @@
+import base64
+import json
+import math
+
+from django.core.exceptions import ValidationError
+from django.db.models import Q
+
+# ----------------------------
+# Keyset (cursor) pagination
+# ----------------------------
+DEFAULT_PAGE_SIZE = 24
+MAX_PAGE_SIZE = 100
+
+
+class InvalidCursor(ValueError):
+    pass
+
+
+def get_page_size(request, default=DEFAULT_PAGE_SIZE, maximum=MAX_PAGE_SIZE):
+    """
+    Read ?limit= from the query string, clamped to 1..maximum.
+    Bad values fall back to the default instead of failing the request.
+    """
+    try:
+        limit = int(request.GET.get('limit', default))
+    except (TypeError, ValueError):
+        return default
+    return max(1, min(limit, maximum))
+
+
+def encode_cursor(values):
+    raw = json.dumps([str(v) for v in values]).encode('utf-8')
+    return base64.urlsafe_b64encode(raw).decode('ascii').rstrip('=')
+
+
+def decode_cursor(cursor, size):
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        values = json.loads(base64.urlsafe_b64decode(padded.encode('ascii')))
+    except (ValueError, TypeError):
+        raise InvalidCursor('Invalid cursor')
+    if not isinstance(values, list) or len(values) != size:
+        raise InvalidCursor('Invalid cursor')
+    return values
+
+
+def _field(model, path):
+    """The model field at the end of a lookup path such as 'rating_summary__average'."""
+    for name in path.split('__'):
+        field = model._meta.get_field(name)
+        model = field.related_model
+    return field
+
+
+def _cursor_values(model, ordering, cursor):
+    """Decode a cursor into values of the ordering's field types; raises InvalidCursor."""
+    values = []
+    for (path, _), raw in zip(ordering, decode_cursor(cursor, len(ordering))):
+        field = _field(model, path)
+        if not isinstance(raw, str):
+            raise InvalidCursor('Invalid cursor')
+        try:
+            value = (field.target_field if field.is_relation else field).to_python(raw)
+        except ValidationError:
+            raise InvalidCursor('Invalid cursor')
+        if value is None or (isinstance(value, float) and not math.isfinite(value)):
+            raise InvalidCursor('Invalid cursor')
+        values.append(value)
+    return values
+
+
+def _after(ordering, values):
+    """
+    Build the "strictly after this row" filter for an ordering such as
+    [('created_at', True), ('id', True)] (field, descending):
+        created_at < v0 OR (created_at = v0 AND id < v1)
+    """
+    condition = Q()
+    for i, (field, descending) in enumerate(ordering):
+        lookup = f"{field}__lt" if descending else f"{field}__gt"
+        branch = Q(**{lookup: values[i]})
+        for j in range(i):
+            branch &= Q(**{ordering[j][0]: values[j]})
+        condition |= branch
+    return condition
+
+
+def _page_query(qs, ordering, cursor, limit):
+    order_by = [f"-{f}" if desc else f for f, desc in ordering]
+    qs = qs.order_by(*order_by)
+    if cursor:
+        qs = qs.filter(_after(ordering, _cursor_values(qs.model, ordering, cursor)))
+    return qs[:limit + 1]
+
+
+def keyset_paginate(qs, ordering, cursor=None, limit=DEFAULT_PAGE_SIZE):
+    """
+    Return (rows, next_cursor) for one page of `qs`.
+
+    `ordering` must end in a unique column (normally 'id') so that every row
+    has a stable position. Only `limit + 1` rows are fetched no matter how
+    deep the client pages, so cost stays flat as the table grows.
+    """
+    rows = list(_page_query(qs, ordering, cursor, limit))
+    return _page(rows, ordering, limit)
+
+
+async def akeyset_paginate(qs, ordering, cursor=None, limit=DEFAULT_PAGE_SIZE):
+    """keyset_paginate() for async views, fetching through the async ORM."""
+    rows = [row async for row in _page_query(qs, ordering, cursor, limit)]
+    return _page(rows, ordering, limit)
+
+
+def _page(rows, ordering, limit):
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        last = rows[-1]
+        next_cursor = encode_cursor([_value(last, f) for f, _ in ordering])
+    return rows, next_cursor
+
+
+def _value(row, field):
+    if isinstance(row, dict):
+        return row[field]
+    for part in field.split('__'):
+        row = getattr(row, part)
+    return row
+
+
+def paginate_ranked(ranked, cursor=None, limit=DEFAULT_PAGE_SIZE):
+    """
+    Page through an in-memory [(score, id)] list sorted best first, e.g.
+    search results. The cursor is the (score, id) of the last row served.
+    """
+    start = 0
+    if cursor:
+        score, pk = decode_cursor(cursor, 2)
+        try:
+            last = (float(score), int(pk))
+        except (TypeError, ValueError):
+            raise InvalidCursor('Invalid cursor')
+        if not math.isfinite(last[0]):
+            raise InvalidCursor('Invalid cursor')
+        while start < len(ranked) and ranked[start] >= last:
+            start += 1
+    page = ranked[start:start + limit]
+    next_cursor = None
+    if start + limit < len(ranked):
+        next_cursor = encode_cursor(page[-1])
+    return [pk for _, pk in page], next_cursor
@@ -0,0 +1,71 @@
+from decimal import Decimal
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Count, F, Sum
+
+from . import carts
+from .models import CartItem, Product
+
+# ----------------------------
+# Cart pricing
+# ----------------------------
+# Every place that needs cart totals goes through here so they all price the
+# cart the same way and with a single query.
+
+def summarize(lines, prices):
+    """
+    {'lines', 'items', 'subtotal'} for {product_id: quantity} lines priced
+    from {product_id: price}; lines whose product is gone are left out.
+    """
+    lines = {pk: qty for pk, qty in lines.items() if pk in prices}
+    subtotal = sum((prices[pk] * qty for pk, qty in lines.items()), Decimal('0.00'))
+    return {
+        'lines': len(lines),
+        'items': sum(lines.values()),
+        'subtotal': Decimal(subtotal).quantize(Decimal('0.01')),
+    }
+
+def cart_summary(user_id):
+    """Summary of the user's cart (held by carts.py) from one query."""
+    if carts.write_behind():
+        # The cache holds the cart, ahead of its rows: price the cached lines
+        lines = carts.get_lines(user_id)
+        prices = dict(Product.objects.filter(pk__in=lines).values_list('id', 'price')) if lines else {}
+        return summarize(lines, prices)
+    totals = CartItem.objects.filter(cart__user_id=user_id).aggregate(
+        subtotal=Sum(F('quantity') * F('product__price')), items=Sum('quantity'), lines=Count('id'))
+    return {
+        'lines': totals['lines'],
+        'items': totals['items'] or 0,
+        'subtotal': Decimal(totals['subtotal'] or 0).quantize(Decimal('0.01')),
+    }
+
+def cart_lines(cart):
+    """
+    Cart lines with current unit prices plus their total, from one query.
+    Returns (lines, total) where each line is a dict with product_id,
+    quantity and unit_price.
+    """
+    lines = list(CartItem.objects.filter(cart=cart)
+                 .values('id', 'product_id', 'quantity', unit_price=F('product__price'))
+                 .order_by('product_id'))
+    total = sum((line['unit_price'] * line['quantity'] for line in lines), Decimal('0.00'))
+    return lines, total
+
+# --- Cached summary for the header badge ---
+
+def _summary_key(user_id):
+    return f"cart_summary:{user_id}"
+
+def cached_cart_summary(user_id):
+    key = _summary_key(user_id)
+    summary = cache.get(key)
+    if summary is None:
+        summary = cart_summary(user_id)
+        cache.set(key, summary, getattr(settings, 'CART_SUMMARY_TTL', 300))
+    return summary
+
+def invalidate_cart_summary(user_id):
+    """Call after any write to the user's cart lines."""
+    cache.delete(_summary_key(user_id))
@@ -0,0 +1,169 @@
+import json
+import logging
+import re
+from collections import namedtuple
+from decimal import Decimal
+
+from django.db import connection
+
+from .analytics import default_range
+from .cards import image_rows, product_rows
+from .models import (CartItem, DailyProductSales, DailySales, ImageUploadJob, Order, OrderItem,
+                     PaymentCallback, Product, WishlistItem)
+from .views import ACTIVE, ORDER_FIELDS, PRODUCT_SORTS, REVIEW_SORTS, _review_rows
+
+logger = logging.getLogger(__name__)
+
+# ----------------------------
+# Query-plan regression checks
+# ----------------------------
+# The main query of each hot view, built the way the view builds it, run
+# through EXPLAIN. A plan that reads a whole table, or sorts rows an index
+# should have delivered in order, is a regression: usually an index that a
+# migration dropped or a filter the view no longer matches. Entry point:
+# `manage.py check_query_plans` (and api/tests.py).
+
+PlanCheck = namedtuple('PlanCheck', 'name build allow')  # allow: tables that may be scanned, or 'sort'
+
+PAGE = 25
+
+
+def _first(model, **filters):
+    """An existing primary key, so lookups are planned against real rows."""
+    return model.objects.filter(**filters).values_list('pk', flat=True).order_by('pk').first() or 1
+
+
+def _catalog(sort, **filters):
+    qs = Product.objects.filter(ACTIVE, **filters)
+    order_by = [f"-{f}" if desc else f for f, desc in PRODUCT_SORTS[sort]]
+    return product_rows(qs).order_by(*order_by)[:PAGE]
+
+
+def _reviews(sort):
+    order_by = [f"-{f}" if desc else f for f, desc in REVIEW_SORTS[sort]]
+    return _review_rows(_first(Product)).order_by(*order_by)[:PAGE]
+
+
+CHECKS = [
+    # Catalog
+    PlanCheck('catalog newest', lambda: _catalog('newest'), ()),
+    PlanCheck('catalog by price', lambda: _catalog('price_asc', price__gte=Decimal('500')), ()),
+    # The average lives on ProductRating, so this order cannot come from a
+    # product index: a known sort over the active catalog
+    PlanCheck('catalog by rating', lambda: _catalog('rating'), ('sort',)),
+    # Several categories merge into one ordering: a sort of the matching rows only
+    PlanCheck('catalog category', lambda: _catalog('newest', category_id__in=[1, 2]), ('sort',)),
+    PlanCheck('product images', lambda: image_rows(list(range(1, PAGE + 1))), ()),
+    PlanCheck('my products', lambda: product_rows(
+        Product.objects.filter(created_by_id=_first(Product.created_by.field.related_model, is_staff=True)))
+        .order_by('-created_at'), ()),
+
+    # Reviews
+    *[PlanCheck(f'reviews {sort}', lambda sort=sort: _reviews(sort), ()) for sort in REVIEW_SORTS],
+
+    # Cart and wishlist
+    PlanCheck('cart lines', lambda: CartItem.objects.filter(cart_id=_first(CartItem.cart.field.related_model))
+              .values('id', 'product_id', 'quantity'), ()),
+    PlanCheck('cart prices', lambda: Product.objects.filter(pk__in=list(range(1, PAGE + 1))).values('id', 'price'), ()),
+    PlanCheck('wishlist', lambda: WishlistItem.objects.filter(
+        wishlist_id=_first(WishlistItem.wishlist.field.related_model)).values('id', 'product_id'), ()),
+    PlanCheck('wishlist page', lambda: WishlistItem.objects.filter(
+        wishlist__user_id=_first(Order.user.field.related_model)).values('id', 'product_id').order_by('-id')[:PAGE], ()),
+
+    # Orders
+    PlanCheck('order history', lambda: Order.objects.filter(user_id=_first(Order.user.field.related_model))
+              .values(*ORDER_FIELDS).order_by('-created_at', '-id')[:PAGE], ()),
+    PlanCheck('order lines', lambda: OrderItem.objects.filter(order_id__in=list(range(1, PAGE + 1)))
+              .values('order_id', 'product_id', 'product__title', 'quantity', 'unit_price')
+              .order_by('order_id', 'id'), ()),
+    PlanCheck('payment callback', lambda: PaymentCallback.objects.filter(txnid='TXN-1').values('status'), ()),
+
+    # Admin
+    PlanCheck('sales by day', lambda: DailySales.objects.filter(day__range=default_range()).order_by('day'), ()),
+    PlanCheck('sales by product', lambda: DailyProductSales.objects.filter(day__range=default_range())
+              .values('product_id'), ()),
+    PlanCheck('pending uploads', lambda: ImageUploadJob.objects.filter(status='pending').values('id'), ()),
+]
+
+
+# --- Reading plans ---
+
+_SQLITE_SCAN = re.compile(r'\bSCAN (\w+)(?: AS \w+)?$')
+
+
+def _sqlite_problems(plan):
+    problems = []
+    for line in plan.splitlines():
+        line = line.strip(' -|`')
+        match = _SQLITE_SCAN.search(line)
+        if match:
+            problems.append(('full scan', match.group(1)))
+        elif 'USE TEMP B-TREE FOR ORDER BY' in line:
+            problems.append(('sort', None))
+    return problems
+
+
+def _mysql_problems(plan):
+    problems = []
+
+    def walk(node):
+        if isinstance(node, dict):
+            if 'table_name' in node and 'access_type' in node:
+                if node['access_type'] == 'ALL':
+                    problems.append(('full scan', node['table_name']))
+            if node.get('using_filesort'):
+                problems.append(('sort', None))
+            for value in node.values():
+                walk(value)
+        elif isinstance(node, list):
+            for value in node:
+                walk(value)
+    walk(json.loads(plan))
+    return problems
+
+
+def _postgresql_problems(plan):
+    problems = [('full scan', table) for table in re.findall(r'Seq Scan on (\w+)', plan)]
+    if re.search(r'^\s*(?:->\s*)?Sort\b', plan, re.M):
+        problems.append(('sort', None))
+    return problems
+
+
+READERS = {
+    'sqlite': ({}, _sqlite_problems),
+    'mysql': ({'format': 'json'}, _mysql_problems),
+    'postgresql': ({}, _postgresql_problems),
+}
+
+
+def supported():
+    """Whether plans of the default database's vendor can be read."""
+    return connection.vendor in READERS
+
+
+def explain(qs):
+    """(plan text, [(problem, table)]) for a queryset on the default database (a supported vendor)."""
+    options, read = READERS[connection.vendor]
+    plan = qs.explain(**options)
+    return plan, read(plan)
+
+
+def run(only=None, checks=CHECKS):
+    """{name: {'plan', 'problems'}} for every check; problems exclude allowed tables.
+
+    Empty, with a warning, on a database vendor without a plan reader.
+    """
+    if not supported():
+        logger.warning("No query plan reader for %s; plan checks skipped", connection.vendor)
+        return {}
+    results = {}
+    for check in checks:
+        if only and check.name not in only:
+            continue
+        plan, problems = explain(check.build())
+        results[check.name] = {
+            'plan': plan,
+            'problems': [(kind, table) for kind, table in problems
+                         if kind not in check.allow and table not in check.allow],
+        }
+    return results
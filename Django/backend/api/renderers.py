@@ -0,0 +1,35 @@
+import datetime
+from decimal import Decimal
+
+from django.core.serializers.json import DjangoJSONEncoder
+from django.utils import timezone
+
+from .timing import TimedJsonResponse
+
+# ----------------------------
+# Fast JSON rendering
+# ----------------------------
+# Lean list endpoints (see cards.py) hand raw column values to the encoder
+# instead of running them through DRF fields. FastJSONEncoder formats the two
+# types that need it the way the DRF serializers do, and LeanJsonResponse
+# skips the circular-reference check (the payloads are plain trees), so the
+# stdlib C encoder does all the work and the bytes match the DRF responses.
+
+
+class FastJSONEncoder(DjangoJSONEncoder):
+    def default(self, o):
+        if isinstance(o, datetime.datetime):
+            # DRF DateTimeField: current timezone, full precision, 'Z' for UTC
+            value = timezone.localtime(o).isoformat() if timezone.is_aware(o) else o.isoformat()
+            return value[:-6] + 'Z' if value.endswith('+00:00') else value
+        if isinstance(o, Decimal):
+            # DRF DecimalField (already quantized by the caller): no exponent
+            return format(o, 'f')
+        return super().default(o)
+
+
+class LeanJsonResponse(TimedJsonResponse):
+    def __init__(self, data, **kwargs):
+        kwargs.setdefault('encoder', FastJSONEncoder)
+        kwargs.setdefault('json_dumps_params', {'check_circular': False})
+        super().__init__(data, **kwargs)
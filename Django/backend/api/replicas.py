@@ -0,0 +1,208 @@
+import logging
+import random
+import threading
+import time
+from contextvars import ContextVar
+from functools import wraps
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.core.cache import cache
+from django.db import close_old_connections
+from django.utils import timezone
+
+from .metrics import REPLICA_HEALTHY, REPLICA_LAG
+
+logger = logging.getLogger(__name__)
+
+# ----------------------------
+# Read replicas
+# ----------------------------
+# Views decorated with @replica_reads send their GET queries to one of the
+# DATABASE_REPLICAS aliases; everything else, and every write, uses 'default'.
+# After a user writes, ReplicaMiddleware pins that user's reads to the primary
+# for REPLICA_STICKY_SECONDS so they always see their own changes. The pin
+# lives in the Django cache, so it holds across workers once CACHES is shared;
+# @replica_reads looks it up once per request, not per query.
+#
+# `manage.py replica_heartbeat --loop` stamps the ReplicaHeartbeat row on the
+# primary every REPLICA_CHECK_INTERVAL seconds. In each process a background
+# thread compares the replicas' copies of that row with the primary's at the
+# same interval: a replica that errors, has no heartbeat or lags more than
+# REPLICA_MAX_LAG seconds is left out of rotation until a later check passes.
+# Requests only read the last result; until the first check finishes they
+# read from the primary.
+
+_request = ContextVar('replica_request', default=None)
+
+
+def _replicas():
+    return getattr(settings, 'DATABASE_REPLICAS', [])
+
+
+def _pin_key(user_id):
+    return f"replica_pin:{user_id}"
+
+
+def is_pinned(user_id):
+    return user_id is not None and cache.get(_pin_key(user_id)) is not None
+
+
+def pin(user_id):
+    cache.set(_pin_key(user_id), True, getattr(settings, 'REPLICA_STICKY_SECONDS', 5))
+
+
+def beat():
+    """Stamp the primary's heartbeat row for the replicas to catch up with."""
+    from .models import ReplicaHeartbeat
+
+    now = timezone.now()
+    if not ReplicaHeartbeat.objects.using('default').filter(pk=1).update(beat_at=now):
+        ReplicaHeartbeat.objects.using('default').create(pk=1, beat_at=now)
+
+
+class ReplicaMonitor:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._thread = None
+        self.status = {}  # alias -> {'healthy': bool, 'lag': seconds or None, 'error': str}
+
+    def healthy(self):
+        self.start()
+        return [alias for alias in _replicas() if self.status.get(alias, {}).get('healthy')]
+
+    def start(self):
+        """Start this process's checker thread, unless running or REPLICA_CHECK_INTERVAL is None."""
+        if self._thread is not None or getattr(settings, 'REPLICA_CHECK_INTERVAL', 5) is None:
+            return
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='replica-monitor', daemon=True)
+                self._thread.start()
+
+    def _run(self):
+        while True:
+            interval = getattr(settings, 'REPLICA_CHECK_INTERVAL', 5)
+            if interval is None:
+                break
+            try:
+                self.check()
+            except Exception:
+                logger.exception("Checking the read replicas failed")
+            finally:
+                # The thread keeps its own DB connections; recycle them like a request would
+                close_old_connections()
+            time.sleep(interval)
+        with self._lock:
+            self._thread = None
+
+    def check(self):
+        from .models import ReplicaHeartbeat
+
+        max_lag = getattr(settings, 'REPLICA_MAX_LAG', 10)
+        primary = ReplicaHeartbeat.objects.using('default').filter(pk=1).values_list('beat_at', flat=True).first()
+        status = {}
+        for alias in _replicas():
+            try:
+                copy = ReplicaHeartbeat.objects.using(alias).filter(pk=1).values_list('beat_at', flat=True).first()
+            except Exception as e:
+                status[alias] = {'healthy': False, 'lag': None, 'error': str(e)}
+                continue
+            if primary is None:
+                status[alias] = {'healthy': False, 'lag': None, 'error': 'No heartbeat on the primary'}
+                continue
+            lag = max((primary - copy).total_seconds(), 0.0) if copy is not None else None
+            status[alias] = {'healthy': lag is not None and lag <= max_lag, 'lag': lag, 'error': ''}
+        for alias, s in status.items():
+            REPLICA_HEALTHY.labels(alias).set(int(s['healthy']))
+            if s['lag'] is not None:
+                REPLICA_LAG.labels(alias).set(s['lag'])
+        self.status = status
+        return status
+
+
+replica_monitor = ReplicaMonitor()
+
+
+class ReplicaRouter:
+    """Replica reads inside @replica_reads views, the primary for everything else."""
+
+    def db_for_read(self, model, **hints):
+        state = _request.get()
+        if state is None or not state['reads'] or not _replicas():
+            return 'default'
+        replicas = replica_monitor.healthy()
+        return random.choice(replicas) if replicas else 'default'
+
+    def db_for_write(self, model, **hints):
+        state = _request.get()
+        if state is not None:
+            state['wrote'] = True
+        return 'default'
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Replicas hold the same rows as the primary
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        return db not in _replicas()
+
+
+def replica_reads(view):
+    """Let a view's GET queries go to a replica (unless the user is pinned)."""
+    def _enable(request):
+        state = _request.get()
+        if state is not None and request.method == 'GET' and _replicas():
+            # One cache lookup per request; the router only reads the flag
+            state['reads'] = not is_pinned(state['user_id'])
+
+    if iscoroutinefunction(view):
+        @wraps(view)
+        async def inner(request, *args, **kwargs):
+            _enable(request)
+            return await view(request, *args, **kwargs)
+    else:
+        @wraps(view)
+        def inner(request, *args, **kwargs):
+            _enable(request)
+            return view(request, *args, **kwargs)
+    return inner
+
+
+class ReplicaMiddleware:
+    """Tracks who is asking and pins users who wrote to the primary."""
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        state, token = self._start(request)
+        try:
+            return self.get_response(request)
+        finally:
+            self._finish(state, token)
+
+    async def __acall__(self, request):
+        state, token = self._start(request)
+        try:
+            return await self.get_response(request)
+        finally:
+            self._finish(state, token)
+
+    def _start(self, request):
+        from .views import token_user_id
+        # Mutable on purpose: the router updates it from sync_to_async threads too
+        state = {'user_id': token_user_id(request), 'reads': False, 'wrote': False}
+        return state, _request.set(state)
+
+    def _finish(self, state, token):
+        _request.reset(token)
+        if state['wrote'] and state['user_id'] is not None:
+            pin(state['user_id'])
@@ -0,0 +1,239 @@
+import math
+import re
+from bisect import bisect_left
+from collections import defaultdict
+
+from django.conf import settings
+
+from .indexes import InMemoryIndex
+
+# ----------------------------
+# In-process product search
+# ----------------------------
+# An inverted index over active products ranked with BM25F. It is built lazily
+# on the first query and then kept current by the Product/Category signals in
+# signals.py. Writes made by other worker processes are picked up by a periodic
+# background rebuild (SEARCH_INDEX_TTL seconds, None to disable; see
+# api/indexes.py).
+
+FIELD_WEIGHTS = {'title': 3.0, 'brand': 2.0, 'category': 2.0, 'description': 1.0}
+BM25_K1 = 1.2
+BM25_B = 0.75
+FUZZY_PENALTY = 0.7    # score factor for a term matched with one typo
+PREFIX_PENALTY = 0.8   # score factor for an as-you-type prefix match
+MAX_PREFIX_EXPANSIONS = 20
+MIN_FUZZY_LENGTH = 4   # shorter terms are matched exactly only
+
+TOKEN_RE = re.compile(r"\w+", re.UNICODE)
+
+
+def tokenize(text):
+    return TOKEN_RE.findall((text or '').lower())
+
+
+def _deletes(term):
+    return {term[:i] + term[i + 1:] for i in range(len(term))}
+
+
+def _within_one_edit(a, b):
+    """Optimal string alignment distance <= 1 (one insert, delete, substitution or swap)."""
+    if a == b:
+        return True
+    la, lb = len(a), len(b)
+    if abs(la - lb) > 1:
+        return False
+    if la == lb:
+        diff = [i for i in range(la) if a[i] != b[i]]
+        if len(diff) == 1:
+            return True
+        return (len(diff) == 2 and diff[1] == diff[0] + 1
+                and a[diff[0]] == b[diff[1]] and a[diff[1]] == b[diff[0]])
+    if la > lb:
+        a, b = b, a
+    # b is one character longer than a
+    for i in range(len(a)):
+        if a[i] != b[i]:
+            return a[i:] == b[i + 1:]
+    return True
+
+
+class ProductSearchIndex(InMemoryIndex):
+    ttl_setting = 'SEARCH_INDEX_TTL'
+
+    def _reset(self):
+        self._postings = defaultdict(dict)   # term -> {doc_id: weighted tf}
+        self._doc_terms = {}                 # doc_id -> {term: weighted tf}
+        self._doc_len = {}                   # doc_id -> weighted length
+        self._doc_category = {}              # doc_id -> category_id
+        self._total_len = 0.0
+        self._deletes = defaultdict(set)     # deletion variant -> terms
+        self._vocab = []                     # sorted terms, for prefix lookups
+        self._built_at = None
+
+    # --- Maintenance ---
+    def _load(self):
+        from .models import Product
+        rows = (Product.objects.filter(is_active=True)
+                .values('id', 'title', 'brand', 'description', 'category_id', 'category__name')
+                .iterator(chunk_size=2000))
+        for row in rows:
+            self._add(row)
+
+    def add_product(self, product):
+        """Index (or re-index) a Product instance; inactive products are dropped."""
+        if not self._tracking:
+            return
+        if not product.is_active:
+            self.remove(product.pk)
+            return
+        category = product.category if product.category_id else None
+        self.add({
+            'id': product.pk, 'title': product.title, 'brand': product.brand,
+            'description': product.description, 'category_id': product.category_id,
+            'category__name': category.name if category else '',
+        })
+
+    def add(self, row):
+        self._apply('_replace', row)
+
+    def remove(self, doc_id):
+        self._apply('_remove', doc_id)
+
+    def reindex_category(self, category_id):
+        """Refresh every indexed product of a renamed or deleted category."""
+        if not self._tracking:
+            return
+        from .models import Product
+        with self._lock:
+            doc_ids = [d for d, c in self._doc_category.items() if c == category_id]
+        if not doc_ids:
+            return
+        rows = (Product.objects.filter(id__in=doc_ids, is_active=True)
+                .values('id', 'title', 'brand', 'description', 'category_id', 'category__name'))
+        with self._lock:
+            for doc_id in doc_ids:
+                self.remove(doc_id)
+            for row in rows:
+                self.add(row)
+
+    def _replace(self, row):
+        self._remove(row['id'])
+        self._add(row)
+
+    def _add(self, row):
+        doc_id = row['id']
+        fields = {
+            'title': row.get('title'),
+            'brand': row.get('brand'),
+            'category': row.get('category__name'),
+            'description': row.get('description'),
+        }
+        terms = defaultdict(float)
+        length = 0.0
+        for field, text in fields.items():
+            weight = FIELD_WEIGHTS[field]
+            for token in tokenize(text):
+                terms[token] += weight
+                length += weight
+
+        for term, tf in terms.items():
+            if term not in self._postings:
+                self._add_term(term)
+            self._postings[term][doc_id] = tf
+        self._doc_terms[doc_id] = dict(terms)
+        self._doc_len[doc_id] = length
+        self._doc_category[doc_id] = row.get('category_id')
+        self._total_len += length
+
+    def _remove(self, doc_id):
+        terms = self._doc_terms.pop(doc_id, None)
+        if terms is None:
+            return
+        for term in terms:
+            postings = self._postings[term]
+            postings.pop(doc_id, None)
+            if not postings:
+                del self._postings[term]
+                self._drop_term(term)
+        self._total_len -= self._doc_len.pop(doc_id, 0.0)
+        self._doc_category.pop(doc_id, None)
+
+    def _add_term(self, term):
+        i = bisect_left(self._vocab, term)
+        self._vocab.insert(i, term)
+        if len(term) >= MIN_FUZZY_LENGTH:
+            for variant in _deletes(term):
+                self._deletes[variant].add(term)
+
+    def _drop_term(self, term):
+        i = bisect_left(self._vocab, term)
+        if i < len(self._vocab) and self._vocab[i] == term:
+            del self._vocab[i]
+        if len(term) >= MIN_FUZZY_LENGTH:
+            for variant in _deletes(term):
+                bucket = self._deletes.get(variant)
+                if bucket:
+                    bucket.discard(term)
+                    if not bucket:
+                        del self._deletes[variant]
+
+    # --- Querying ---
+    def _expand(self, token, is_last):
+        """Map one query token to [(indexed term, score factor)]."""
+        matches = {}
+        if token in self._postings:
+            matches[token] = 1.0
+        elif len(token) >= MIN_FUZZY_LENGTH:
+            candidates = set(self._deletes.get(token, ()))
+            for variant in _deletes(token):
+                if variant in self._postings:
+                    candidates.add(variant)
+                candidates |= self._deletes.get(variant, set())
+            for term in candidates:
+                if _within_one_edit(token, term):
+                    matches[term] = FUZZY_PENALTY
+
+        # The last token is usually still being typed
+        if is_last and len(token) >= 2:
+            i = bisect_left(self._vocab, token)
+            expanded = 0
+            while i < len(self._vocab) and expanded < MAX_PREFIX_EXPANSIONS:
+                term = self._vocab[i]
+                if not term.startswith(token):
+                    break
+                matches.setdefault(term, PREFIX_PENALTY)
+                expanded += 1
+                i += 1
+        return matches
+
+    def search(self, query, limit=None):
+        """
+        Return [(score, product_id)] best first (ties broken by newest id).
+        """
+        self.ensure_fresh()
+        tokens = tokenize(query)
+        if not tokens:
+            return []
+        if limit is None:
+            limit = getattr(settings, 'SEARCH_MAX_RESULTS', 1000)
+
+        with self._lock:
+            n_docs = len(self._doc_terms)
+            if not n_docs:
+                return []
+            avgdl = self._total_len / n_docs
+            scores = defaultdict(float)
+            for pos, token in enumerate(tokens):
+                for term, factor in self._expand(token, pos == len(tokens) - 1).items():
+                    postings = self._postings[term]
+                    df = len(postings)
+                    idf = math.log(1 + (n_docs - df + 0.5) / (df + 0.5))
+                    for doc_id, tf in postings.items():
+                        norm = BM25_K1 * (1 - BM25_B + BM25_B * self._doc_len[doc_id] / avgdl)
+                        scores[doc_id] += factor * idf * tf * (BM25_K1 + 1) / (tf + norm)
+
+        ranked = sorted(((round(s, 6), d) for d, s in scores.items()), reverse=True)
+        return ranked[:limit]
+
+
+product_search = ProductSearchIndex()
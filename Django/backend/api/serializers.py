@@ -1,46 +1,66 @@
 from rest_framework import serializers
 from django.contrib.auth.models import User
-from .models import (Category, Product, ProductImage, UserProfile,
+from .models import (Category, Product, ProductImage, ProductRating, UserProfile,
                      Address, Cart, CartItem, Wishlist, WishlistItem, Order, OrderItem, Review)
+from .timing import phase
 
-class CategorySerializer(serializers.ModelSerializer):
+class TimedSerializer:
+    """Reports time spent serializing to the Server-Timing middleware."""
+    def to_representation(self, instance):
+        with phase('serialize'):
+            return super().to_representation(instance)
+
+class CategorySerializer(TimedSerializer, serializers.ModelSerializer):
     class Meta:
         model = Category
         fields = ['id','name','slug','description']
 
-class ProductImageSerializer(serializers.ModelSerializer):
+class ProductImageSerializer(TimedSerializer, serializers.ModelSerializer):
     class Meta:
         model = ProductImage
         fields = ['id','image_url','alt_text','is_featured']
 
-class ProductSerializer(serializers.ModelSerializer):
+def rating_summary_data(summary):
+    if summary is None:
+        return {'count': 0, 'average': 0, 'histogram': {str(n): 0 for n in range(1, 6)}}
+    return {'count': summary.count, 'average': summary.average, 'histogram': summary.histogram()}
+
+class ProductSerializer(TimedSerializer, serializers.ModelSerializer):
     images = ProductImageSerializer(many=True, read_only=True)
     category = CategorySerializer(read_only=True)
     category_id = serializers.PrimaryKeyRelatedField(write_only=True, queryset=Category.objects.all(), source='category', required=False, allow_null=True)
+    rating_summary = serializers.SerializerMethodField()
 
     class Meta:
         model = Product
-        fields = ['id','title','slug','description','price','brand','category','category_id','stock','is_active','created_at','images']
+        fields = ['id','title','slug','description','price','brand','category','category_id','stock','is_active','created_at','images','rating_summary']
+
+    def get_rating_summary(self, obj):
+        # select_related('rating_summary') in list views keeps this query-free
+        try:
+            return rating_summary_data(obj.rating_summary)
+        except ProductRating.DoesNotExist:
+            return rating_summary_data(None)
 
-class WishlistItemSerializer(serializers.ModelSerializer):
+class WishlistItemSerializer(TimedSerializer, serializers.ModelSerializer):
     product = ProductSerializer(read_only=True)
 
     class Meta:
         model = WishlistItem
         fields = ['id', 'product', 'added_at']
 
-class UserSerializer(serializers.ModelSerializer):
+class UserSerializer(TimedSerializer, serializers.ModelSerializer):
     class Meta:
         model = User
         fields = ['id','username','email','first_name','last_name']
 
-class AddressSerializer(serializers.ModelSerializer):
+class AddressSerializer(TimedSerializer, serializers.ModelSerializer):
     class Meta:
         model = Address
         fields = '__all__'
         read_only_fields = ['user','created_at']
 
-class CartItemSerializer(serializers.ModelSerializer):
+class CartItemSerializer(TimedSerializer, serializers.ModelSerializer):
     product = ProductSerializer(read_only=True)
     product_id = serializers.PrimaryKeyRelatedField(write_only=True, queryset=Product.objects.all(), source='product')
 
@@ -48,27 +68,27 @@ class CartItemSerializer(serializers.ModelSerializer):
         model = CartItem
         fields = ['id','product','product_id','quantity','added_at']
 
-class CartSerializer(serializers.ModelSerializer):
+class CartSerializer(TimedSerializer, serializers.ModelSerializer):
     items = CartItemSerializer(many=True)
     class Meta:
         model = Cart
         fields = ['id','user','items','updated_at']
         read_only_fields = ['user']
 
-class OrderItemSerializer(serializers.ModelSerializer):
+class OrderItemSerializer(TimedSerializer, serializers.ModelSerializer):
     product = ProductSerializer(read_only=True)
     class Meta:
         model = OrderItem
         fields = ['id','product','quantity','unit_price']
 
-class OrderSerializer(serializers.ModelSerializer):
+class OrderSerializer(TimedSerializer, serializers.ModelSerializer):
     order_items = OrderItemSerializer(many=True, read_only=True)
     class Meta:
         model = Order
         fields = ['id','user','address','total_amount','status','created_at','payment_id','order_items']
         read_only_fields = ['user','total_amount','status','created_at','payment_id']
 
-class ReviewSerializer(serializers.ModelSerializer):
+class ReviewSerializer(TimedSerializer, serializers.ModelSerializer):
     user = UserSerializer(read_only=True)
     class Meta:
         model = Review
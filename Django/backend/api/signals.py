@@ -0,0 +1,159 @@
+from django.contrib.auth.models import User
+from django.db import transaction
+from django.db.models import QuerySet
+from django.db.models.signals import post_delete, post_init, post_save
+from django.dispatch import receiver
+from django.utils import timezone
+
+from .cards import invalidate_cards
+from .conditional import bump_stamp
+from .models import Category, Product, ProductImage, ProductRating, Review
+from .facets import product_facets
+from .search import product_search
+from .tokens import revoke_tokens
+
+# ----------------------------
+# Keep in-process indexes current
+# ----------------------------
+# Index updates run on commit so a rolled-back write never becomes searchable.
+
+@receiver(post_save, sender=Product)
+def index_product(sender, instance, **kwargs):
+    def apply():
+        product_search.add_product(instance)
+        product_facets.add_product(instance)
+    transaction.on_commit(apply)
+
+@receiver(post_delete, sender=Product)
+def unindex_product(sender, instance, **kwargs):
+    pk = instance.pk
+    def apply():
+        product_search.remove(pk)
+        product_facets.remove(pk)
+    transaction.on_commit(apply)
+
+@receiver(post_save, sender=Category)
+def reindex_category(sender, instance, **kwargs):
+    pk = instance.pk
+    def apply():
+        product_search.reindex_category(pk)
+        product_facets.update_category(instance)
+    transaction.on_commit(apply)
+
+@receiver(post_delete, sender=Category)
+def unindex_category(sender, instance, **kwargs):
+    pk = instance.pk
+    def apply():
+        product_search.reindex_category(pk)
+        product_facets.delete_category(pk)
+    transaction.on_commit(apply)
+
+
+# ----------------------------
+# Change stamps for conditional GET
+# ----------------------------
+@receiver(post_save, sender=Product)
+@receiver(post_delete, sender=Product)
+def stamp_products(sender, instance, **kwargs):
+    transaction.on_commit(lambda: bump_stamp('product'))
+
+@receiver(post_save, sender=Category)
+@receiver(post_delete, sender=Category)
+def stamp_categories(sender, instance, **kwargs):
+    transaction.on_commit(lambda: bump_stamp('category'))
+
+@receiver(post_save, sender=ProductImage)
+@receiver(post_delete, sender=ProductImage)
+def touch_product_for_image(sender, instance, **kwargs):
+    # Images are part of the product payload, so they move its updated_at
+    Product.objects.filter(pk=instance.product_id).update(updated_at=timezone.now())
+    transaction.on_commit(lambda: bump_stamp('product'))
+
+@receiver(post_save, sender=Product)
+@receiver(post_delete, sender=Product)
+@receiver(post_save, sender=ProductImage)
+@receiver(post_delete, sender=ProductImage)
+def drop_cached_card(sender, instance, **kwargs):
+    pk = instance.pk if sender is Product else instance.product_id
+    transaction.on_commit(lambda: invalidate_cards([pk]))
+
+@receiver(post_save, sender=Review)
+@receiver(post_delete, sender=Review)
+def stamp_reviews(sender, instance, **kwargs):
+    product_id = instance.product_id
+    transaction.on_commit(lambda: bump_stamp(f'reviews:{product_id}'))
+
+
+# ----------------------------
+# Rating summaries
+# ----------------------------
+# Reviews remember the rating they were loaded with so an edit can move it
+# between histogram buckets. The summary row is locked for the update.
+
+@receiver(post_save, sender=Product)
+def create_rating_summary(sender, instance, created, **kwargs):
+    if created:
+        ProductRating.objects.get_or_create(product=instance)
+
+@receiver(post_init, sender=Review)
+def remember_rating(sender, instance, **kwargs):
+    instance._saved_rating = instance.rating
+
+def _update_rating(product_id, removed=None, added=None, create=True):
+    with transaction.atomic():
+        qs = ProductRating.objects.select_for_update()
+        if create:
+            summary, _ = qs.get_or_create(product_id=product_id)
+        else:
+            summary = qs.filter(product_id=product_id).first()
+            if summary is None:
+                # Being deleted together with its product
+                return
+        summary.apply(removed=removed, added=added)
+        summary.save()
+        # The summary is part of the product payload
+        Product.objects.filter(pk=product_id).update(updated_at=timezone.now())
+    transaction.on_commit(lambda: bump_stamp('product'))
+    transaction.on_commit(lambda: invalidate_cards([product_id]))
+
+@receiver(post_save, sender=Review)
+def rate_on_save(sender, instance, created, **kwargs):
+    if created:
+        _update_rating(instance.product_id, added=instance.rating)
+    elif instance.rating != instance._saved_rating:
+        _update_rating(instance.product_id, removed=instance._saved_rating, added=instance.rating)
+    instance._saved_rating = instance.rating
+
+@receiver(post_delete, sender=Review)
+def rate_on_delete(sender, instance, origin=None, **kwargs):
+    # A product's reviews are deleted with it, and so is its summary
+    deleted = origin.model if isinstance(origin, QuerySet) else type(origin)
+    if deleted is Product:
+        return
+    _update_rating(instance.product_id, removed=instance._saved_rating, create=False)
+
+# ----------------------------
+# Revoke tokens when credentials change
+# ----------------------------
+# Deactivating a user or changing their password, through the API, the admin
+# site or a shell, invalidates every token issued to them so far. Fields left
+# deferred at load time are not compared.
+
+def _credentials(user):
+    return user.__dict__.get('is_active'), user.__dict__.get('password')
+
+@receiver(post_init, sender=User)
+def remember_credentials(sender, instance, **kwargs):
+    instance._saved_credentials = _credentials(instance)
+
+@receiver(post_save, sender=User)
+def revoke_on_credentials_change(sender, instance, created, update_fields=None, **kwargs):
+    (was_active, old_password), (is_active, password) = instance._saved_credentials, _credentials(instance)
+    instance._saved_credentials = (is_active, password)
+    if created:
+        return
+    # check_password() upgrading the hash of the same password saves only the password
+    rehashed = update_fields is not None and set(update_fields) == {'password'}
+    deactivated = was_active and is_active is False
+    if deactivated or (old_password is not None and password != old_password and not rehashed):
+        revoke_tokens(instance)
@@ -1,3 +1,1007 @@
-from django.test import TestCase
+import datetime
+import io
+import json
+import os
+import re
+import tempfile
+import threading
+import time
+from decimal import Decimal
+from unittest import mock
 
-# Create your tests here.
+import jwt
+from prometheus_client import REGISTRY
+
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.db import IntegrityError, connections, transaction
+from django.http import JsonResponse
+from django.test import RequestFactory, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+
+from . import benchmark, carts, query_plans, replicas, views
+from .analytics import record_order
+from .facets import product_facets
+from .importer import ProductImporter, iter_rows
+from .inventory import OutOfStock, reserve_stock
+from .pagination import encode_cursor
+from .models import (CartItem, Category, DailySales, ImageUploadJob, Order, OrderItem, PaymentCallback, Product,
+                     ProductImage, ProductImportJob, ProductRating, ReplicaHeartbeat, Review, UserProfile)
+from .pricing import cart_lines, invalidate_cart_summary
+from .search import ProductSearchIndex, product_search
+from .serializers import ProductSerializer
+from .uploads import enqueue_uploads
+
+# Small-volume run of the endpoint benchmarks (api/benchmark.py). Query counts
+# do not depend on data volume, so a small catalog is enough to catch N+1
+# regressions; latency and payload budgets are checked by `manage.py benchmark`.
+# A TransactionTestCase so rollups and index updates run on commit, as in
+# production, and count towards the budgets.
+SMOKE_VOLUMES = {'products': 60, 'images': 2, 'reviews': 150, 'users': 12, 'orders': 80}
+
+
+class SeededTestCase(TestCase):
+    """The benchmark catalog at SMOKE_VOLUMES, seeded once per class, as self.fx."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.fx = benchmark.seed(SMOKE_VOLUMES)
+
+    def setUp(self):
+        # As seed() leaves them: nothing cached from an earlier test
+        cache.clear()
+        product_search.mark_stale()
+        product_facets.mark_stale()
+
+
+@override_settings(IMAGE_UPLOAD_BACKEND='api.uploads.LocalFileStorage', IMAGE_UPLOAD_EAGER=True,
+                   MEDIA_ROOT=tempfile.gettempdir(), CART_WRITE_BEHIND=True)
+class EndpointBudgetTests(TransactionTestCase):
+    def test_every_route_has_a_scenario(self):
+        self.assertEqual(benchmark.uncovered_routes(), [])
+
+    def test_query_budgets(self):
+        fx = benchmark.seed(SMOKE_VOLUMES)
+        results = benchmark.run(fx, iterations=2)
+        self.assertEqual(benchmark.check(results, benchmark.load_budgets(), SMOKE_VOLUMES), [])
+
+    def test_asgi_read_path_matches_wsgi(self):
+        fx = benchmark.seed(SMOKE_VOLUMES)
+        results = benchmark.compare_servers(fx, concurrency=4, requests=8)
+        for name, r in results.items():
+            self.assertTrue(r['identical'], name)
+            self.assertEqual(r['asgi']['status'], [200], name)
+
+
+@override_settings(IMAGE_UPLOAD_BACKEND='api.uploads.LocalFileStorage', IMAGE_UPLOAD_EAGER=True,
+                   MEDIA_ROOT=tempfile.gettempdir())
+class QueryPlanTests(SeededTestCase):
+    def test_hot_queries_use_indexes(self):
+        problems = {name: r['problems'] for name, r in query_plans.run().items() if r['problems']}
+        self.assertEqual(problems, {})
+
+    def test_unknown_vendor_is_skipped(self):
+        with mock.patch.object(connections['default'], 'vendor', 'oracle'), self.assertLogs('api.query_plans', 'WARNING'):
+            self.assertEqual(query_plans.run(), {})
+
+
+@override_settings(IMAGE_UPLOAD_BACKEND='api.uploads.LocalFileStorage', IMAGE_UPLOAD_EAGER=True,
+                   MEDIA_ROOT=tempfile.gettempdir(), CART_FLUSH_DELAY=None, CART_WRITE_BEHIND=True)
+class CartStoreTests(SeededTestCase):
+    def test_journaled_changes_reach_the_database(self):
+        fx = self.fx
+        user_id, (first, second) = fx.shopper.pk, fx.product_ids[:2]
+        carts.set_line(user_id, first, 7)
+        carts.remove_line(user_id, second)
+        # As after a crash: nothing was written, and the next drain catches up
+        self.assertEqual(CartItem.objects.get(cart__user_id=user_id, product_id=first).quantity, 2)
+        self.assertEqual(carts.drain(), 1)
+        stored = dict(CartItem.objects.filter(cart__user_id=user_id).values_list('product_id', 'quantity'))
+        self.assertEqual(stored, carts.get_lines(user_id))
+        self.assertEqual(carts.drain(), 0)
+
+    def test_checkout_keeps_the_cart_still(self):
+        fx = self.fx
+        user_id, product_id = fx.shopper.pk, fx.product_ids[0]
+        carts.set_line(user_id, product_id, 9)
+        with carts.checkout(user_id) as placed:
+            self.assertEqual(CartItem.objects.get(cart__user_id=user_id, product_id=product_id).quantity, 9)
+            with mock.patch.object(carts, 'LOCK_WAIT', 0), self.assertRaises(carts.CartBusy):
+                carts.add_line(user_id, product_id, 1)
+            placed()
+        self.assertEqual(carts.get_lines(user_id), {})
+
+    def test_busy_cart_answers_503(self):
+        fx = self.fx
+        cache.add(carts._lock_key(fx.shopper.pk), 'held', carts.LOCK_TIMEOUT)
+        with mock.patch.object(carts, 'LOCK_WAIT', 0):
+            response = self.client.post(reverse('cart_view'), {'product_id': fx.product_ids[0], 'quantity': 1},
+                                        content_type='application/json', **fx.headers(fx.shopper))
+        self.assertEqual(response.status_code, 503)
+
+    def test_item_routes_keep_taking_cart_item_ids(self):
+        fx = self.fx
+        headers = fx.headers(fx.shopper)
+        carts.add_line(fx.shopper.pk, fx.product_ids[10], 1)  # not written yet
+        items = {i['product_id']: i['id'] for i in self.client.get(reverse('cart_view'), **headers).json()['items']}
+        stored = dict(CartItem.objects.filter(cart__user=fx.shopper).values_list('product_id', 'id'))
+        self.assertEqual(items, stored)
+
+        pk = items[fx.product_ids[10]]
+        response = self.client.put(reverse('cart_item_detail', args=[pk]), {'quantity': 4},
+                                   content_type='application/json', **headers)
+        self.assertEqual(response.json(), {'id': pk, 'product': fx.product_ids[10], 'quantity': 4})
+        self.assertEqual(self.client.get(reverse('cart_line_detail', args=[fx.product_ids[10]]), **headers).json(),
+                         {'product': fx.product_ids[10], 'quantity': 4})
+        self.client.delete(reverse('cart_view'), {'item_id': items[fx.product_ids[0]]},
+                           content_type='application/json', **headers)
+        self.assertNotIn(fx.product_ids[0], carts.get_lines(fx.shopper.pk))
+
+        # Someone else's row, or no row at all
+        fx.fill_cart(fx.buyer)
+        carts.flush(fx.buyer.pk)
+        other = CartItem.objects.filter(cart__user=fx.buyer).values_list('id', flat=True).first()
+        for bad in (other, max(stored.values()) + 1000):
+            self.assertEqual(self.client.get(reverse('cart_item_detail', args=[bad]), **headers).status_code, 404)
+
+    @override_settings(CART_WRITE_BEHIND=False)
+    def test_without_a_shared_cache_changes_go_straight_to_the_database(self):
+        fx = self.fx
+        user_id, product_id = fx.shopper.pk, fx.product_ids[0]
+        carts.set_line(user_id, product_id, 7)
+        self.assertEqual(CartItem.objects.get(cart__user_id=user_id, product_id=product_id).quantity, 7)
+        self.assertEqual(carts.drain(), 0)
+
+
+@override_settings(CART_WRITE_BEHIND=True)
+class CartSummaryTests(SeededTestCase):
+    def summary(self):
+        return self.client.get(reverse('cart_summary'), **self.fx.headers(self.fx.shopper)).json()
+
+    def expected(self, lines):
+        prices = dict(Product.objects.filter(pk__in=lines).values_list('pk', 'price'))
+        subtotal = sum(prices[pk] * qty for pk, qty in lines.items())
+        return {'lines': len(lines), 'items': sum(lines.values()), 'subtotal': str(subtotal.quantize(Decimal('0.01')))}
+
+    def test_summary_is_cached_until_the_cart_changes(self):
+        p, user_id = self.fx.product_ids, self.fx.shopper.pk
+        self.assertEqual(self.summary(), self.expected(dict.fromkeys(p[:5], 2)))
+        with self.assertNumQueries(0):
+            self.summary()
+        self.client.post(reverse('cart_view'), {'product_id': p[10], 'quantity': 3},
+                         content_type='application/json', **self.fx.headers(self.fx.shopper))
+        expected = self.expected({**dict.fromkeys(p[:5], 2), p[10]: 3})
+        with self.assertNumQueries(1):  # the cart's prices
+            self.assertEqual(self.summary(), expected)
+        self.assertEqual(carts.get_lines(user_id)[p[10]], 3)
+
+    @override_settings(CART_WRITE_BEHIND=False)
+    def test_database_carts_are_totalled_in_the_database(self):
+        p, user_id = self.fx.product_ids, self.fx.shopper.pk
+        expected = self.expected(dict.fromkeys(p[:5], 2))
+        self.assertEqual(self.summary(), expected)
+        invalidate_cart_summary(user_id)
+        with self.assertNumQueries(1):  # one aggregate, no CartItem rows
+            self.assertEqual(self.summary(), expected)
+        carts.clear(user_id)
+        invalidate_cart_summary(user_id)
+        self.assertEqual(self.summary(), {'lines': 0, 'items': 0, 'subtotal': '0.00'})
+
+    def test_order_lines_are_priced_in_one_query(self):
+        cart = CartItem.objects.filter(cart__user=self.fx.shopper).first().cart
+        Product.objects.filter(pk=self.fx.product_ids[0]).update(price=Decimal('1.50'))
+        with self.assertNumQueries(1):
+            lines, total = cart_lines(cart)
+        self.assertEqual([l['product_id'] for l in lines], self.fx.product_ids[:5])
+        self.assertEqual(lines[0]['unit_price'], Decimal('1.50'))
+        self.assertEqual(total, sum(l['unit_price'] * 2 for l in lines))
+
+
+class CartBatchTests(SeededTestCase):
+    def batch(self, *operations):
+        return self.client.post(reverse('cart_batch'), {'operations': list(operations)},
+                                content_type='application/json', **self.fx.headers(self.fx.shopper))
+
+    def test_operations_apply_together(self):
+        p = self.fx.product_ids
+        response = self.batch({'op': 'add', 'product_id': p[0]}, {'op': 'set', 'product_id': p[1], 'quantity': 5},
+                              {'op': 'remove', 'product_id': p[2]}, {'op': 'set', 'product_id': p[3], 'quantity': 0},
+                              {'op': 'add', 'product_id': p[10], 'quantity': 2})
+        self.assertEqual(response.status_code, 200)
+        expected = {p[0]: 3, p[1]: 5, p[4]: 2, p[10]: 2}
+        self.assertEqual(carts.get_lines(self.fx.shopper.pk), expected)
+        self.assertEqual({i['product']: i['quantity'] for i in response.json()['items']}, expected)
+
+    def test_one_bad_operation_changes_nothing(self):
+        p, lines = self.fx.product_ids, carts.get_lines(self.fx.shopper.pk)
+        add = {'op': 'add', 'product_id': p[0]}
+        for bad, status, body in [
+            ({'op': 'set', 'product_id': p[1]}, 400, {'error': 'Invalid operation', 'index': 1}),
+            ({'op': 'add', 'product_id': p[1], 'quantity': 0}, 400, {'error': 'Invalid operation', 'index': 1}),
+            ({'op': 'move', 'product_id': p[1]}, 400, {'error': 'Invalid operation', 'index': 1}),
+            ({'op': 'add', 'product_id': p[-1] + 1000}, 404, {'error': 'Product not found', 'product_ids': [p[-1] + 1000]}),
+        ]:
+            response = self.batch(add, bad)
+            self.assertEqual((response.status_code, response.json()), (status, body), bad)
+            self.assertEqual(carts.get_lines(self.fx.shopper.pk), lines, bad)
+
+
+class WishlistIdsTests(SeededTestCase):
+    def ids(self):
+        return self.client.get(reverse('wishlist_ids'), **self.fx.headers(self.fx.shopper)).json()['product_ids']
+
+    def test_cached_ids_follow_adds_and_removes(self):
+        p, headers = self.fx.product_ids, self.fx.headers(self.fx.shopper)
+        self.assertEqual(self.ids(), p[:20])
+        with self.assertNumQueries(0):
+            self.assertEqual(self.ids(), p[:20])
+        self.client.post(reverse('wishlist_add'), {'product_id': p[30]}, content_type='application/json', **headers)
+        self.assertEqual(self.ids(), p[:20] + [p[30]])
+        self.client.delete(reverse('wishlist_remove', args=[p[0]]), **headers)
+        self.assertEqual(self.ids(), p[1:20] + [p[30]])
+
+
+class ProductReviewListTests(SeededTestCase):
+    def pages(self, sort):
+        url = reverse('product_reviews_list', args=[self.fx.reviewed_product_id])
+        seen, params = [], {'sort': sort, 'limit': 4}
+        while True:
+            with self.assertNumQueries(2):  # the product, then the page
+                page = self.client.get(url, params).json()
+            seen += [r['id'] for r in page['results']]
+            if not page['next_cursor']:
+                return seen
+            params['cursor'] = page['next_cursor']
+
+    def test_every_sort_pages_through_all_reviews(self):
+        reviews = Review.objects.filter(product_id=self.fx.reviewed_product_id)
+        self.assertGreater(reviews.count(), 4)
+        for sort, order in [('newest', ('-created_at', '-id')), ('highest', ('-rating', '-id')),
+                            ('lowest', ('rating', 'id')), ('helpful', ('-helpful_count', '-id'))]:
+            self.assertEqual(self.pages(sort), list(reviews.order_by(*order).values_list('id', flat=True)), sort)
+
+    def test_unknown_sort_is_refused(self):
+        response = self.client.get(reverse('product_reviews_list', args=[self.fx.reviewed_product_id]), {'sort': 'random'})
+        self.assertEqual((response.status_code, response.json()), (400, {'error': 'Invalid sort'}))
+
+
+class ProductCardCacheTests(SeededTestCase):
+    def test_cached_cards_follow_product_writes(self):
+        fx = self.fx
+        url = f"/api/products/batch/?ids={fx.product_ids[1]},{fx.product_ids[0]}"
+        self.client.get(url)
+        product = Product.objects.get(pk=fx.product_ids[0])
+        product.title = 'Renamed'
+        with self.captureOnCommitCallbacks(execute=True):
+            product.save()
+        with self.assertNumQueries(2):  # only the changed card is reloaded
+            results = self.client.get(url).json()['results']
+        self.assertEqual([r['id'] for r in results], fx.product_ids[1::-1])
+        self.assertEqual(results[1], self.client.get(f"/api/products/{product.pk}/").json())
+
+
+@override_settings(IMAGE_UPLOAD_BACKEND='api.uploads.LocalFileStorage', IMAGE_UPLOAD_EAGER=True,
+                   MEDIA_ROOT=tempfile.gettempdir())
+class StockReservationTests(SeededTestCase):
+    def setUp(self):
+        super().setUp()
+        self.fx.fill_cart(self.fx.buyer)
+        self.cart_ids = self.fx.product_ids[5:8]
+
+    def stock(self):
+        return dict(Product.objects.filter(pk__in=self.cart_ids).values_list('pk', 'stock'))
+
+    def test_shortage_rolls_the_checkout_back(self):
+        short = self.cart_ids[-1]
+        Product.objects.filter(pk=short).update(stock=0)
+        before, orders = self.stock(), Order.objects.count()
+        response = self.client.post(reverse('create_order'), {'address_id': self.fx.buyer_address_id},
+                                    content_type='application/json', **self.fx.headers(self.fx.buyer))
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(response.json()['shortages'], [{'product_id': short, 'requested': 1, 'available': 0}])
+        self.assertEqual(self.stock(), before)
+        self.assertEqual(Order.objects.count(), orders)
+        self.assertEqual(set(carts.get_lines(self.fx.buyer.pk)), set(self.cart_ids))
+
+    def test_reservation_never_takes_stock_below_zero(self):
+        pk = self.cart_ids[0]
+        Product.objects.filter(pk=pk).update(stock=1)
+        with self.assertRaises(OutOfStock), transaction.atomic():
+            reserve_stock([{'product_id': pk, 'quantity': 2}])
+        self.assertEqual(Product.objects.get(pk=pk).stock, 1)
+
+
+@override_settings(IMAGE_UPLOAD_BACKEND='api.uploads.LocalFileStorage', IMAGE_UPLOAD_EAGER=True,
+                   MEDIA_ROOT=tempfile.gettempdir())
+class PayUCallbackTests(SeededTestCase):
+    def setUp(self):
+        super().setUp()
+        self.fx.fill_cart(self.fx.buyer)
+
+    def callback(self, **data):
+        payload = {'udf1': self.fx.buyer.pk, 'udf2': self.fx.buyer_address_id, 'txnid': 'txn-1', 'status': 'success'}
+        return self.client.post(reverse('payu_success'), {**payload, **data})
+
+    def orders(self):
+        return Order.objects.filter(user=self.fx.buyer).count()
+
+    def test_replayed_txnid_orders_once(self):
+        orders = self.orders()
+        self.callback()
+        self.assertEqual(self.orders(), orders + 1)
+        # The shopper fills a new cart; PayU retries the old callback
+        self.fx.fill_cart(self.fx.buyer)
+        lines = carts.get_lines(self.fx.buyer.pk)
+        self.callback()
+        self.assertEqual(self.orders(), orders + 1)
+        self.assertEqual(carts.get_lines(self.fx.buyer.pk), lines)
+        self.assertEqual(PaymentCallback.objects.filter(txnid='txn-1').count(), 1)
+
+    def test_failed_or_unknown_payment_places_no_order(self):
+        orders, lines = self.orders(), carts.get_lines(self.fx.buyer.pk)
+        self.assertEqual(self.callback(status='failure')['Location'], "http://localhost:5173/cart")
+        self.assertEqual(self.callback(udf1=0)['Location'], "http://localhost:5173/")
+        self.assertEqual(self.orders(), orders)
+        self.assertEqual(carts.get_lines(self.fx.buyer.pk), lines)
+        self.assertFalse(PaymentCallback.objects.exists())
+
+
+class OrderHistoryTests(SeededTestCase):
+    def test_pages_walk_the_history_newest_first(self):
+        fx = self.fx
+        url = reverse('orders_list')
+        self.client.get(url, **fx.headers(fx.shopper))  # token check cached
+        seen, cursor = [], None
+        while True:
+            with self.assertNumQueries(2):  # orders, then their lines
+                page = self.client.get(url, {'limit': 25, **({'cursor': cursor} if cursor else {})},
+                                       **fx.headers(fx.shopper)).json()
+            seen += page['results']
+            cursor = page['next_cursor']
+            if not cursor:
+                break
+        expected = list(Order.objects.filter(user=fx.shopper).order_by('-created_at', '-id').values_list('id', flat=True))
+        self.assertEqual([o['id'] for o in seen], expected)
+        order = seen[0]
+        lines = OrderItem.objects.filter(order_id=order['id']).order_by('id')
+        self.assertEqual([(i['product'], i['quantity']) for i in order['items']],
+                         [(i.product_id, i.quantity) for i in lines])
+        self.assertEqual(order['item_count'], sum(i.quantity for i in lines))
+
+    def test_tampered_cursor_is_refused(self):
+        response = self.client.get(reverse('orders_list'), {'cursor': 'not-a-cursor'}, **self.fx.headers(self.fx.shopper))
+        self.assertEqual(response.status_code, 400)
+
+
+class TokenRevocationTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user('shopper', password='old-pass-1')
+        UserProfile.objects.create(user=self.user)
+        self.admin = User.objects.create_user('admin', password='admin-pass-1', is_staff=True)
+
+    def get_orders(self, user=None, token=None):
+        token = token or views.generate_token(user or self.user)
+        return self.client.get(reverse('orders_list'), HTTP_AUTHORIZATION=f"Bearer {token}")
+
+    def test_token_of_an_older_version_is_refused(self):
+        token = views.generate_token(self.user)
+        self.assertEqual(self.get_orders(token=token).status_code, 200)  # now cached
+        self.assertEqual(self.client.post(reverse('user_logout'), HTTP_AUTHORIZATION=f"Bearer {token}").status_code, 200)
+        self.assertEqual(self.get_orders(token=token).status_code, 401)
+        self.assertEqual(self.get_orders().status_code, 200)
+
+    def test_changed_password_revokes_earlier_tokens(self):
+        token = views.generate_token(self.user)
+        response = self.client.post(reverse('change_password'), {'old_password': 'old-pass-1', 'new_password': 'new-pass-2'},
+                                    content_type='application/json', HTTP_AUTHORIZATION=f"Bearer {token}")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.get_orders(token=token).status_code, 401)
+        self.assertEqual(self.get_orders(token=response.json()['token']).status_code, 200)
+
+    def test_deactivated_user_is_refused(self):
+        token = views.generate_token(self.user)
+        self.assertEqual(self.get_orders(token=token).status_code, 200)
+        response = self.client.post(reverse('admin_deactivate_user', args=[self.user.pk]),
+                                    HTTP_AUTHORIZATION=f"Bearer {views.generate_token(self.admin)}")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.get_orders(token=token).status_code, 401)
+
+    def legacy_token(self):
+        # As issued before tokens carried claims and a version
+        payload = {'user_id': self.user.pk, 'exp': datetime.datetime.now() + datetime.timedelta(hours=1),
+                   'iat': datetime.datetime.now()}
+        return jwt.encode(payload, views.JWT_SECRET, algorithm=views.JWT_ALGO)
+
+    def test_unversioned_token_of_a_deactivated_user_is_refused(self):
+        self.user.is_active = False
+        self.user.save()
+        self.assertEqual(self.get_orders(token=self.legacy_token()).status_code, 401)
+
+    def test_unversioned_token_is_refused_after_a_password_change(self):
+        token = self.legacy_token()
+        response = self.client.post(reverse('change_password'), {'old_password': 'old-pass-1', 'new_password': 'new-pass-2'},
+                                    content_type='application/json', HTTP_AUTHORIZATION=f"Bearer {views.generate_token(self.user)}")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.get_orders(token=token).status_code, 401)
+
+
+class ImageUploadTests(TestCase):
+    def setUp(self):
+        media = tempfile.TemporaryDirectory()
+        self.addCleanup(media.cleanup)
+        self.spool = os.path.join(media.name, 'spool')
+        settings = override_settings(IMAGE_UPLOAD_BACKEND='api.uploads.LocalFileStorage', IMAGE_UPLOAD_EAGER=True,
+                                     MEDIA_ROOT=media.name, IMAGE_UPLOAD_SPOOL_DIR=self.spool)
+        settings.enable()
+        self.addCleanup(settings.disable)
+        self.admin = User.objects.create_user('admin', password='admin-pass-1', is_staff=True)
+        Category.objects.create(name='Cameras', slug='cameras')
+
+    def test_product_images_are_uploaded_in_the_background(self):
+        form = {'title': 'Camera', 'slug': 'camera', 'description': 'New', 'price': '99.99', 'brand': 'Brand',
+                'stock': '3', 'category_name': 'Cameras',
+                'images': [SimpleUploadedFile(f'{n}.jpg', b'jpeg bytes', content_type='image/jpeg') for n in range(2)]}
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(reverse('products_list_create'), form,
+                                        HTTP_AUTHORIZATION=f"Bearer {views.generate_token(self.admin)}")
+        self.assertEqual(response.status_code, 201)
+        jobs = ImageUploadJob.objects.filter(product__slug='camera')
+        self.assertEqual([j.status for j in jobs], ['done', 'done'])
+        self.assertEqual(ProductImage.objects.filter(product__slug='camera').count(), 2)
+        self.assertEqual(os.listdir(self.spool), [])
+
+    def test_resume_retries_jobs_stuck_running(self):
+        product = Product.objects.create(title='Lens', slug='lens', price=10, category=Category.objects.get())
+        stuck = enqueue_uploads(product, [SimpleUploadedFile('lens.jpg', b'jpeg bytes')])[0]
+        ImageUploadJob.objects.filter(pk=stuck.pk).update(
+            status='running', started_at=timezone.now() - datetime.timedelta(hours=1))
+        call_command('resume_image_uploads', stdout=io.StringIO())
+        stuck.refresh_from_db()
+        self.assertEqual(stuck.status, 'done')
+        self.assertEqual(os.listdir(self.spool), [])
+
+
+REPLICA = 'replica_test'
+
+
+@override_settings(DATABASE_REPLICAS=[REPLICA], REPLICA_CHECK_INTERVAL=None, REPLICA_MAX_LAG=10)
+class ReplicaRoutingTests(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        # A second in-memory SQLite database standing in for a replica, for
+        # this class only (the test runner never hears of it). Migrated before
+        # DATABASE_REPLICAS names it, which would keep the router from
+        # creating its tables.
+        cls.databases = {'default', REPLICA}
+        connections.settings[REPLICA] = connections.configure_settings(
+            {'default': connections.settings['default'],
+             REPLICA: {'ENGINE': 'django.db.backends.sqlite3', 'NAME': ''}})[REPLICA]
+        connections[REPLICA].creation.create_test_db(verbosity=0, autoclobber=True)
+        cls.addClassCleanup(cls.drop_replica)
+        super().setUpClass()
+
+    @classmethod
+    def drop_replica(cls):
+        connections[REPLICA].close()
+        del connections[REPLICA]
+        del connections.settings[REPLICA]
+
+    def setUp(self):
+        cache.clear()
+        self.monitor = replicas.replica_monitor
+        self.addCleanup(setattr, self.monitor, 'status', self.monitor.status)
+
+    def route_reads(self, user_id, reads=1):
+        """Where a @replica_reads GET view by this user sends its queries, as ReplicaMiddleware sets it up."""
+        view = replicas.replica_reads(lambda request: [replicas.ReplicaRouter().db_for_read(Product)
+                                                       for _ in range(reads)])
+        token = replicas._request.set({'user_id': user_id, 'reads': False, 'wrote': False})
+        try:
+            return view(RequestFactory().get('/'))
+        finally:
+            replicas._request.reset(token)
+
+    def route_read(self, user_id):
+        return self.route_reads(user_id)[0]
+
+    def beat(self, behind=0):
+        replicas.beat()
+        beat_at = ReplicaHeartbeat.objects.using('default').get(pk=1).beat_at
+        ReplicaHeartbeat.objects.using(REPLICA).update_or_create(
+            pk=1, defaults={'beat_at': beat_at - datetime.timedelta(seconds=behind)})
+
+    def test_reads_stick_to_the_primary_after_a_write(self):
+        self.beat()
+        self.monitor.check()
+        writer = User.objects.create_user('writer')
+        product = Product.objects.create(title='Lamp', slug='lamp', price=10)
+        self.assertEqual(self.route_read(writer.pk), REPLICA)
+        response = self.client.post(reverse('wishlist_add'), {'product_id': product.pk}, content_type='application/json',
+                                    HTTP_AUTHORIZATION=f"Bearer {views.generate_token(writer)}")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.route_read(writer.pk), 'default')
+        self.assertEqual(self.route_read(writer.pk + 1), REPLICA)
+
+    def test_the_pin_is_looked_up_once_per_request(self):
+        self.beat()
+        self.monitor.check()
+        replicas.pin(7)
+        with mock.patch.object(replicas, 'is_pinned', wraps=replicas.is_pinned) as is_pinned:
+            self.assertEqual(self.route_reads(7, reads=3), ['default'] * 3)
+            self.assertEqual(self.route_reads(8, reads=3), [REPLICA] * 3)
+        self.assertEqual(is_pinned.call_args_list, [mock.call(7), mock.call(8)])
+
+    def test_payu_callback_pins_the_buyer(self):
+        self.beat()
+        self.monitor.check()
+        buyer = User.objects.create_user('buyer')
+        product = Product.objects.create(title='Lamp', slug='lamp', price=10, stock=5)
+        carts.add_line(buyer.pk, product.pk, 1)
+        # No bearer token: PayU posts the callback, not the buyer
+        response = self.client.post(reverse('payu_success'), {'udf1': buyer.pk, 'txnid': 'txn-1', 'status': 'success'})
+        self.assertEqual(response['Location'], "http://localhost:5173/Success")
+        self.assertEqual(self.route_read(buyer.pk), 'default')
+        self.assertEqual(self.route_read(buyer.pk + 1), REPLICA)
+
+    def test_lagging_replica_leaves_rotation(self):
+        self.beat(behind=60)
+        self.assertFalse(self.monitor.check()[REPLICA]['healthy'])
+        self.assertEqual(self.route_read(None), 'default')
+        self.beat(behind=1)
+        self.assertEqual(self.monitor.check()[REPLICA]['lag'], 1.0)
+        self.assertEqual(self.route_read(None), REPLICA)
+
+
+class ProductListQueryTests(TestCase):
+    def setUp(self):
+        for n in range(3):
+            Product.objects.create(title=f'Item {n}', slug=f'item-{n}', price=10 + n)
+
+    def get(self, **params):
+        return self.client.get(reverse('products_list_create'), params)
+
+    def test_pages_follow_the_cursor(self):
+        first = self.get(sort='price_asc', limit=2).json()
+        second = self.get(sort='price_asc', limit=2, cursor=first['next_cursor']).json()
+        self.assertEqual([p['slug'] for p in first['results'] + second['results']], ['item-0', 'item-1', 'item-2'])
+        self.assertIsNone(second['next_cursor'])
+
+    def test_tampered_cursors_are_refused(self):
+        for sort, values in [('price_asc', ['cheap', '1']), ('price_asc', ['10.00', 'one']),
+                             ('newest', ['yesterday', '1']), ('rating', ['nan', '1'])]:
+            response = self.get(sort=sort, cursor=encode_cursor(values))
+            self.assertEqual((response.status_code, response.json()), (400, {'error': 'Invalid cursor'}), (sort, values))
+        self.assertEqual(self.get(cursor='not base64!').status_code, 400)
+
+    def test_non_finite_prices_are_refused(self):
+        for value in ('NaN', 'Infinity', '-inf', 'cheap'):
+            response = self.get(min_price=value)
+            self.assertEqual((response.status_code, response.json()), (400, {'error': 'Invalid min_price'}))
+        self.assertEqual(len(self.get(min_price='10.5', max_price='11').json()['results']), 1)
+        self.assertEqual(self.get(min_price='1e999').json()['results'], [])
+
+
+class LeanRenderingTests(TestCase):
+    def setUp(self):
+        self.admin = User.objects.create(username='seller', is_staff=True)
+        category = Category.objects.create(name='Audio', slug='audio')
+        rated = Product.objects.create(title='Speaker', slug='speaker', price=Decimal('19.90'), brand='Acme',
+                                       category=category, created_by=self.admin, stock=3)
+        ProductImage.objects.create(product=rated, image_url='https://img.example.com/1.jpg', is_featured=True)
+        ProductImage.objects.create(product=rated, image_url='https://img.example.com/2.jpg')
+        rating = ProductRating(product=rated)
+        rating.apply(added=4)
+        rating.save()
+        # Uncategorized, unrated, whole price, older
+        plain = Product.objects.create(title='Cable', slug='cable', price=5, created_by=self.admin)
+        Product.objects.filter(pk=plain.pk).update(created_at=timezone.now() - datetime.timedelta(days=1))
+
+    def serialized(self):
+        products = Product.objects.filter(created_by=self.admin).order_by('-created_at')
+        return JsonResponse(ProductSerializer(products, many=True).data, safe=False).content
+
+    def test_my_products_match_the_serializer_byte_for_byte(self):
+        response = self.client.get(reverse('my_products'),
+                                   HTTP_AUTHORIZATION=f"Bearer {views.generate_token(self.admin)}")
+        self.assertEqual(response.content, self.serialized())
+
+    def test_product_list_matches_the_serializer(self):
+        results = self.client.get(reverse('products_list_create'), {'sort': 'newest'}).json()['results']
+        self.assertEqual(results, json.loads(self.serialized()))
+
+
+@override_settings(CONDITIONAL_GET=True)
+class ConditionalGetTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.lamp = Product.objects.create(title='Lamp', slug='lamp', price=10, stock=5)
+
+    def get_list(self, etag=None):
+        headers = {'HTTP_IF_NONE_MATCH': etag} if etag else {}
+        return self.client.get(reverse('products_list_create'), **headers)
+
+    def checkout(self, quantity):
+        with self.captureOnCommitCallbacks(execute=True), transaction.atomic():
+            reserve_stock([{'product_id': self.lamp.pk, 'quantity': quantity}])
+
+    def test_checkouts_change_the_validators(self):
+        detail = reverse('product_detail', args=[self.lamp.pk])
+        etag, detail_etag = self.get_list()['ETag'], self.client.get(detail)['ETag']
+        self.assertEqual(self.get_list(etag).status_code, 304)
+        self.checkout(2)
+        response = self.get_list(etag)
+        self.assertEqual(response.status_code, 200)  # its stock moved
+        self.assertEqual(response.json()['results'][0]['stock'], 3)
+        self.assertEqual(self.client.get(detail, HTTP_IF_NONE_MATCH=detail_etag).status_code, 200)
+
+    @override_settings(CONDITIONAL_GET=False)
+    def test_no_validators_without_a_shared_cache(self):
+        response = self.get_list()
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(response.has_header('ETag') or response.has_header('Last-Modified'))
+
+
+class ProductSearchTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        product_search.mark_stale()
+        self.addCleanup(product_search.mark_stale)
+        audio = Category.objects.create(name='Audio', slug='audio')
+        self.headphones = Product.objects.create(title='Wireless Headphones', slug='headphones', price=99,
+                                                 brand='Sony', category=audio)
+        self.charger = Product.objects.create(title='Phone Charger', slug='charger', price=19, brand='Anker')
+        self.kettle = Product.objects.create(title='Coffee Maker', slug='kettle', price=49, brand='Bosch')
+
+    def search(self, q):
+        return [p['id'] for p in self.client.get(reverse('products_list_create'), {'q': q}).json()['results']]
+
+    def test_typos_and_prefixes_match(self):
+        self.assertEqual(self.search('headphnoes'), [self.headphones.pk])  # swapped letters
+        self.assertEqual(self.search('wireles'), [self.headphones.pk])     # dropped letter, or a prefix
+        self.assertEqual(self.search('phone char'), [self.charger.pk])        # last word still being typed
+        self.assertEqual(self.search('audio'), [self.headphones.pk])       # category name
+
+    def test_writes_reach_the_built_index(self):
+        self.assertEqual(self.search('grinder'), [])
+        with self.captureOnCommitCallbacks(execute=True):
+            grinder = Product.objects.create(title='Espresso Grinder', slug='grinder', price=150)
+            self.kettle.title = 'Tea Kettle'
+            self.kettle.save()
+        self.assertEqual(self.search('grinder'), [grinder.pk])
+        self.assertEqual(self.search('kettle'), [self.kettle.pk])
+        self.assertEqual(self.search('coffee'), [])
+
+    def test_expired_index_answers_while_it_rebuilds(self):
+        self.assertEqual(self.search('coffee'), [self.kettle.pk])
+        started, release = threading.Event(), threading.Event()
+
+        def load(index):
+            started.set()
+            release.wait(5)
+            index._add({'id': 999, 'title': 'Espresso Grinder'})  # written by another worker
+
+        with mock.patch.object(ProductSearchIndex, '_load', load), override_settings(SEARCH_INDEX_TTL=0):
+            self.assertEqual(self.search('coffee'), [self.kettle.pk])
+            self.assertTrue(started.wait(5))
+            # Still the current copy, without waiting; a write lands meanwhile
+            self.assertEqual(self.search('coffee'), [self.kettle.pk])
+            with self.captureOnCommitCallbacks(execute=True):
+                self.kettle.title = 'Tea Kettle'
+                self.kettle.save()
+            release.set()
+            for _ in range(500):
+                if not product_search._rebuilding:
+                    break
+                time.sleep(0.01)
+        self.assertEqual([pk for _, pk in product_search.search('grinder')], [999])
+        self.assertEqual([pk for _, pk in product_search.search('kettle')], [self.kettle.pk])  # replayed
+
+
+class ProductFacetTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        product_facets.mark_stale()
+        self.addCleanup(product_facets.mark_stale)
+        audio = Category.objects.create(name='Audio', slug='audio')
+        video = Category.objects.create(name='Video', slug='video')
+        for n, (category, brand, price) in enumerate([(audio, 'Sony', 100), (audio, 'Sony', 700),
+                                                      (audio, 'Bose', 300), (video, 'Sony', 3000)]):
+            Product.objects.create(title=f'Item {n}', slug=f'item-{n}', price=price, brand=brand, category=category)
+
+    def facets(self, **params):
+        facets = self.client.get(reverse('products_list_create'), params).json()['facets']
+        return ({c['slug']: c['count'] for c in facets['categories']},
+                {b['value']: b['count'] for b in facets['brands']},
+                {p['min']: p['count'] for p in facets['price'] if p['count']})
+
+    def test_each_facet_ignores_its_own_filter(self):
+        categories, brands, prices = self.facets(category='audio', brand='Sony')
+        self.assertEqual(categories, {'audio': 2, 'video': 1})  # Sony, any category
+        self.assertEqual(brands, {'Sony': 2, 'Bose': 1})        # audio, any brand
+        self.assertEqual(prices, {0: 1, 500: 1})                # audio and Sony
+        categories, brands, prices = self.facets()
+        self.assertEqual((categories, brands), ({'audio': 3, 'video': 1}, {'Sony': 3, 'Bose': 1}))
+        self.assertEqual(prices, {0: 2, 500: 1, 2500: 1})
+
+    def test_filtered_listing_follows_the_index(self):
+        url = reverse('products_list_create')
+        self.assertEqual(len(self.client.get(url, {'brand': 'Sony'}).json()['results']), 3)
+        with self.assertNumQueries(0):  # nothing matches: no page query
+            response = self.client.get(url, {'brand': 'Sony', 'max_price': 50}).json()
+        self.assertEqual(response['results'], [])
+
+    @override_settings(INDEX_REBUILD_EAGER=True)
+    def test_refresh_picks_up_writes_that_skipped_signals(self):
+        self.facets()
+        Product.objects.bulk_create([Product(title='Item 4', slug='item-4', price=50, brand='Bose')])
+        self.assertEqual(self.facets()[1], {'Sony': 3, 'Bose': 1})
+        product_facets.refresh()
+        self.assertEqual(self.facets()[1], {'Sony': 3, 'Bose': 2})
+
+
+class ProductRatingTests(TestCase):
+    def setUp(self):
+        self.product = Product.objects.create(title='Lamp', slug='lamp', price=10)
+        self.users = [User.objects.create_user(f'reviewer-{n}') for n in range(3)]
+
+    def summary(self):
+        rating = ProductRating.objects.get(product=self.product)
+        return rating.count, rating.average, rating.histogram()
+
+    def test_summary_follows_review_writes(self):
+        first, second = (Review.objects.create(product=self.product, user=u, rating=r)
+                         for u, r in zip(self.users, (5, 2)))
+        self.assertEqual(self.summary(), (2, 3.5, {'1': 0, '2': 1, '3': 0, '4': 0, '5': 1}))
+        second.rating = 4
+        second.save()
+        self.assertEqual(self.summary(), (2, 4.5, {'1': 0, '2': 0, '3': 0, '4': 1, '5': 1}))
+        first.delete()
+        self.assertEqual(self.summary(), (1, 4.0, {'1': 0, '2': 0, '3': 0, '4': 1, '5': 0}))
+
+    def test_deleting_the_product_skips_the_summary(self):
+        for user in self.users:
+            Review.objects.create(product=self.product, user=user, rating=3)
+        with self.assertNumQueries(10):  # the cascade only; no summary update per review
+            self.product.delete()
+        self.assertFalse(ProductRating.objects.exists())
+
+
+@override_settings(INDEX_REBUILD_EAGER=True)
+class ProductImporterTests(TestCase):
+    def test_upserts_by_slug_and_reports_bad_rows(self):
+        owner = User.objects.create_user('owner')
+        lamp = Product.objects.create(title='Lamp', slug='lamp', price=10, created_by=owner)
+        rows = '\n'.join([
+            'title,slug,price,stock,category,image_urls',
+            'Desk Lamp,lamp,12.50,4,Lighting,',
+            'Desk,desk,99,1,Furniture,',
+            'Stool,stool,cheap,1,Furniture,',
+            ',nameless,5,1,Furniture,',
+            'Chair,chair,45,2,Furniture,"https://img.example.com/1.jpg,https://img.example.com/2.jpg"',
+        ])
+        importer = ProductImporter(user=User.objects.create_user('admin', is_staff=True), chunk_size=10)
+        report = importer.run(iter_rows(io.StringIO(rows), 'csv'))
+
+        self.assertEqual({k: report[k] for k in ('rows', 'created', 'updated', 'failed')},
+                         {'rows': 5, 'created': 2, 'updated': 1, 'failed': 2})
+        self.assertEqual([e['row'] for e in report['errors']], [3, 4])
+        lamp.refresh_from_db()
+        self.assertEqual((lamp.title, lamp.price, lamp.created_by), ('Desk Lamp', Decimal('12.50'), owner))
+        chair = Product.objects.get(slug='chair')
+        self.assertEqual(chair.category.name, 'Furniture')
+        self.assertEqual(chair.images.count(), 2)
+        self.assertTrue(ProductRating.objects.filter(product=chair).exists())
+        self.assertFalse(Product.objects.filter(slug='stool').exists())
+
+    def run_import(self, rows, **kwargs):
+        return ProductImporter(chunk_size=10, **kwargs).run(iter_rows(io.StringIO('\n'.join(rows)), 'csv'))
+
+    def test_category_names_with_the_same_slug_share_a_category(self):
+        report = self.run_import(['title,category', 'Speaker,Audio & Video', 'Receiver,Audio Video', 'Mixer,audio video'])
+        self.assertEqual(report['failed'], 0)
+        self.assertEqual(list(Category.objects.values_list('name', 'slug')), [('Audio & Video', 'audio-video')])
+        self.assertEqual(Product.objects.filter(category__slug='audio-video').count(), 3)
+
+    def test_out_of_range_numbers_are_row_errors(self):
+        report = self.run_import(['title,price,stock', 'Yacht,123456789,1', 'Crate,5,99999999999', 'Cup,5,1'])
+        self.assertEqual(report['errors'], [{'row': 1, 'error': 'Price out of range'},
+                                            {'row': 2, 'error': 'Stock out of range'}])
+        self.assertEqual(list(Product.objects.values_list('slug', flat=True)), ['cup'])
+
+    def test_partial_columns_leave_the_others_alone(self):
+        lighting = Category.objects.create(name='Lighting', slug='lighting')
+        lamp = Product.objects.create(title='Lamp', slug='lamp', price=Decimal('49.99'), stock=12, category=lighting,
+                                      description='Brass', brand='Ikea', is_active=False)
+        report = self.run_import(['title,slug', 'Desk Lamp,lamp'])
+        self.assertEqual(report['updated'], 1)
+        lamp.refresh_from_db()
+        self.assertEqual((lamp.title, lamp.price, lamp.stock, lamp.category, lamp.description, lamp.brand, lamp.is_active),
+                         ('Desk Lamp', Decimal('49.99'), 12, lighting, 'Brass', 'Ikea', False))
+
+    def test_blank_cells_leave_the_values_alone(self):
+        lighting = Category.objects.create(name='Lighting', slug='lighting')
+        lamp = Product.objects.create(title='Lamp', slug='lamp', price=Decimal('49.99'), stock=12, category=lighting,
+                                      brand='Ikea', is_active=False)
+        report = self.run_import(['title,slug,price,stock,brand,category,is_active',
+                                  'Desk Lamp,lamp,,,, ,', 'Desk,desk,,,,,'])
+        self.assertEqual((report['created'], report['updated'], report['failed']), (1, 1, 0))
+        lamp.refresh_from_db()
+        self.assertEqual((lamp.title, lamp.price, lamp.stock, lamp.brand, lamp.category, lamp.is_active),
+                         ('Desk Lamp', Decimal('49.99'), 12, 'Ikea', lighting, False))
+        desk = Product.objects.get(slug='desk')
+        self.assertEqual((desk.price, desk.stock, desk.category, desk.is_active), (Decimal('0.00'), 0, None, True))
+
+    def test_a_failing_row_does_not_fail_its_chunk(self):
+        bulk_create = Product.objects.bulk_create
+
+        def refuse_bad_rows(objs, **kwargs):
+            if any(o.slug == 'bad' for o in objs):
+                raise IntegrityError('refused')
+            return bulk_create(objs, **kwargs)
+
+        with mock.patch.object(Product.objects, 'bulk_create', side_effect=refuse_bad_rows):
+            report = self.run_import(['title,slug', 'Good,good', 'Bad,bad', 'Fine,fine'])
+        self.assertEqual((report['created'], report['errors']), (2, [{'row': 2, 'error': 'refused'}]))
+        self.assertEqual(sorted(Product.objects.values_list('slug', flat=True)), ['fine', 'good'])
+
+    def queue_import(self, rows, name='catalog.csv'):
+        admin = User.objects.create_user('admin', is_staff=True)
+        upload = SimpleUploadedFile(name, '\n'.join(rows).encode(), content_type='text/csv')
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(reverse('products_import'), {'file': upload},
+                                        HTTP_AUTHORIZATION=f"Bearer {views.generate_token(admin)}")
+        self.assertEqual(response.status_code, 202)
+        return admin, response.json()['id']
+
+    @override_settings(PRODUCT_IMPORT_EAGER=True)
+    def test_uploads_are_imported_in_the_background(self):
+        admin, job_id = self.queue_import(['title,slug,price', 'Desk,desk,99', ',nameless,5'])
+        response = self.client.get(reverse('import_job_detail', args=[job_id]),
+                                   HTTP_AUTHORIZATION=f"Bearer {views.generate_token(admin)}")
+        job = response.json()
+        self.assertEqual(job['status'], 'done')
+        self.assertEqual({k: job['report'][k] for k in ('rows', 'created', 'failed')},
+                         {'rows': 2, 'created': 1, 'failed': 1})
+        self.assertEqual(Product.objects.get(slug='desk').created_by, admin)
+        self.assertFalse(os.path.exists(ProductImportJob.objects.get().spool_path))
+
+    def test_resume_runs_jobs_stuck_running(self):
+        with mock.patch('api.importer.submit'):
+            _, job_id = self.queue_import(['title,slug', 'Desk,desk'])
+        ProductImportJob.objects.filter(pk=job_id).update(
+            status='running', started_at=timezone.now() - datetime.timedelta(days=1))
+        call_command('resume_product_imports', stdout=io.StringIO())
+        self.assertEqual(ProductImportJob.objects.get().status, 'done')
+        self.assertTrue(Product.objects.filter(slug='desk').exists())
+
+
+class SalesRollupTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('buyer')
+        self.product = Product.objects.create(title='Lamp', slug='lamp', price=10, stock=5)
+
+    def place_order(self):
+        order = Order.objects.create(user=self.user, total_amount=20, status='paid')
+        OrderItem.objects.create(order=order, product=self.product, quantity=2, unit_price=Decimal('10.00'))
+        record_order(order, [{'product_id': self.product.pk, 'quantity': 2, 'unit_price': Decimal('10.00')}])
+        return order
+
+    def totals(self):
+        return DailySales.objects.filter(day=timezone.localdate()).values_list('orders', 'units', 'revenue').first()
+
+    def test_rollups_follow_committed_orders_only(self):
+        with self.captureOnCommitCallbacks(execute=True), transaction.atomic():
+            self.place_order()
+        self.assertEqual(self.totals(), (1, 2, Decimal('20.00')))
+        with self.captureOnCommitCallbacks(execute=True), self.assertRaises(OutOfStock), transaction.atomic():
+            self.place_order()
+            raise OutOfStock([])  # the checkout fails after recording its sale
+        self.assertEqual(self.totals(), (1, 2, Decimal('20.00')))
+
+    def test_checkouts_leave_the_day_row_unlocked(self):
+        # Every checkout of the day shares the DailySales row: a checkout's
+        # transaction must not touch it, or checkouts would wait on each other
+        with self.captureOnCommitCallbacks(execute=True), transaction.atomic():
+            with CaptureQueriesContext(connections['default']) as ctx:
+                self.place_order()
+                self.place_order()
+            self.assertEqual([q['sql'] for q in ctx if 'dailysales' in q['sql'].lower()], [])
+            self.assertIsNone(self.totals())
+        self.assertEqual(self.totals(), (2, 4, Decimal('40.00')))
+
+    def test_a_failed_rollup_keeps_the_order_and_rebuild_repairs_it(self):
+        with mock.patch('api.analytics.apply_sale', side_effect=IntegrityError), \
+                self.assertLogs('api.analytics', 'ERROR'), \
+                self.captureOnCommitCallbacks(execute=True), transaction.atomic():
+            order = self.place_order()
+        self.assertTrue(Order.objects.filter(pk=order.pk).exists())
+        self.assertIsNone(self.totals())
+        call_command('rebuild_sales_rollups', stdout=io.StringIO())
+        self.assertEqual(self.totals(), (1, 2, Decimal('20.00')))
+
+
+class ServerTimingTests(TestCase):
+    def setUp(self):
+        cache.clear()  # auth state cached for users of earlier tests
+        self.staff = User.objects.create(username='staff', is_staff=True)
+        self.shopper = User.objects.create(username='shopper')
+        for n in range(3):
+            Product.objects.create(title=f'Item {n}', slug=f'item-{n}', price=10 + n)
+
+    def get(self, user=None, **params):
+        headers = {'HTTP_AUTHORIZATION': f"Bearer {views.generate_token(user)}"} if user else {}
+        return self.client.get(reverse('products_list_create'), params, **headers)
+
+    def phases(self, response):
+        return {m['name']: m for m in re.finditer(
+            r'(?P<name>\w+);dur=(?P<dur>[\d.]+)(?:;desc="(?P<queries>\d+) queries")?', response['Server-Timing'])}
+
+    @override_settings(SERVER_TIMING_SAMPLE_RATE=1)
+    def test_header_reports_the_queries_run(self):
+        with CaptureQueriesContext(connections['default']) as ctx:
+            response = self.get()
+        phases = self.phases(response)
+        self.assertEqual(set(phases), {'db', 'serialize', 'render', 'app', 'total'})
+        self.assertEqual(int(phases['db']['queries']), len(ctx))
+        self.assertGreater(len(ctx), 0)
+        self.assertAlmostEqual(float(phases['db']['dur']),
+                               sum(float(q['time']) * 1000 for q in ctx), delta=len(ctx))  # times rounded to 1ms
+        self.assertLessEqual(float(phases['db']['dur']), float(phases['total']['dur']))
+
+    @override_settings(SERVER_TIMING_SAMPLE_RATE=0)
+    def test_unsampled_requests_get_no_header(self):
+        self.assertNotIn('Server-Timing', self.get())
+
+    @override_settings(SERVER_TIMING_SAMPLE_RATE=0)
+    def test_debug_envelope_is_for_staff_only(self):
+        response = self.get(self.staff, _debug='timing')
+        body = response.json()
+        self.assertEqual(len(body['data']['results']), 3)
+        self.assertEqual(body['_debug']['queries'], int(self.phases(response)['db']['queries']))
+        for user in (self.shopper, None):
+            response = self.get(user, _debug='timing')
+            self.assertNotIn('_debug', response.json())
+            self.assertNotIn('Server-Timing', response)
+
+
+class MetricsTests(TestCase):
+    def sample(self, name, **labels):
+        return REGISTRY.get_sample_value(name, labels) or 0
+
+    def test_requests_are_labelled_by_url_name(self):
+        Product.objects.create(title='Lamp', slug='lamp', price=10)
+        before = {
+            'routed': self.sample('api_requests_total', view='products_list_create', method='GET', status='200'),
+            'latency': self.sample('api_request_duration_seconds_count', view='products_list_create'),
+            'queries': self.sample('api_request_db_queries_count', view='products_list_create'),
+            'unmatched': self.sample('api_requests_total', view='unmatched', method='GET', status='404'),
+        }
+        self.client.get(reverse('products_list_create'))
+        for path in ('/api/no-such-page/', '/api/no-such-page/1/', '/elsewhere/'):
+            self.client.get(path)
+        self.assertEqual(self.sample('api_requests_total', view='products_list_create', method='GET', status='200'),
+                         before['routed'] + 1)
+        self.assertEqual(self.sample('api_request_duration_seconds_count', view='products_list_create'),
+                         before['latency'] + 1)
+        self.assertEqual(self.sample('api_request_db_queries_count', view='products_list_create'), before['queries'] + 1)
+        # Unrouted paths share one label instead of one per path
+        self.assertEqual(self.sample('api_requests_total', view='unmatched', method='GET', status='404'),
+                         before['unmatched'] + 3)
+
+    def test_scrapes_need_the_token(self):
+        url = reverse('metrics')
+        with override_settings(METRICS_TOKEN=None):
+            self.assertEqual(self.client.get(url).status_code, 403)
+            with override_settings(DEBUG=True):
+                self.assertEqual(self.client.get(url).status_code, 200)
+        with override_settings(METRICS_TOKEN='s3cret'):
+            self.assertEqual(self.client.get(url).status_code, 403)
+            self.assertEqual(self.client.get(url, HTTP_AUTHORIZATION='Bearer wrong').status_code, 403)
+            response = self.client.get(url, HTTP_AUTHORIZATION='Bearer s3cret')
+            self.assertEqual(response.status_code, 200)
+            self.assertIn(b'api_requests_total', response.content)
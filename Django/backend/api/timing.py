@@ -0,0 +1,215 @@
+import json
+import random
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.conf import settings
+from django.db import connections
+from django.db.backends.signals import connection_created
+from django.http import JsonResponse
+
+# ----------------------------
+# Per-request timing (Server-Timing)
+# ----------------------------
+# For a sample of requests (SERVER_TIMING_SAMPLE_RATE) the middleware measures
+# SQL (count and time, via the DB execute hook below), DRF serialization (the
+# TimedSerializer mixin in serializers.py) and JSON rendering (JsonResponse
+# below) and reports them in a Server-Timing header. Unsampled requests only
+# pay for one random() call and a context variable lookup per serializer call.
+# Staff can add ?_debug=timing to any JSON endpoint to always get timings,
+# plus the slowest statements, in a {"data": ..., "_debug": ...} envelope.
+
+DEBUG_PARAM = '_debug'
+DEBUG_SLOW_QUERIES = 10
+
+_current = ContextVar('request_timing', default=None)
+
+
+# --- Query observation ---
+# One execute wrapper is installed on every DB connection when it opens. It
+# reports to whatever observers the current context registered, so it sees
+# queries run from sync_to_async threads under ASGI as well as under WSGI.
+
+_query_observers = ContextVar('query_observers', default=())
+
+
+def _execute_hook(execute, sql, params, many, context):
+    observers = _query_observers.get()
+    if not observers:
+        return execute(sql, params, many, context)
+    started = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        elapsed = time.perf_counter() - started
+        for observer in observers:
+            observer(sql, elapsed)
+
+
+def install_query_hook(connection, **kwargs):
+    if _execute_hook not in connection.execute_wrappers:
+        connection.execute_wrappers.append(_execute_hook)
+
+
+connection_created.connect(install_query_hook)
+
+
+@contextmanager
+def observe_queries(observer):
+    """Call observer(sql, seconds) for every query run in this context."""
+    token = _query_observers.set(_query_observers.get() + (observer,))
+    try:
+        yield
+    finally:
+        _query_observers.reset(token)
+
+
+class RequestTiming:
+    def __init__(self, keep_queries=False):
+        self.started = time.perf_counter()
+        self.durations = {'db': 0.0, 'serialize': 0.0, 'render': 0.0}
+        self.queries = 0
+        self.serialize_db = 0.0  # lazy queries fired while serializing
+        self.keep_queries = keep_queries
+        self.statements = []   # (ms, sql) when keep_queries
+        self._depth = {}
+
+    # Nested serializers run inside their parent's phase: only the outermost counts
+    def enter(self, phase):
+        depth = self._depth.get(phase, 0)
+        self._depth[phase] = depth + 1
+        return time.perf_counter() if depth == 0 else None
+
+    def exit(self, phase, started):
+        self._depth[phase] -= 1
+        if started is not None:
+            self.durations[phase] += time.perf_counter() - started
+
+    def query(self, sql, elapsed):
+        self.queries += 1
+        self.durations['db'] += elapsed
+        if self._depth.get('serialize'):
+            self.serialize_db += elapsed
+        if self.keep_queries:
+            self.statements.append((elapsed * 1000, sql))
+
+    def metrics(self):
+        total = time.perf_counter() - self.started
+        durations = dict(self.durations, serialize=self.durations['serialize'] - self.serialize_db)
+        ms = {name: round(seconds * 1000, 2) for name, seconds in durations.items()}
+        ms['total'] = round(total * 1000, 2)
+        ms['app'] = round(max(ms['total'] - ms['db'] - ms['serialize'] - ms['render'], 0), 2)
+        return ms
+
+    def header(self):
+        ms = self.metrics()
+        return ', '.join([
+            f'db;dur={ms["db"]};desc="{self.queries} queries"',
+            f'serialize;dur={ms["serialize"]}',
+            f'render;dur={ms["render"]}',
+            f'app;dur={ms["app"]}',
+            f'total;dur={ms["total"]}',
+        ])
+
+    def debug(self):
+        slowest = sorted(self.statements, key=lambda s: -s[0])[:DEBUG_SLOW_QUERIES]
+        return {
+            'timing_ms': self.metrics(),
+            'queries': self.queries,
+            'slowest_queries': [{'ms': round(ms, 2), 'sql': sql} for ms, sql in slowest],
+        }
+
+
+class phase:
+    """Attribute the enclosed block to a Server-Timing phase (no-op when unsampled)."""
+
+    def __init__(self, name):
+        self.name = name
+
+    def __enter__(self):
+        self.timing = _current.get()
+        if self.timing is not None:
+            self.started = self.timing.enter(self.name)
+
+    def __exit__(self, *exc):
+        if self.timing is not None:
+            self.timing.exit(self.name, self.started)
+
+
+class TimedJsonResponse(JsonResponse):
+    """JsonResponse whose JSON encoding is reported as the 'render' phase."""
+
+    def __init__(self, *args, **kwargs):
+        with phase('render'):
+            super().__init__(*args, **kwargs)
+
+
+def _wants_debug(request):
+    if request.GET.get(DEBUG_PARAM) != 'timing':
+        return False
+    from .views import decode_token_from_request
+    user = decode_token_from_request(request)
+    return bool(user and user.is_staff)
+
+
+def _sampled():
+    rate = getattr(settings, 'SERVER_TIMING_SAMPLE_RATE', 0.1)
+    return rate > 0 and random.random() < rate
+
+
+@contextmanager
+def _timed(timing):
+    token = _current.set(timing)
+    try:
+        with observe_queries(timing.query):
+            yield
+    finally:
+        _current.reset(token)
+
+
+class ServerTimingMiddleware:
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+        for conn in connections.all():
+            install_query_hook(conn)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        debug = DEBUG_PARAM in request.GET and _wants_debug(request)
+        if not debug and not _sampled():
+            return self.get_response(request)
+        timing = RequestTiming(keep_queries=debug)
+        with _timed(timing):
+            response = self.get_response(request)
+        return self._finish(response, timing, debug)
+
+    async def __acall__(self, request):
+        debug = DEBUG_PARAM in request.GET and await sync_to_async(_wants_debug)(request)
+        if not debug and not _sampled():
+            return await self.get_response(request)
+        timing = RequestTiming(keep_queries=debug)
+        with _timed(timing):
+            response = await self.get_response(request)
+        return self._finish(response, timing, debug)
+
+    def _finish(self, response, timing, debug):
+        if debug and response.get('Content-Type', '').startswith('application/json'):
+            response = self._envelope(response, timing)
+        response['Server-Timing'] = timing.header()
+        return response
+
+    def _envelope(self, response, timing):
+        try:
+            data = json.loads(response.content)
+        except ValueError:
+            return response
+        # A different body: the original validators (ETag etc.) are not carried over
+        return JsonResponse({'data': data, '_debug': timing.debug()}, status=response.status_code)
@@ -0,0 +1,43 @@
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import F
+
+from .models import UserProfile
+
+# ----------------------------
+# Token revocation state
+# ----------------------------
+# Every JWT carries the user's token_version. A token is honoured while the
+# user is active and the version still matches, so bumping the version revokes
+# every token issued so far. The flags a token is checked against are cached
+# per user in the shared cache for AUTH_CACHE_TTL seconds, so most requests
+# need no auth query; revoke_tokens drops the entry so a revocation takes
+# effect on every worker at once.
+
+_MISSING = object()
+
+def _state_key(user_id):
+    return f"auth_state:{user_id}"
+
+def auth_state(user_id):
+    """(is_active, is_staff, is_superuser, token_version) for a user, or None if there is no such user."""
+    key = _state_key(user_id)
+    state = cache.get(key, _MISSING)
+    if state is _MISSING:
+        row = (User.objects.filter(pk=user_id)
+               .values_list('is_active', 'is_staff', 'is_superuser', 'profile__token_version')
+               .first())
+        state = (row[0], row[1], row[2], row[3] or 0) if row else None
+        cache.set(key, state, getattr(settings, 'AUTH_CACHE_TTL', 60))
+    return state
+
+def revoke_tokens(user):
+    """Invalidate every token issued to `user` so far."""
+    profile, _ = UserProfile.objects.get_or_create(user=user)
+    UserProfile.objects.filter(pk=profile.pk).update(token_version=F('token_version') + 1)
+    key = _state_key(user.id)
+    # Again on commit, in case a request cached the old state in between
+    cache.delete(key)
+    transaction.on_commit(lambda: cache.delete(key))
@@ -0,0 +1,176 @@
+import logging
+import os
+import tempfile
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.files.storage import FileSystemStorage
+from django.db import close_old_connections, transaction
+from django.db.models import Q
+from django.utils import timezone
+from django.utils.module_loading import import_string
+
+from .models import ImageUploadJob, ProductImage
+
+logger = logging.getLogger(__name__)
+
+# ----------------------------
+# Background image uploads
+# ----------------------------
+# Requests only spool uploaded files to local disk and record an
+# ImageUploadJob; a small thread pool pushes them to the storage backend and
+# attaches the ProductImage when each upload finishes. Clients poll
+# GET /api/uploads/<id>/ for the outcome.
+#
+# A job whose worker died mid-upload stays 'running'; `manage.py
+# resume_image_uploads` (run it at startup or from cron) puts jobs running for
+# longer than IMAGE_UPLOAD_STALE_AFTER back to pending, runs every pending job
+# and removes spool files no job needs any more.
+
+# --- Storage backends (IMAGE_UPLOAD_BACKEND) ---
+
+class CloudinaryStorage:
+    def save(self, path, name):
+        from cloudinary.uploader import upload as cloud_upload
+        return cloud_upload(path).get('secure_url')
+
+
+class LocalFileStorage:
+    """Filesystem stand-in for development and tests."""
+
+    def __init__(self):
+        self.storage = FileSystemStorage(
+            location=os.path.join(settings.MEDIA_ROOT, 'product-images'),
+            base_url=settings.MEDIA_URL + 'product-images/',
+        )
+
+    def save(self, path, name):
+        with open(path, 'rb') as f:
+            stored = self.storage.save(name, f)
+        return getattr(settings, 'IMAGE_UPLOAD_PUBLIC_HOST', '') + self.storage.url(stored)
+
+
+def get_storage():
+    return import_string(getattr(settings, 'IMAGE_UPLOAD_BACKEND', 'api.uploads.CloudinaryStorage'))()
+
+# --- Worker pool ---
+
+_executor = None
+_executor_lock = threading.Lock()
+
+def _get_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(
+                max_workers=getattr(settings, 'IMAGE_UPLOAD_WORKERS', 4),
+                thread_name_prefix='image-upload',
+            )
+    return _executor
+
+def _spool_dir():
+    path = getattr(settings, 'IMAGE_UPLOAD_SPOOL_DIR', None) or os.path.join(tempfile.gettempdir(), 'image-upload-spool')
+    os.makedirs(path, exist_ok=True)
+    return path
+
+def _spool(uploaded):
+    ext = os.path.splitext(uploaded.name or '')[1][:10]
+    path = os.path.join(_spool_dir(), f"{uuid.uuid4().hex}{ext}")
+    with open(path, 'wb') as out:
+        for chunk in uploaded.chunks():
+            out.write(chunk)
+    return path
+
+def enqueue_uploads(product, files):
+    """
+    Spool `files` and queue one job per file. Jobs start once the current
+    transaction commits. Returns the created jobs.
+    """
+    jobs = [
+        ImageUploadJob.objects.create(product=product, spool_path=_spool(f), file_name=(f.name or '')[:255])
+        for f in files
+    ]
+    for job in jobs:
+        transaction.on_commit(lambda pk=job.pk: submit(pk))
+    return jobs
+
+def submit(job_id):
+    if getattr(settings, 'IMAGE_UPLOAD_EAGER', False):
+        run_job(job_id)
+    else:
+        _get_executor().submit(_worker, job_id)
+
+def _worker(job_id):
+    # Pool threads keep their own DB connections; recycle them like a request would
+    close_old_connections()
+    try:
+        run_job(job_id)
+    finally:
+        close_old_connections()
+
+def run_job(job_id):
+    # Claim the job so it never runs twice (e.g. when resumed after a restart)
+    claimed = (ImageUploadJob.objects.filter(pk=job_id, status='pending')
+               .update(status='running', started_at=timezone.now()))
+    if not claimed:
+        return
+    job = ImageUploadJob.objects.get(pk=job_id)
+    try:
+        url = get_storage().save(job.spool_path, job.file_name or os.path.basename(job.spool_path))
+        if not url:
+            raise ValueError('Storage returned no URL')
+        image = ProductImage.objects.create(product_id=job.product_id, image_url=url)
+        ImageUploadJob.objects.filter(pk=job_id).update(status='done', image=image, finished_at=timezone.now())
+    except Exception as e:
+        logger.exception("Image upload %s failed", job_id)
+        ImageUploadJob.objects.filter(pk=job_id).update(status='failed', error=str(e), finished_at=timezone.now())
+    finally:
+        # Done or failed, the job is finished with its local copy
+        _remove_spool_file(job.spool_path)
+
+def _remove_spool_file(path):
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+def reset_stale_jobs():
+    """Put jobs left 'running' by a dead worker back to pending; returns how many."""
+    cutoff = timezone.now() - timedelta(seconds=getattr(settings, 'IMAGE_UPLOAD_STALE_AFTER', 15 * 60))
+    stale = Q(started_at__lt=cutoff) | Q(started_at__isnull=True)
+    return ImageUploadJob.objects.filter(stale, status='running').update(status='pending', started_at=None)
+
+def remove_orphaned_spool_files():
+    """
+    Delete spool files no pending or running job refers to, e.g. those of
+    jobs deleted together with their product. Returns how many were removed.
+    """
+    directory = _spool_dir()
+    # Skip fresh files: their job may not be committed yet
+    cutoff = time.time() - getattr(settings, 'IMAGE_UPLOAD_STALE_AFTER', 15 * 60)
+    needed = set(ImageUploadJob.objects.filter(status__in=['pending', 'running'])
+                 .values_list('spool_path', flat=True))
+    removed = 0
+    for entry in os.scandir(directory):
+        if entry.is_file() and entry.path not in needed and entry.stat().st_mtime < cutoff:
+            _remove_spool_file(entry.path)
+            removed += 1
+    return removed
+
+def job_data(job):
+    return {
+        'id': job.id,
+        'product': job.product_id,
+        'file_name': job.file_name,
+        'status': job.status,
+        'error': job.error,
+        'image_id': job.image_id,
+        'image_url': job.image.image_url if job.image_id else None,
+        'created_at': job.created_at,
+        'started_at': job.started_at,
+        'finished_at': job.finished_at,
+    }
@@ -6,7 +6,10 @@ urlpatterns = [
     path('auth/register/', views.user_register, name='user_register'),
     path('auth/login/', views.user_login, name='user_login'),
     path('auth/admin/register/', views.admin_register, name='admin_register'),
+    path('auth/logout/', views.user_logout, name='user_logout'), # POST (revokes every token of the user)
+    path('auth/password/', views.change_password, name='change_password'), # POST (returns a fresh token)
     path('auth/admin/login/', views.admin_login, name='admin_login'),
+    path('auth/admin/users/<int:pk>/deactivate/', views.admin_deactivate_user, name='admin_deactivate_user'),
 
     # --- Categories ---
     path('categories/', views.categories, name='category_list_create'),
@@ -15,15 +18,24 @@ urlpatterns = [
     # --- Products ---
     path('products/', views.products_list_create, name='products_list_create'),
     path('products/<int:pk>/', views.product_detail, name='product_detail'),
+    path('products/batch/', views.products_batch, name='products_batch'), # GET ?ids=1,2,3 (cached cards)
     path('products/images/<int:pk>/', views.product_image_detail, name='product_image_detail'),
     path('products/my/', views.get_my_products, name='my_products'), # Admin's Products
+    path('products/import/', views.products_import, name='products_import'), # Admin bulk CSV/JSONL upsert (queued)
+    path('uploads/<int:pk>/', views.upload_job_detail, name='upload_job_detail'), # Admin: image upload job status
+    path('imports/<int:pk>/', views.import_job_detail, name='import_job_detail'), # Admin: product import job status
     
     # --- Cart ---
     path('cart/', views.cart_view, name='cart_view'), # GET (view), POST (add), DELETE (clear)
-    path('cart/items/<int:pk>/', views.cart_item_detail, name='cart_item_detail'), # PUT (update qty), DELETE (remove item)
+    path('cart/items/<int:pk>/', views.cart_item_detail, name='cart_item_detail'), # PUT (update qty), DELETE (remove item); pk: CartItem id
+    path('cart/lines/<int:product_id>/', views.cart_line_detail, name='cart_line_detail'), # the same by product id
+    path('cart/summary/', views.cart_summary_view, name='cart_summary'), # GET (cached header badge counts)
+    path('cart/batch/', views.cart_batch, name='cart_batch'), # POST (add / set / remove several lines at once)
     
     # --- Wishlist ---
     path('wishlist/', views.wishlist_view, name='wishlist_view'), # GET
+    path('wishlist/items/', views.wishlist_items, name='wishlist_items'), # GET (paginated, ?cursor=&limit=)
+    path('wishlist/ids/', views.wishlist_ids, name='wishlist_ids'), # GET (cached product ids, for heart icons)
     path('wishlist/add/', views.add_to_wishlist, name='wishlist_add'), # POST
     path('wishlist/remove/<int:product_id>/', views.remove_from_wishlist, name='wishlist_remove'), # DELETE
 
@@ -36,6 +48,9 @@ urlpatterns = [
     path('orders/', views.orders_list, name='orders_list'), # Order history
     path('orders/<int:pk>/', views.order_detail, name='order_detail'),
 
+    # --- Analytics (admin) ---
+    path('analytics/sales/', views.sales_analytics, name='sales_analytics'), # GET ?from=&to=&group_by=
+
     # --- Payments ---
     path('payu/initiate/', views.initiate_payu_payment, name='payu_init'), # Initiate PayU Payment
     path('payu/success/', views.payu_success, name='payu_success'), # PayU Success Callback
@@ -44,5 +59,9 @@ urlpatterns = [
     # --- Reviews ---
     path('reviews/add/', views.add_review, name='add_review'),
     path('reviews/<int:pk>/', views.review_detail, name='review_detail'),
+    path('reviews/<int:pk>/helpful/', views.review_helpful, name='review_helpful'), # POST (vote once per user)
     path('products/<int:product_id>/reviews/', views.product_reviews, name='product_reviews_list'),
+
+    # --- Monitoring ---
+    path('_metrics', views.metrics_view, name='metrics'), # GET (Prometheus text format)
 ]
\ No newline at end of file
@@ -2,20 +2,43 @@ from django.shortcuts import get_object_or_404, redirect
 from django.contrib.auth.models import User
 from django.contrib.auth import authenticate
 from django.conf import settings
+from django.utils.dateparse import parse_date
 from django.utils.text import slugify
 from django.views.decorators.csrf import csrf_exempt
-from django.http import JsonResponse
-from django.db import transaction
-from cloudinary.uploader import upload as cloud_upload
+from django.views.decorators.http import condition
+from django.http import HttpResponse
+from django.db import IntegrityError, transaction
+from django.db.models import F, Q, Value
 import jwt, datetime, os, json
 import hashlib
+import hmac
+from decimal import Decimal, InvalidOperation
+import logging
 import uuid
+from collections import namedtuple
+from functools import wraps
 
-from .models import (Category, Product, ProductImage, UserProfile, Address,
-                     Cart, CartItem, Wishlist, WishlistItem, Order, OrderItem, Review)
+from .models import (Category, Product, ProductImage, ImageUploadJob, ProductImportJob, UserProfile, Address,
+                     CartItem, Wishlist, WishlistItem, Order, OrderItem, PaymentCallback,
+                     Review, ReviewVote)
 from .serializers import (CategorySerializer, ProductSerializer, ProductImageSerializer,
-                          AddressSerializer, CartSerializer, CartItemSerializer, WishlistItemSerializer,
+                          AddressSerializer, CartSerializer, CartItemSerializer,
                           OrderSerializer, ReviewSerializer)
+from .importer import detect_format, enqueue_import, job_data as import_job_data
+from .analytics import GROUPINGS, default_range, forget_order, record_order, sales_report
+from .inventory import OutOfStock, check_stock, reserve_stock
+from .uploads import enqueue_uploads, job_data
+from .pricing import cached_cart_summary, cart_lines, invalidate_cart_summary, summarize
+from .pagination import InvalidCursor, get_page_size, keyset_paginate, paginate_ranked
+from .cards import card_json, cards, image_rows, load_cards, product_fields, product_rows
+from .renderers import LeanJsonResponse
+from .replicas import pin as pin_to_primary, replica_reads
+from . import carts, conditional, metrics
+from .timing import TimedJsonResponse as JsonResponse
+from .facets import product_facets
+from .search import product_search
+from .tokens import auth_state, revoke_tokens
+from .wishlists import invalidate_wishlist_ids, wishlist_product_ids
 
 # ----------------------------
 # UTILITY: Unified Data Parser
@@ -34,6 +57,8 @@ def get_request_data(request):
         # Return POST data (Form-Data / x-www-form-urlencoded)
         return request.POST
 
+logger = logging.getLogger(__name__)
+
 # ----------------------------
 # JWT helpers
 # ----------------------------
@@ -41,23 +66,63 @@ JWT_SECRET = getattr(settings, 'SECRET_KEY')
 JWT_ALGO = 'HS256'
 JWT_EXP_HOURS = 24
 
+TOKEN_USER_FIELDS = [f.attname for f in User._meta.concrete_fields
+                     if f.attname in ('id', 'username', 'is_active', 'is_staff', 'is_superuser')]
+
 def generate_token(user):
+    version = UserProfile.objects.filter(user=user).values_list('token_version', flat=True).first() or 0
     payload = {
         'user_id': user.id,
+        'username': user.username,
+        'is_staff': user.is_staff,
+        'is_superuser': user.is_superuser,
+        'ver': version,
         'exp': datetime.datetime.now() + datetime.timedelta(hours=JWT_EXP_HOURS),
         'iat': datetime.datetime.now(),
     }
     return jwt.encode(payload, JWT_SECRET, algorithm=JWT_ALGO)
 
+def token_user_id(request):
+    """Id of the user the bearer token was issued to; the signature is checked but nothing is loaded."""
+    auth = request.headers.get('Authorization','')
+    if not auth.startswith('Bearer '):
+        return None
+    try:
+        return jwt.decode(auth.split(' ')[1], JWT_SECRET, algorithms=[JWT_ALGO]).get('user_id')
+    except Exception:
+        return None
+
 def decode_token_from_request(request):
+    """
+    Returns a User built from the token claims (id, username, staff flags)
+    instead of a fetched row. Any other field is loaded lazily on first access.
+    """
     auth = request.headers.get('Authorization','')
     if not auth.startswith('Bearer '):
         return None
     token = auth.split(' ')[1]
     try:
         decoded = jwt.decode(token, JWT_SECRET, algorithms=[JWT_ALGO])
-        user = User.objects.get(id=decoded['user_id'])
-        return user
+        if 'ver' not in decoded:
+            # Issued before token versions existed: it cannot be checked for
+            # revocation, so the user signs in again
+            return None
+        state = auth_state(decoded['user_id'])
+        if not state:
+            return None
+        is_active, is_staff, is_superuser, version = state
+        if not is_active or decoded['ver'] != version:
+            return None
+        # A demotion takes effect without waiting for the token to expire
+        claims = {
+            'id': decoded['user_id'],
+            'username': decoded.get('username', ''),
+            'is_active': True,
+            'is_staff': decoded.get('is_staff', False) and is_staff,
+            'is_superuser': decoded.get('is_superuser', False) and is_superuser,
+        }
+        # from_db() expects values in concrete field order
+        return User.from_db(None, TOKEN_USER_FIELDS, [claims[f] for f in TOKEN_USER_FIELDS])
     except Exception:
         return None
 
@@ -139,10 +204,59 @@ def admin_login(request):
     token = generate_token(user)
     return JsonResponse({'token': token, 'username': user.username,'is_staff': user.is_staff})
 
+@csrf_exempt
+def user_logout(request):
+    if request.method != "POST":
+        return JsonResponse({'error':'Invalid method'}, status=405)
+    user = decode_token_from_request(request)
+    if not user:
+        return JsonResponse({"error":"Authentication required"}, status=401)
+    # Tokens are stateless: logging out signs the user out everywhere
+    revoke_tokens(user)
+    return JsonResponse({'message':'Logged out'})
+
+@csrf_exempt
+def change_password(request):
+    if request.method != "POST":
+        return JsonResponse({'error':'Invalid method'}, status=405)
+    user = decode_token_from_request(request)
+    if not user:
+        return JsonResponse({"error":"Authentication required"}, status=401)
+
+    data = get_request_data(request)
+    old_password = data.get('old_password')
+    new_password = data.get('new_password')
+    if not old_password or not new_password:
+        return JsonResponse({'error':'old_password & new_password required'}, status=400)
+    if not authenticate(username=user.username, password=old_password):
+        return JsonResponse({'error':'Invalid credentials'}, status=401)
+
+    user = User.objects.get(pk=user.pk)
+    user.set_password(new_password)
+    user.save()  # revokes every token issued so far (signals.revoke_on_credentials_change)
+    token = generate_token(user)
+    return JsonResponse({'message':'Password changed','token': token})
+
+@csrf_exempt
+def admin_deactivate_user(request, pk):
+    if request.method != "POST":
+        return JsonResponse({'error':'Invalid method'}, status=405)
+    admin = decode_token_from_request(request)
+    if not admin or not admin.is_staff:
+        return JsonResponse({'error':'Admin only'}, status=403)
+
+    user = get_object_or_404(User, pk=pk)
+    if user.is_active:
+        user.is_active = False
+        user.save(update_fields=['is_active'])  # revokes the user's tokens
+    return JsonResponse({'id': user.pk, 'is_active': False})
+
 # ----------------------------
 # CATEGORY endpoints
 # ----------------------------
 @csrf_exempt
+@replica_reads
+@condition(etag_func=conditional.categories_etag, last_modified_func=conditional.categories_last_modified)
 def categories(request):
     if request.method == 'GET':
         qs = Category.objects.all()
@@ -164,6 +278,8 @@ def categories(request):
     return JsonResponse(CategorySerializer(cat).data, status=201)
 
 @csrf_exempt
+@replica_reads
+@condition(etag_func=conditional.categories_etag, last_modified_func=conditional.categories_last_modified)
 def category_detail(request, pk):
     cat = get_object_or_404(Category, pk=pk)
     if request.method == 'GET':
@@ -188,19 +304,115 @@ def category_detail(request, pk):
 # ----------------------------
 # PRODUCT endpoints
 # ----------------------------
+# Keyset orderings for the catalog; each ends in 'id' so the cursor is unique
+# An explicit comparison: on SQLite Django renders filter(is_active=True) as a
+# bare "WHERE is_active", which cannot use the (is_active, ...) indexes
+ACTIVE = Q(is_active=Value(True))
+
+PRODUCT_SORTS = {
+    'newest': [('created_at', True), ('id', True)],
+    'price_asc': [('price', False), ('id', False)],
+    'price_desc': [('price', True), ('id', True)],
+    'rating': [('rating_summary__average', True), ('id', True)],
+}
+
+def _query_list(request, name):
+    """?name=a,b&name=c -> ['a', 'b', 'c']"""
+    values = []
+    for raw in request.GET.getlist(name):
+        values += [v.strip() for v in raw.split(',') if v.strip()]
+    return values
+
+def _query_decimal(request, name):
+    """A finite ?name= decimal, None if absent; raises ValueError otherwise."""
+    if not request.GET.get(name):
+        return None
+    try:
+        value = Decimal(request.GET[name])
+    except InvalidOperation:
+        raise ValueError(f'Invalid {name}')
+    if not value.is_finite():
+        raise ValueError(f'Invalid {name}')
+    return value
+
+ProductListPlan = namedtuple('ProductListPlan', 'qs ranked ordering facets')
+
+def _product_list_plan(request):
+    """
+    Validate the list query string and run the in-memory search and facet
+    lookups. Returns a ProductListPlan (or an error response) for
+    _product_page(), or the async view, to fetch one page from.
+    """
+    qs = Product.objects.filter(ACTIVE)
+    q = request.GET.get('q')
+    cats = _query_list(request, 'category')
+    brands = _query_list(request, 'brand')
+    if cats:
+        # Accept category ids and/or slugs
+        ids = [c for c in cats if c.isdigit()]
+        qs = qs.filter(Q(category_id__in=ids) | Q(category__slug__in=[c for c in cats if not c.isdigit()]))
+    if brands:
+        qs = qs.filter(brand__in=brands)
+    try:
+        min_price, max_price = _query_decimal(request, 'min_price'), _query_decimal(request, 'max_price')
+    except ValueError as e:
+        return JsonResponse({'error': str(e)}, status=400)
+    if min_price is not None: qs = qs.filter(price__gte=min_price)
+    if max_price is not None: qs = qs.filter(price__lte=max_price)
+
+    sort = request.GET.get('sort') or ('relevance' if q else 'newest')
+    if sort != 'relevance' and sort not in PRODUCT_SORTS:
+        return JsonResponse({'error': 'Invalid sort'}, status=400)
+
+    ranked = None
+    if q:
+        # Text matching comes from the in-memory index; the database only
+        # applies the remaining filters to the matched ids.
+        ranked = product_search.search(q)
+        qs = qs.filter(id__in=[pk for _, pk in ranked])
+
+    # Facet counts (and the filtered id set) come from the in-memory facet index
+    matched, facets = product_facets.query(
+        categories=cats, brands=brands, min_price=min_price, max_price=max_price,
+        candidates=[pk for _, pk in ranked] if ranked is not None else None,
+    )
+
+    if sort == 'relevance' and ranked is not None:
+        return ProductListPlan(qs, [r for r in ranked if r[1] in matched], None, facets)
+    # Filtered listings are bounded by the same matches as their counts: none
+    # skips the page query, a few narrow it to primary key lookups
+    if matched is not None:
+        if not matched:
+            qs = qs.none()
+        elif len(matched) <= getattr(settings, 'FACET_FILTER_MAX_IDS', 1000):
+            qs = qs.filter(id__in=matched)
+    return ProductListPlan(qs, None, PRODUCT_SORTS.get(sort, PRODUCT_SORTS['newest']), facets)
+
+def _product_page(plan, request):
+    """(product_rows() rows, next_cursor) for one page of a ProductListPlan."""
+    cursor, limit = request.GET.get('cursor'), get_page_size(request)
+    rows = product_rows(plan.qs)
+    if plan.ranked is not None:
+        ids, next_cursor = paginate_ranked(plan.ranked, cursor, limit)
+        found = {r['id']: r for r in rows.filter(id__in=ids)}
+        return [found[pk] for pk in ids if pk in found], next_cursor
+    return keyset_paginate(rows, plan.ordering, cursor, limit)
+
 @csrf_exempt
+@replica_reads
+@condition(etag_func=conditional.product_list_etag, last_modified_func=conditional.product_list_last_modified)
 def products_list_create(request):
     # --- GET Logic (Public) ---
     if request.method == 'GET':
-        qs = Product.objects.filter(is_active=True)
-        q = request.GET.get('q')
-        cat = request.GET.get('category')
+        plan = _product_list_plan(request)
+        if not isinstance(plan, ProductListPlan):
+            return plan
         try:
-            if request.GET.get('min_price'): qs = qs.filter(price__gte=float(request.GET.get('min_price')))
-            if request.GET.get('max_price'): qs = qs.filter(price__lte=float(request.GET.get('max_price')))
-        except ValueError: pass 
-        ser = ProductSerializer(qs, many=True)
-        return JsonResponse(ser.data, safe=False)
+            page, next_cursor = _product_page(plan, request)
+        except InvalidCursor as e:
+            return JsonResponse({'error': str(e)}, status=400)
+        results = cards(page, image_rows([r['id'] for r in page]))
+        return LeanJsonResponse({'results': results, 'next_cursor': next_cursor, 'facets': plan.facets})
 
     # --- POST Logic (Admin) ---
     user = decode_token_from_request(request)
@@ -241,14 +453,8 @@ def products_list_create(request):
             created_by=user  # <--- This requires the migration!
         )
 
-        # 5. Image Upload
-        files = request.FILES.getlist('images')
-        for f in files:
-            try:
-                r = cloud_upload(f)
-                ProductImage.objects.create(product=p, image_url=r.get('secure_url'))
-            except Exception as img_e:
-                print(f"Image Upload Failed: {img_e}")
+        # 5. Image Upload (queued; images attach when the workers finish)
+        jobs = enqueue_uploads(p, request.FILES.getlist('images'))
 
         # Text Image URLs
         img_urls = data.get('image_urls')
@@ -257,7 +463,9 @@ def products_list_create(request):
                 if url.strip(): 
                     ProductImage.objects.create(product=p, image_url=url.strip())
 
-        return JsonResponse(ProductSerializer(p).data, status=201)
+        data = ProductSerializer(p).data
+        data['upload_jobs'] = [job_data(j) for j in jobs]
+        return JsonResponse(data, status=201)
 
     except Exception as e:
         # 👇 THIS PRINTS THE REAL ERROR TO YOUR TERMINAL
@@ -266,8 +474,10 @@ def products_list_create(request):
         return JsonResponse({'error': f"Server Error: {str(e)}"}, status=500)
 
 @csrf_exempt
+@replica_reads
+@condition(etag_func=conditional.product_etag, last_modified_func=conditional.product_last_modified)
 def product_detail(request, pk):
-    p = get_object_or_404(Product, pk=pk)
+    p = get_object_or_404(Product.objects.select_related('category', 'rating_summary'), pk=pk)
     if request.method == 'GET':
         return JsonResponse(ProductSerializer(p).data)
         
@@ -302,19 +512,63 @@ def product_detail(request, pk):
         p.save()
 
         files = request.FILES.getlist('images')
+        jobs = []
         if files:
             if data.get('clear_images') == 'true':
                 p.images.all().delete()
-            for f in files:
-                r = cloud_upload(f)
-                ProductImage.objects.create(product=p, image_url=r.get('secure_url'))
+            jobs = enqueue_uploads(p, files)
 
-        return JsonResponse(ProductSerializer(p).data)
+        data = ProductSerializer(p).data
+        data['upload_jobs'] = [job_data(j) for j in jobs]
+        return JsonResponse(data)
 
     if request.method == 'DELETE':
         p.delete()
         return JsonResponse({'message':'deleted'})
     
+@csrf_exempt
+def products_import(request):
+    """Admin bulk upsert from an uploaded CSV/JSONL file (field name 'file')."""
+    if request.method != 'POST':
+        return JsonResponse({'error':'Invalid method'}, status=405)
+    user = decode_token_from_request(request)
+    if not user or not user.is_staff:
+        return JsonResponse({'error':'Admin only'}, status=403)
+
+    upload = request.FILES.get('file')
+    if not upload:
+        return JsonResponse({'error': 'file required'}, status=400)
+    fmt = request.POST.get('format') or detect_format(upload.name)
+    if fmt not in ('csv', 'jsonl'):
+        return JsonResponse({'error': 'format must be csv or jsonl'}, status=400)
+
+    # Imported in the background (importer.py); poll GET /api/imports/<id>/ for the report
+    job = enqueue_import(user, upload, fmt)
+    return JsonResponse(import_job_data(job), status=202)
+
+@csrf_exempt
+def products_batch(request):
+    """
+    Product cards for ?ids=3,1,2 (cart, wishlist, order history, recently
+    viewed), in the order asked: {"results": [...], "missing": [ids]}.
+    """
+    # Not @replica_reads: a miss refilled from a lagging replica would stay cached
+    if request.method != 'GET':
+        return JsonResponse({'error':'Invalid method'}, status=405)
+    try:
+        ids = list(dict.fromkeys(int(pk) for pk in request.GET.get('ids', '').split(',') if pk.strip()))
+    except ValueError:
+        return JsonResponse({'error': 'ids must be comma-separated product ids'}, status=400)
+    limit = getattr(settings, 'PRODUCT_BATCH_MAX_IDS', 100)
+    if len(ids) > limit:
+        return JsonResponse({'error': f'At most {limit} ids per request'}, status=400)
+
+    # Cards come from the cache already encoded: only the envelope is rendered here
+    found = card_json(ids)
+    body = '{"results": [%s], "missing": %s}' % (
+        ', '.join(found[pk] for pk in ids if pk in found), json.dumps([pk for pk in ids if pk not in found]))
+    return HttpResponse(body, content_type='application/json')
+
 # For Admin's Product Details
 @csrf_exempt
 def get_my_products(request):
@@ -324,8 +578,7 @@ def get_my_products(request):
     
     # Filter products where created_by == current_user
     qs = Product.objects.filter(created_by=user).order_by('-created_at')
-    ser = ProductSerializer(qs, many=True)
-    return JsonResponse(ser.data, safe=False)
+    return LeanJsonResponse(load_cards(qs), safe=False)
     
 @csrf_exempt
 def product_image_detail(request, pk):
@@ -345,90 +598,238 @@ def product_image_detail(request, pk):
         img.save()
         return JsonResponse(ProductImageSerializer(img).data)
 
+@csrf_exempt
+def upload_job_detail(request, pk):
+    user = decode_token_from_request(request)
+    if not user or not user.is_staff:
+        return JsonResponse({'error':'Admin only'}, status=403)
+    job = get_object_or_404(ImageUploadJob.objects.select_related('image'), pk=pk)
+    return JsonResponse(job_data(job))
+
+@csrf_exempt
+def import_job_detail(request, pk):
+    user = decode_token_from_request(request)
+    if not user or not user.is_staff:
+        return JsonResponse({'error':'Admin only'}, status=403)
+    return JsonResponse(import_job_data(get_object_or_404(ProductImportJob, pk=pk)))
+
 # ----------------------------
 # CART
 # ----------------------------
+def retry_if_cart_busy(view):
+    """Answer 503 when the cart's lock cannot be taken in time (carts.CartBusy)."""
+    @wraps(view)
+    def wrapper(request, *args, **kwargs):
+        try:
+            return view(request, *args, **kwargs)
+        except carts.CartBusy:
+            response = JsonResponse({"error":"Cart is busy, please retry"}, status=503)
+            response['Retry-After'] = '1'
+            return response
+    return wrapper
+
 @csrf_exempt
+@retry_if_cart_busy
 def cart_view(request):
     user = decode_token_from_request(request)
     if not user:
         return JsonResponse({"error":"Authentication required"}, status=401)
 
-    cart, created = Cart.objects.get_or_create(user=user)
-
+    # Carts live in the cache (carts.py): lines are keyed by product id, and
+    # are written to Cart/CartItem in the background
     if request.method == "GET":
-        # 1. Fetch Product and Images efficiently
-        cart_items = cart.items.select_related('product').prefetch_related('product__images').all()
-        
-        items = []
-        for item in cart_items:
-            # 2. Get the first image safely
-            first_img = item.product.images.first()
-            img_url = first_img.image_url if first_img else None
-            
-            # 3. Construct the full data object
-            items.append({
-                "id": item.id,
-                "product_id": item.product.id,
-                "title": item.product.title,   
-                "price": float(item.product.price),
-                "image": img_url,        
-                "quantity": item.quantity
-            })
-            
-        return JsonResponse({"cart_id": cart.id, "items": items})
+        cart = carts.get_cart(user.id)
+        lines = cart['lines']
+        item_ids = _cart_item_ids(user.id, cart['cart_id']) if lines else {}
+        products = {}
+        first_images = {}
+        if lines:
+            products = {p['id']: p for p in Product.objects.filter(pk__in=lines).values('id', 'title', 'price')}
+            for img in image_rows(list(products)):
+                first_images.setdefault(img['product_id'], img['image_url'])
+
+        items = [{
+            "id": item_ids.get(pk),
+            "product_id": pk,
+            "title": products[pk]['title'],
+            "price": float(products[pk]['price']),
+            "image": first_images.get(pk),
+            "quantity": quantity,
+        } for pk, quantity in lines.items() if pk in products]
+        prices = {pk: p['price'] for pk, p in products.items()}
+        return JsonResponse({"cart_id": cart['cart_id'], "items": items, "summary": summarize(lines, prices)})
 
     elif request.method == "POST":
         data = get_request_data(request)
-        product_id = data.get("product_id")
+        try:
+            product_id = int(data.get("product_id"))
+        except (TypeError, ValueError):
+            return JsonResponse({"error":"Invalid product_id"}, status=400)
         try:
             quantity = int(data.get("quantity", 1))
         except ValueError:
             return JsonResponse({"error":"Invalid quantity"}, status=400)
 
-        product = get_object_or_404(Product, pk=product_id)
-        ci, created = CartItem.objects.get_or_create(cart=cart, product=product, defaults={"quantity":quantity})
-        
-        if not created:
-            ci.quantity += quantity
-            ci.save()
-        return JsonResponse({"id": ci.id, "product": ci.product.id, "quantity": ci.quantity})
+        # Already in the cart means it exists: only new lines cost a query
+        lines = carts.get_lines(user.id)
+        if lines.get(product_id, 0) + quantity < 0:
+            return JsonResponse({"error":"Invalid quantity"}, status=400)
+        if product_id not in lines and not Product.objects.filter(pk=product_id).exists():
+            return JsonResponse({"error":"Product not found"}, status=404)
+        quantity = carts.add_line(user.id, product_id, quantity)
+        invalidate_cart_summary(user.id)
+        metrics.CART_ADDS.inc()
+        # No CartItem id: a new line has no row until its cart is written
+        return JsonResponse({"product": product_id, "quantity": quantity})
 
     elif request.method == "DELETE":
         data = get_request_data(request)
-        item_id = data.get("item_id")
-        if item_id:
-            ci = get_object_or_404(CartItem, pk=item_id, cart=cart)
-            ci.delete()
+        item_id, product_id = data.get("item_id"), data.get("product_id")
+        if item_id or product_id:
+            # item_id is a CartItem id (the "id" of GET lines), product_id the line's product
+            try:
+                if item_id:
+                    product_id = _cart_item_product(user.id, int(item_id))
+                removed = product_id is not None and carts.remove_line(user.id, int(product_id))
+            except (TypeError, ValueError):
+                removed = False
+            if not removed:
+                return JsonResponse({"error":"Item not found"}, status=404)
+            invalidate_cart_summary(user.id)
             return JsonResponse({"message":"item removed"})
         else:
-            cart.items.all().delete()
+            carts.clear(user.id)
+            invalidate_cart_summary(user.id)
             return JsonResponse({"message":"cart cleared"})
 
+def _cart_item_ids(user_id, cart_id):
+    """{product_id: CartItem id} for the user's cart, written first if it changed."""
+    carts.flush(user_id)
+    return dict(CartItem.objects.filter(cart_id=cart_id).values_list('product_id', 'id'))
+
+def _cart_item_product(user_id, item_id):
+    """Product id of one of the user's CartItem rows, None if it is not theirs."""
+    carts.flush(user_id)
+    return (CartItem.objects.filter(pk=item_id, cart__user_id=user_id)
+            .values_list('product_id', flat=True).first())
+
 @csrf_exempt
+@retry_if_cart_busy
 def cart_item_detail(request, pk):
+    # pk is a CartItem id, the "id" of GET /api/cart/ lines; cart/lines/<product_id>/
+    # is the same without the row lookup
     user = decode_token_from_request(request)
     if not user:
         return JsonResponse({"error":"Authentication required"}, status=401)
-    cart = getattr(user, 'cart', None)
-    if not cart:
-        return JsonResponse({"error":"Cart not found"}, status=404)
-    item = get_object_or_404(CartItem, pk=pk, cart=cart)
-    
+    product_id = _cart_item_product(user.id, pk)
+    if product_id is None:
+        return JsonResponse({"error":"Item not found"}, status=404)
+    return _cart_line(request, user, product_id, item_id=pk)
+
+@csrf_exempt
+@retry_if_cart_busy
+def cart_line_detail(request, product_id):
+    user = decode_token_from_request(request)
+    if not user:
+        return JsonResponse({"error":"Authentication required"}, status=401)
+    return _cart_line(request, user, product_id)
+
+def _cart_line(request, user, product_id, item_id=None):
+    ids = {"id": item_id} if item_id is not None else {}
+    quantity = carts.get_lines(user.id).get(product_id)
+    if quantity is None:
+        return JsonResponse({"error":"Item not found"}, status=404)
+
     if request.method == "GET":
-        return JsonResponse({"id": item.id, "product": item.product.id, "quantity": item.quantity})
+        return JsonResponse({**ids, "product": product_id, "quantity": quantity})
     elif request.method == "PUT":
         data = get_request_data(request)
         try:
-            item.quantity = int(data.get("quantity", item.quantity))
+            quantity = int(data.get("quantity", quantity))
         except ValueError:
             return JsonResponse({"error":"Invalid quantity"}, status=400)
-        item.save()
-        return JsonResponse({"id": item.id, "product": item.product.id, "quantity": item.quantity})
+        if quantity < 0:
+            return JsonResponse({"error":"Invalid quantity"}, status=400)
+        if carts.set_line(user.id, product_id, quantity) is None:
+            return JsonResponse({"error":"Item not found"}, status=404)
+        invalidate_cart_summary(user.id)
+        return JsonResponse({**ids, "product": product_id, "quantity": quantity})
     elif request.method == "DELETE":
-        item.delete()
+        if not carts.remove_line(user.id, product_id):
+            return JsonResponse({"error":"Item not found"}, status=404)
+        invalidate_cart_summary(user.id)
         return JsonResponse({"message": "Item removed"})
     
+CART_OPERATIONS = ('add', 'set', 'remove')
+
+def _cart_operation(op):
+    """(op, product_id, quantity) from one batch entry, or None if it is invalid."""
+    if not isinstance(op, dict) or op.get("op") not in CART_OPERATIONS:
+        return None
+    try:
+        product_id = int(op.get("product_id"))
+        quantity = int(op.get("quantity", 1 if op["op"] == "add" else 0))
+    except (TypeError, ValueError):
+        return None
+    if op["op"] == "add" and quantity < 1 or op["op"] == "set" and ("quantity" not in op or quantity < 0):
+        return None
+    return op["op"], product_id, quantity
+
+@csrf_exempt
+@retry_if_cart_busy
+def cart_batch(request):
+    """
+    Apply a list of cart operations at once, all or nothing:
+    {"operations": [{"op": "add", "product_id": 1, "quantity": 2},
+                    {"op": "set", "product_id": 2, "quantity": 5},
+                    {"op": "remove", "product_id": 3}]}
+    Setting a quantity of 0 removes the line.
+    """
+    user = decode_token_from_request(request)
+    if not user:
+        return JsonResponse({"error":"Authentication required"}, status=401)
+    if request.method != "POST":
+        return JsonResponse({'error':'Invalid method'}, status=405)
+
+    data = get_request_data(request)
+    raw = data.get("operations")
+    if not isinstance(raw, list) or not raw:
+        return JsonResponse({"error":"operations must be a non-empty list"}, status=400)
+    limit = getattr(settings, 'CART_BATCH_MAX_OPERATIONS', 100)
+    if len(raw) > limit:
+        return JsonResponse({"error":f"At most {limit} operations per batch"}, status=400)
+    operations = []
+    for index, op in enumerate(raw):
+        parsed = _cart_operation(op)
+        if parsed is None:
+            return JsonResponse({"error":"Invalid operation", "index": index}, status=400)
+        operations.append(parsed)
+
+    # Every product added or set must exist: one query for those not in the cart yet
+    lines = carts.get_lines(user.id)
+    wanted = {pk for op, pk, quantity in operations if op != 'remove' and pk not in lines}
+    if wanted:
+        missing = wanted - set(Product.objects.filter(pk__in=wanted).values_list('pk', flat=True))
+        if missing:
+            return JsonResponse({"error":"Product not found", "product_ids": sorted(missing)}, status=404)
+
+    # One change in the cart store; the write-behind flush then stores it with
+    # one upsert and one delete (carts.flush)
+    lines = carts.apply_operations(user.id, operations)
+    invalidate_cart_summary(user.id)
+    adds = sum(1 for op in operations if op[0] == 'add')
+    if adds:
+        metrics.CART_ADDS.inc(adds)
+    return JsonResponse({"items": [{"id": pk, "product": pk, "quantity": quantity} for pk, quantity in lines.items()]})
+
+@csrf_exempt
+def cart_summary_view(request):
+    user = decode_token_from_request(request)
+    if not user:
+        return JsonResponse({"error":"Authentication required"}, status=401)
+    # Header badge: served from cache, refilled by one aggregate query
+    return JsonResponse(cached_cart_summary(user.id))
+
 # ----------------------------
 # WISHLIST ENDPOINTS
 # ----------------------------
@@ -439,16 +840,41 @@ def wishlist_view(request):
     if not user:
         return JsonResponse({"error": "Authentication required"}, status=401)
 
-    # Get or create the user's wishlist
-    wishlist, created = Wishlist.objects.get_or_create(user=user)
-
     if request.method == "GET":
-        # Return all items in the wishlist
-        items = wishlist.items.select_related('product').all()
-        # Note: We need to serialize this manually or use DRF serializer
-        # Using the Serializer we created in step 2:
-        serializer = WishlistItemSerializer(items, many=True)
-        return JsonResponse(serializer.data, safe=False)
+        # Return all items in the wishlist, shaped like WishlistItemSerializer
+        rows = list(_wishlist_rows(user).order_by('id'))
+        return LeanJsonResponse(_wishlist_data(rows), safe=False)
+
+@csrf_exempt
+def wishlist_items(request):
+    """The wishlist a page at a time, newest first: two queries per page."""
+    user = decode_token_from_request(request)
+    if not user:
+        return JsonResponse({"error": "Authentication required"}, status=401)
+
+    try:
+        rows, next_cursor = keyset_paginate(_wishlist_rows(user), [('id', True)],
+                                            request.GET.get('cursor'), get_page_size(request))
+    except InvalidCursor as e:
+        return JsonResponse({"error": str(e)}, status=400)
+    return LeanJsonResponse({"results": _wishlist_data(rows), "next_cursor": next_cursor})
+
+@csrf_exempt
+def wishlist_ids(request):
+    """Product ids on the user's wishlist (heart icons on product grids); cached."""
+    user = decode_token_from_request(request)
+    if not user:
+        return JsonResponse({"error": "Authentication required"}, status=401)
+    return JsonResponse({"product_ids": wishlist_product_ids(user.id)})
+
+def _wishlist_rows(user):
+    # By user through the join: reads never need to create the wishlist
+    return WishlistItem.objects.filter(wishlist__user_id=user.id).values('id', 'added_at', *product_fields('product__'))
+
+def _wishlist_data(rows):
+    products = cards(rows, image_rows([r['product__id'] for r in rows]), prefix='product__')
+    return [{'id': r['id'], 'product': product, 'added_at': r['added_at']}
+            for r, product in zip(rows, products)]
 
 @csrf_exempt
 def add_to_wishlist(request):
@@ -470,6 +896,7 @@ def add_to_wishlist(request):
         item, created = WishlistItem.objects.get_or_create(wishlist=wishlist, product=product)
         
         if created:
+            invalidate_wishlist_ids(user.id)
             return JsonResponse({"message": "Added to wishlist"})
         else:
             return JsonResponse({"message": "Item already in wishlist"}, status=200)
@@ -485,6 +912,7 @@ def remove_from_wishlist(request, product_id):
         # Find the item by Product ID inside this user's wishlist
         item = get_object_or_404(WishlistItem, wishlist=wishlist, product_id=product_id)
         item.delete()
+        invalidate_wishlist_ids(user.id)
         return JsonResponse({"message": "Item removed"})
 
 # ----------------------------
@@ -498,7 +926,7 @@ def addresses(request):
         
     if request.method == "GET":
         qs = Address.objects.filter(user=user)
-        data = [{"id":a.id, "line1": a.line1, "city": a.city, "state": a.state} for a in qs]
+        data = [{"id":a.id, "line1": a.address_line1, "city": a.city, "state": a.state} for a in qs]
         return JsonResponse(data, safe=False)
         
     elif request.method == "POST":
@@ -527,11 +955,11 @@ def address_detail(request, pk):
         
     elif request.method == "PUT":
         data = get_request_data(request)
-        addr.line1 = data.get("line1", addr.line1)
-        addr.line2 = data.get("line2", addr.line2)
+        addr.address_line1 = data.get("line1", addr.address_line1)
+        addr.address_line2 = data.get("line2", addr.address_line2)
         addr.city = data.get("city", addr.city)
         addr.state = data.get("state", addr.state)
-        addr.zip_code = data.get("zip_code", addr.zip_code)
+        addr.postal_code = data.get("zip_code", addr.postal_code)
         addr.country = data.get("country", addr.country)
         addr.save()
         return JsonResponse(AddressSerializer(addr).data)
@@ -544,118 +972,176 @@ def address_detail(request, pk):
 # ORDERS
 # ----------------------------
 @csrf_exempt
+@retry_if_cart_busy
 def create_order(request):
     user = decode_token_from_request(request)
     if not user:
         return JsonResponse({"error":"Authentication required"}, status=401)
         
-    cart = getattr(user, 'cart', None)
-    if not cart or not cart.items.exists():
-        return JsonResponse({"error":"Cart is empty"}, status=400)
-    
-    data = get_request_data(request)
-    address_id = data.get("address_id")
+    # The cart is written to the database and held still until the order is placed
+    with carts.checkout(user.id) as placed:
+        cart = getattr(user, 'cart', None)
+        if not cart or not cart.items.exists():
+            return JsonResponse({"error":"Cart is empty"}, status=400)
     
-    # 1. Get the Transaction ID sent from Frontend (Dummy or Real)
-    txn_id = data.get("transaction_id") 
+        data = get_request_data(request)
+        address_id = data.get("address_id")
     
-    if not address_id:
-        return JsonResponse({"error": "Address ID required"}, status=400)
+        # 1. Get the Transaction ID sent from Frontend (Dummy or Real)
+        txn_id = data.get("transaction_id") 
     
-    address = get_object_or_404(Address, pk=address_id, user=user)
-    cart_items = cart.items.select_related('product').all()
+        if not address_id:
+            return JsonResponse({"error": "Address ID required"}, status=400)
     
-    total = sum([item.product.price * item.quantity for item in cart_items])
+        address = get_object_or_404(Address, pk=address_id, user=user)
+        lines, total = cart_lines(cart)
     
-    try:
-        with transaction.atomic():
-            # 2. Create Order with your specific model fields
-            order = Order.objects.create(
-                user=user, 
-                address=address, 
-                total_amount=total,
-                status='paid', # <--- Change status from 'pending' to 'paid'
-                payment_id=txn_id # <--- Map transaction_id to your 'payment_id' field
-            )
+        try:
+            with transaction.atomic():
+                # Take the stock first; a shortage rolls the whole checkout back
+                reserve_stock(lines)
+
+                # 2. Create Order with your specific model fields
+                order = Order.objects.create(
+                    user=user, 
+                    address=address, 
+                    total_amount=total,
+                    status='paid', # <--- Change status from 'pending' to 'paid'
+                    payment_id=txn_id # <--- Map transaction_id to your 'payment_id' field
+                )
             
-            order_items_objs = [
-                OrderItem(
-                    order=order, 
-                    product=item.product, 
-                    quantity=item.quantity, 
-                    unit_price=item.product.price
-                ) for item in cart_items
-            ]
-            OrderItem.objects.bulk_create(order_items_objs)
+                order_items_objs = [
+                    OrderItem(
+                        order=order, 
+                        product_id=line['product_id'], 
+                        quantity=line['quantity'], 
+                        unit_price=line['unit_price']
+                    ) for line in lines
+                ]
+                OrderItem.objects.bulk_create(order_items_objs)
             
-            cart.items.all().delete()
+                cart.items.all().delete()
+
+                # Added to the sales rollups once the order commits
+                record_order(order, lines)
+            placed()
+            invalidate_cart_summary(user.id)
+            metrics.ORDERS_CREATED.labels('checkout').inc()
             
-        return JsonResponse({
-            "order_id": order.id, 
-            "total_amount": total, 
-            "status": "paid",
-            "payment_id": txn_id
-        }, status=201)
+            return JsonResponse({
+                "order_id": order.id, 
+                "total_amount": total, 
+                "status": "paid",
+                "payment_id": txn_id
+            }, status=201)
         
-    except Exception as e:
-        return JsonResponse({"error": "Failed to create order", "details": str(e)}, status=500)
+        except OutOfStock as e:
+            return JsonResponse(e.as_dict(), status=409)
+        except Exception as e:
+            return JsonResponse({"error": "Failed to create order", "details": str(e)}, status=500)
 
 @csrf_exempt
+@replica_reads
 def orders_list(request):
     user = decode_token_from_request(request)
     if not user:
         return JsonResponse({"error": "Authentication required"}, status=401)
 
-    qs = Order.objects.filter(user=user).prefetch_related('items__product').order_by('-created_at')
-    
+    # Two queries per page however long the history: orders, then their lines
+    qs = Order.objects.filter(user_id=user.id).values(*ORDER_FIELDS)
+    try:
+        orders, next_cursor = keyset_paginate(qs, [('created_at', True), ('id', True)],
+                                              request.GET.get('cursor'), get_page_size(request, default=20, maximum=50))
+    except InvalidCursor as e:
+        return JsonResponse({"error": str(e)}, status=400)
+    return JsonResponse({"results": _orders_data(orders), "next_cursor": next_cursor})
+
+ORDER_FIELDS = ('id', 'total_amount', 'status', 'address_id', 'created_at')
+
+def _orders_data(orders):
+    """Attach compact line projections to order value dicts in one query."""
+    lines = {}
+    rows = (OrderItem.objects.filter(order_id__in=[o['id'] for o in orders])
+            .values('order_id', 'product_id', 'product__title', 'quantity', 'unit_price')
+            .order_by('order_id', 'id'))
+    for row in rows:
+        lines.setdefault(row['order_id'], []).append({
+            "product": row['product_id'],
+            "title": row['product__title'],
+            "quantity": row['quantity'],
+            "unit_price": row['unit_price'],
+            "line_total": row['unit_price'] * row['quantity'],
+        })
     data = []
-    for order in qs:
-        items = [{"product": oi.product.id, "quantity": oi.quantity, "unit_price": oi.unit_price} for oi in order.items.all()]
+    for order in orders:
+        items = lines.get(order['id'], [])
         data.append({
-            "id": order.id,
-            "total_amount": order.total_amount,
-            "status": order.status,
-            "address": order.address.id,
+            "id": order['id'],
+            "total_amount": order['total_amount'],
+            "status": order['status'],
+            "address": order['address_id'],
+            "item_count": sum(i['quantity'] for i in items),
             "items": items,
-            "created_at": order.created_at
+            "created_at": order['created_at'],
         })
-    return JsonResponse(data, safe=False)
+    return data
 
 @csrf_exempt
+@replica_reads
 def order_detail(request, pk):
     user = decode_token_from_request(request)
     if not user:
         return JsonResponse({"error": "Authentication required"}, status=401)
 
-    order = get_object_or_404(Order, pk=pk, user=user)
-
     if request.method == "GET":
-        items = [
-            {
-                "product": oi.product.id,
-                "quantity": oi.quantity,
-                "unit_price": oi.unit_price
-            }
-            for oi in order.items.all()
-        ]
-        data = {
-            "id": order.id,
-            "total_amount": order.total_amount,
-            "status": order.status,
-            "address": order.address.id,
-            "items": items,
-            "created_at": order.created_at
-        }
-        return JsonResponse(data)
+        order = Order.objects.filter(pk=pk, user_id=user.id).values(*ORDER_FIELDS).first()
+        if not order:
+            return JsonResponse({"error": "Not found"}, status=404)
+        return JsonResponse(_orders_data([order])[0])
+
+    order = get_object_or_404(Order, pk=pk, user=user)
 
     if request.method == "DELETE":
-        order.delete()
+        with transaction.atomic():
+            forget_order(order)
+            order.delete()
         return JsonResponse({"message": "order deleted"})
 
+# ----------------------------
+# SALES ANALYTICS (admin)
+# ----------------------------
+@csrf_exempt
+def sales_analytics(request):
+    """
+    Revenue and units for ?from=YYYY-MM-DD&to=YYYY-MM-DD (default: last 30
+    days), grouped by ?group_by=day|product|category|seller. Served from the
+    rollup tables, never from Order/OrderItem.
+    """
+    user = decode_token_from_request(request)
+    if not user or not user.is_staff:
+        return JsonResponse({'error': 'Admin only'}, status=403)
+    if request.method != 'GET':
+        return JsonResponse({'error': 'Invalid method'}, status=405)
+
+    start, end = default_range()
+    try:
+        start = parse_date(request.GET['from']) if request.GET.get('from') else start
+        end = parse_date(request.GET['to']) if request.GET.get('to') else end
+    except ValueError:
+        start = end = None
+    if not start or not end or start > end:
+        return JsonResponse({'error': 'from/to must be YYYY-MM-DD dates with from <= to'}, status=400)
+    group_by = request.GET.get('group_by', 'day')
+    if group_by not in GROUPINGS:
+        return JsonResponse({'error': f"group_by must be one of {', '.join(GROUPINGS)}"}, status=400)
+
+    return JsonResponse(sales_report(start, end, group_by, get_page_size(request, default=50, maximum=500)))
+
 # ----------------------------
 # PAYMENTS
 # ----------------------------
 @csrf_exempt
+@retry_if_cart_busy
 def initiate_payu_payment(request):
     user = decode_token_from_request(request)
     if not user:
@@ -670,12 +1156,18 @@ def initiate_payu_payment(request):
             return JsonResponse({"error": "Address ID is required"}, status=400)
 
         # 2. Calculate Amount
+        carts.flush(user.id)
         cart = getattr(user, 'cart', None)
         if not cart or not cart.items.exists():
             return JsonResponse({"error": "Cart is empty"}, status=400)
             
-        cart_items = cart.items.all()
-        total_amount = sum([item.product.price * item.quantity for item in cart_items])
+        lines, total_amount = cart_lines(cart)
+
+        # Fail fast before payment; stock is only taken in payu_success
+        try:
+            check_stock(lines)
+        except OutOfStock as e:
+            return JsonResponse(e.as_dict(), status=409)
         
         # IMPORTANT: Format amount to 2 decimal places string for Hash consistency
         amount_str = f"{total_amount:.2f}"
@@ -716,6 +1208,100 @@ def initiate_payu_payment(request):
             "action": settings.PAYU_BASE_URL,
         })
 
+def _payu_callback_redirect(status):
+    if status == 'out_of_stock':
+        return redirect("http://localhost:5173/cart?error=out_of_stock")
+    return redirect("http://localhost:5173/Success")
+
+def _payu_place_order(user, address, txn_id, placed):
+    cart = getattr(user, 'cart', None)
+
+    # If cart is empty (already processed) or missing, just redirect to orders
+    if not cart or not cart.items.exists():
+        metrics.PAYU_CALLBACKS.labels('empty_cart').inc()
+        return redirect("http://localhost:5173/Success")
+
+    try:
+        with transaction.atomic():
+            # Claim the txnid first; a concurrent duplicate blocks on the
+            # unique index here and then finds it taken instead of ordering twice.
+            callback = None
+            if txn_id:
+                callback = _claim_txnid(txn_id)
+                if callback is None:
+                    metrics.PAYU_CALLBACKS.labels('duplicate').inc()
+                    seen = PaymentCallback.objects.filter(txnid=txn_id).values_list('status', flat=True).first()
+                    return _payu_callback_redirect(seen)
+
+            # Calculate Total
+            lines, total = cart_lines(cart)
+            reserve_stock(lines)
+
+            # Create Order (Allow address to be None if absolutely necessary)
+            order = Order.objects.create(
+                user=user, 
+                address=address, 
+                total_amount=total,
+                status="Paid",
+                payment_id=txn_id
+            )
+
+            # Move Cart Items -> Order Items
+            items = [
+                OrderItem(
+                    order=order, 
+                    product_id=line['product_id'], 
+                    quantity=line['quantity'], 
+                    unit_price=line['unit_price']
+                ) for line in lines
+            ]
+            OrderItem.objects.bulk_create(items)
+
+            # Clear Cart
+            cart.items.all().delete()
+
+            if callback:
+                callback.order = order
+                callback.save(update_fields=['order'])
+
+            # Added to the sales rollups once the order commits
+            record_order(order, lines)
+        placed()
+        invalidate_cart_summary(user.id)
+        # PayU calls back without the shopper's token, so ReplicaMiddleware
+        # cannot pin them: their next order reads must see this order
+        pin_to_primary(user.id)
+        metrics.PAYU_CALLBACKS.labels('processed').inc()
+        metrics.ORDERS_CREATED.labels('payu').inc()
+
+        # 5. ✅ Redirect to React Frontend Success Page
+        return redirect("http://localhost:5173/Success")
+
+    except OutOfStock as e:
+        # Paid but sold out in the meantime: needs a refund for this txnid
+        logger.error("Out of stock after payment %s: %s", txn_id, e.shortages)
+        metrics.PAYU_CALLBACKS.labels('out_of_stock').inc()
+        metrics.PAID_OUT_OF_STOCK.inc()
+        if txn_id:
+            PaymentCallback.objects.get_or_create(txnid=txn_id, defaults={'status': 'out_of_stock'})
+        return _payu_callback_redirect('out_of_stock')
+    except Exception:
+        logger.exception("Creating the order for PayU transaction %s failed", txn_id)
+        metrics.PAYU_CALLBACKS.labels('error').inc()
+        # Redirect to cart if something goes wrong
+        return redirect("http://localhost:5173/cart")
+
+def _claim_txnid(txn_id):
+    """The txnid's PaymentCallback row, created now; None if it already exists."""
+    try:
+        # A savepoint, so a duplicate leaves the surrounding transaction usable
+        with transaction.atomic():
+            return PaymentCallback.objects.create(txnid=txn_id)
+    except IntegrityError:
+        if PaymentCallback.objects.filter(txnid=txn_id).exists():
+            return None
+        raise
+
 @csrf_exempt
 def payu_success(request):
     if request.method == "POST":
@@ -725,12 +1311,26 @@ def payu_success(request):
         user_id = data.get('udf1')
         address_id = data.get('udf2')
         txn_id = data.get('txnid')
+
+        # surl only hears about successful payments; anything else places no order
+        if data.get('status') != 'success':
+            metrics.PAYU_CALLBACKS.labels('failure').inc()
+            return redirect("http://localhost:5173/cart")
+
+        # PayU retries callbacks: a txnid we have already handled is answered
+        # from its idempotency record without touching the cart or orders.
+        if txn_id:
+            seen = PaymentCallback.objects.filter(txnid=txn_id).values_list('status', flat=True).first()
+            if seen:
+                metrics.PAYU_CALLBACKS.labels('duplicate').inc()
+                return _payu_callback_redirect(seen)
         
         # 2. Get User Safely
         try:
             user = User.objects.get(pk=user_id)
         except (User.DoesNotExist, TypeError):
             # If user data is lost, redirect to home
+            metrics.PAYU_CALLBACKS.labels('unknown_user').inc()
             return redirect("http://localhost:5173/") 
 
         # 3. 👇 CRITICAL FIX: Use 'filter().first()' instead of 'get_object_or_404'
@@ -741,47 +1341,13 @@ def payu_success(request):
         if not address:
             address = Address.objects.filter(user=user).first()
             
-        # 4. Process Order
-        cart = getattr(user, 'cart', None)
-        
-        # If cart is empty (already processed) or missing, just redirect to orders
-        if not cart or not cart.items.exists():
-            return redirect("http://localhost:5173/Success")
-
+        # 4. Process Order (the cart is written to the database and held still until it is placed)
         try:
-            with transaction.atomic():
-                # Calculate Total
-                total = sum([item.product.price * item.quantity for item in cart.items.all()])
-                
-                # Create Order (Allow address to be None if absolutely necessary)
-                order = Order.objects.create(
-                    user=user, 
-                    address=address, 
-                    total_amount=total,
-                    status="Paid",
-                    payment_id=txn_id
-                )
-                
-                # Move Cart Items -> Order Items
-                items = [
-                    OrderItem(
-                        order=order, 
-                        product=item.product, 
-                        quantity=item.quantity, 
-                        unit_price=item.product.price
-                    ) for item in cart.items.all()
-                ]
-                OrderItem.objects.bulk_create(items)
-                
-                # Clear Cart
-                cart.items.all().delete()
-
-            # 5. ✅ Redirect to React Frontend Success Page
-            return redirect("http://localhost:5173/Success")
-            
-        except Exception as e:
-            print(f"Order Creation Error: {e}")
-            # Redirect to cart if something goes wrong
+            with carts.checkout(user.id) as placed:
+                return _payu_place_order(user, address, txn_id, placed)
+        except carts.CartBusy:
+            logger.error("Cart of user %s busy; PayU callback %s not processed", user.id, txn_id)
+            metrics.PAYU_CALLBACKS.labels('error').inc()
             return redirect("http://localhost:5173/cart")
             
     # If not POST, go home
@@ -789,12 +1355,21 @@ def payu_success(request):
 
 @csrf_exempt
 def payu_failure(request):
+    metrics.PAYU_CALLBACKS.labels('failure').inc()
     # Redirect back to frontend cart on failure
     return redirect("http://localhost:5173/cart")
 
 # ----------------------------
 # REVIEWS
 # ----------------------------
+# Keyset orderings for product_reviews, backed by the Review indexes
+REVIEW_SORTS = {
+    'newest': [('created_at', True), ('id', True)],
+    'highest': [('rating', True), ('id', True)],
+    'lowest': [('rating', False), ('id', False)],
+    'helpful': [('helpful_count', True), ('id', True)],
+}
+
 @csrf_exempt
 def add_review(request):
     user = decode_token_from_request(request)
@@ -807,21 +1382,25 @@ def add_review(request):
         rating = int(data.get("rating", 5))
     except ValueError:
         rating = 5
+    if not 1 <= rating <= 5:
+        return JsonResponse({"error": "Rating must be between 1 and 5"}, status=400)
 
     body = data.get("body", "")
     title = data.get("title", "")
     product = get_object_or_404(Product, pk=product_id)
     
-    rev, created = Review.objects.get_or_create(
-        product=product, user=user, 
-        defaults={"rating":rating, "body":body, "title":title}
-    )
-    
-    if not created:
-        rev.rating = rating
-        rev.body = body
-        rev.title = title
-        rev.save()
+    # The rating summary is updated by signals inside the same transaction
+    with transaction.atomic():
+        rev, created = Review.objects.get_or_create(
+            product=product, user=user, 
+            defaults={"rating":rating, "body":body, "title":title}
+        )
+        
+        if not created:
+            rev.rating = rating
+            rev.body = body
+            rev.title = title
+            rev.save()
         
     return JsonResponse({"id": rev.id, "product": product.id, "rating": rev.rating, "body": rev.body})
 
@@ -834,7 +1413,7 @@ def review_detail(request, pk):
     review = get_object_or_404(Review, pk=pk, user=user)
     
     if request.method == "GET":
-        return JsonResponse({"id": review.id, "product": review.product.id, "rating": review.rating, "title": review.title, "body": review.body})
+        return JsonResponse({"id": review.id, "product": review.product_id, "rating": review.rating, "title": review.title, "body": review.body})
         
     elif request.method == "PUT":
         data = get_request_data(request)
@@ -843,32 +1422,82 @@ def review_detail(request, pk):
                 review.rating = int(data.get("rating"))
         except ValueError:
             pass
+        if not 1 <= review.rating <= 5:
+            return JsonResponse({"error": "Rating must be between 1 and 5"}, status=400)
             
         review.title = data.get("title", review.title)
         review.body = data.get("body", review.body)
-        review.save()
-        return JsonResponse({"id": review.id, "product": review.product.id, "rating": review.rating, "title": review.title, "body": review.body})
+        with transaction.atomic():
+            review.save()
+        return JsonResponse({"id": review.id, "product": review.product_id, "rating": review.rating, "title": review.title, "body": review.body})
         
     elif request.method == "DELETE":
-        review.delete()
+        with transaction.atomic():
+            review.delete()
         return JsonResponse({"message": "Review deleted"})
 
+def _review_rows(product):
+    return (Review.objects.filter(product=product)
+            .values('id', 'user__username', 'rating', 'title', 'body', 'created_at', 'helpful_count'))
+
+def _review_data(page):
+    return [
+        {
+            "id": r['id'],
+            "user": r['user__username'],
+            "rating": r['rating'],
+            "title": r['title'],
+            "body": r['body'],
+            "created_at": r['created_at'],
+            "helpful_count": r['helpful_count'],
+        }
+        for r in page
+    ]
+
 @csrf_exempt
+@replica_reads
+@condition(etag_func=conditional.reviews_etag, last_modified_func=conditional.reviews_last_modified)
 def product_reviews(request, product_id):
     product = get_object_or_404(Product, pk=product_id)
     if request.method == "GET":
-        reviews = Review.objects.filter(product=product).select_related('user')
-        data = [
-            {
-                "id": r.id,
-                "user": r.user.username,
-                "rating": r.rating,
-                "title": r.title,
-                "body": r.body,
-                "created_at": r.created_at
-            }
-            for r in reviews
-        ]
-        return JsonResponse(data, safe=False)
-    
-    
+        ordering = REVIEW_SORTS.get(request.GET.get('sort', 'newest'))
+        if not ordering:
+            return JsonResponse({"error": "Invalid sort"}, status=400)
+        try:
+            page, next_cursor = keyset_paginate(_review_rows(product), ordering, request.GET.get('cursor'),
+                                                get_page_size(request, default=10, maximum=50))
+        except InvalidCursor as e:
+            return JsonResponse({"error": str(e)}, status=400)
+        return JsonResponse({"results": _review_data(page), "next_cursor": next_cursor})
+
+@csrf_exempt
+def review_helpful(request, pk):
+    user = decode_token_from_request(request)
+    if not user:
+        return JsonResponse({"error":"Authentication required"}, status=401)
+    if request.method != "POST":
+        return JsonResponse({'error':'Invalid method'}, status=405)
+
+    review = get_object_or_404(Review, pk=pk)
+    with transaction.atomic():
+        vote, created = ReviewVote.objects.get_or_create(review=review, user=user)
+        if created:
+            Review.objects.filter(pk=pk).update(helpful_count=F('helpful_count') + 1)
+    if created:
+        transaction.on_commit(lambda: conditional.bump_stamp(f'reviews:{review.product_id}'))
+    review.refresh_from_db(fields=['helpful_count'])
+    return JsonResponse({"id": review.id, "helpful_count": review.helpful_count})
+
+# ----------------------------
+# METRICS
+# ----------------------------
+def metrics_view(request):
+    """Prometheus scrape endpoint: METRICS_TOKEN as a bearer token (open only with DEBUG)."""
+    token = getattr(settings, 'METRICS_TOKEN', None)
+    if not token:
+        if not settings.DEBUG:
+            return JsonResponse({"error": "Metrics need METRICS_TOKEN"}, status=403)
+    elif not hmac.compare_digest(request.headers.get('Authorization', ''), f"Bearer {token}"):
+        return JsonResponse({"error": "Forbidden"}, status=403)
+    body, content_type = metrics.render()
+    return HttpResponse(body, content_type=content_type)
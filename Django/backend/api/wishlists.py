@@ -0,0 +1,29 @@
+from django.conf import settings
+from django.core.cache import cache
+
+from .models import WishlistItem
+
+# ----------------------------
+# Wishlist membership
+# ----------------------------
+# Product grids only need to know which products to draw a filled heart for:
+# the user's wishlisted product ids, cached per user. add_to_wishlist and
+# remove_from_wishlist invalidate it; items removed by a product deletion
+# drop out when the entry expires (WISHLIST_IDS_TTL).
+
+def _ids_key(user_id):
+    return f"wishlist_ids:{user_id}"
+
+def wishlist_product_ids(user_id):
+    """The user's wishlisted product ids, oldest first."""
+    key = _ids_key(user_id)
+    ids = cache.get(key)
+    if ids is None:
+        ids = list(WishlistItem.objects.filter(wishlist__user_id=user_id)
+                   .order_by('id').values_list('product_id', flat=True))
+        cache.set(key, ids, getattr(settings, 'WISHLIST_IDS_TTL', 300))
+    return ids
+
+def invalidate_wishlist_ids(user_id):
+    """Call after any write to the user's wishlist items."""
+    cache.delete(_ids_key(user_id))
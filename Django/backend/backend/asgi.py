@@ -9,8 +9,28 @@ https://docs.djangoproject.com/en/5.2/howto/deployment/asgi/
 
 import os
 
-from django.core.asgi import get_asgi_application
+import django
+from django.conf import settings
+from django.core.handlers.asgi import ASGIHandler
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'backend.settings')
 
-application = get_asgi_application()
+
+class CatalogASGIHandler(ASGIHandler):
+    """
+    Routes ASGI requests through settings.ASGI_URLCONF, whose public catalog
+    reads are native async views (api/async_views.py). WSGI keeps
+    ROOT_URLCONF and never pays for async_to_sync.
+    """
+
+    async def get_response_async(self, request):
+        request.urlconf = getattr(settings, 'ASGI_URLCONF', settings.ROOT_URLCONF)
+        return await super().get_response_async(request)
+
+
+def get_application():
+    django.setup(set_prefix=False)
+    return CatalogASGIHandler()
+
+
+application = get_application()
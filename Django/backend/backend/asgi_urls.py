@@ -0,0 +1,9 @@
+from django.contrib import admin
+from django.urls import path, include
+
+# ROOT_URLCONF for requests served by backend/asgi.py: the API's public reads
+# resolve to native async views (api/async_urls.py)
+urlpatterns = [
+    path('admin/', admin.site.urls),
+    path('api/', include('api.async_urls')),
+]
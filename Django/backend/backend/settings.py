@@ -30,7 +30,8 @@ BASE_DIR = Path(__file__).resolve().parent.parent
 # SECRET_KEY = 'django-insecure-*+214utn=^dx6(c^or$k#!5-is$kh&m7g-(=d05367u=-r89^f'
 
 # SECURITY WARNING: don't run with debug turned on in production!
-DEBUG = True
+# Set DEBUG=0 there: /api/_metrics, for one, is open to anyone in DEBUG without METRICS_TOKEN
+DEBUG = os.getenv("DEBUG", "True").lower() in ("1", "true", "yes")
 
 ALLOWED_HOSTS = ["*"]
 
@@ -50,10 +51,12 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'api.metrics.MetricsMiddleware',
+    'api.timing.ServerTimingMiddleware',
+    'api.replicas.ReplicaMiddleware',
     'corsheaders.middleware.CorsMiddleware',
     "django.middleware.security.SecurityMiddleware",
-    "whitenoise.middleware.WhiteNoiseMiddleware",
-    'django.middleware.security.SecurityMiddleware',
+    "api.middleware.AsyncWhiteNoiseMiddleware",
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
@@ -104,6 +107,15 @@ DATABASES = {
     }
 }
 
+# Local SQLite instead of MySQL (quick local runs, `manage.py benchmark`)
+if os.environ.get('DB_ENGINE') == 'sqlite':
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.sqlite3',
+            'NAME': BASE_DIR / 'db.sqlite3',
+        }
+    }
+
 
 
 # Password validation
@@ -162,4 +174,93 @@ SECRET_KEY= os.getenv("SECRET_KEY")
 # PayU Settings
 PAYU_MERCHANT_KEY = os.getenv("KEY")
 PAYU_MERCHANT_SALT = os.getenv("SALT")
-PAYU_BASE_URL = "https://test.payu.in/_payment"
\ No newline at end of file
+PAYU_BASE_URL = "https://test.payu.in/_payment"
+
+# In-process product search (api/search.py)
+SEARCH_INDEX_TTL = int(os.getenv("SEARCH_INDEX_TTL", 300))  # seconds between background rebuilds
+SEARCH_MAX_RESULTS = 1000
+INDEX_REBUILD_EAGER = False  # rebuild the in-process indexes inline (tests / debugging)
+
+# Seconds the cached token-version / active flags of a user are trusted (api/tokens.py);
+# revocations drop the entry at once
+AUTH_CACHE_TTL = 60
+
+# In-process catalog facets (api/facets.py)
+FACET_INDEX_TTL = int(os.getenv("FACET_INDEX_TTL", 300))  # seconds between background rebuilds
+FACET_PRICE_BUCKETS = [0, 500, 1000, 2500, 5000, 10000, 25000]  # lower bucket edges
+FACET_FILTER_MAX_IDS = 1000  # filtered listings matching up to this many products query them by id
+
+# ETag / Last-Modified on catalog reads (api/conditional.py): only with the
+# shared cache, where every worker sees the same change stamps
+CONDITIONAL_GET = bool(os.getenv("REDIS_URL"))
+# Lifetime of the change stamps: kept until the next write in the shared
+# cache, short with the per-process one (card cache generations)
+CONDITIONAL_STAMP_TTL = None if os.getenv("REDIS_URL") else 300
+
+# Cached cart badge counts (api/pricing.py); writes invalidate it explicitly
+CART_SUMMARY_TTL = 300
+
+MEDIA_URL = '/media/'
+MEDIA_ROOT = BASE_DIR / "media"
+
+# Background product image uploads (api/uploads.py)
+IMAGE_UPLOAD_BACKEND = os.getenv("IMAGE_UPLOAD_BACKEND", "api.uploads.CloudinaryStorage")  # or api.uploads.LocalFileStorage
+IMAGE_UPLOAD_WORKERS = int(os.getenv("IMAGE_UPLOAD_WORKERS", 4))
+IMAGE_UPLOAD_SPOOL_DIR = os.getenv("IMAGE_UPLOAD_SPOOL_DIR")  # defaults to a temp directory
+IMAGE_UPLOAD_PUBLIC_HOST = os.getenv("IMAGE_UPLOAD_PUBLIC_HOST", "http://127.0.0.1:8000")  # prefixes LocalFileStorage URLs
+IMAGE_UPLOAD_EAGER = False  # run uploads inline (tests / debugging)
+IMAGE_UPLOAD_STALE_AFTER = 15 * 60  # seconds a job may run before resume_image_uploads retries it
+
+# Background product imports (api/importer.py)
+PRODUCT_IMPORT_SPOOL_DIR = os.getenv("PRODUCT_IMPORT_SPOOL_DIR")  # defaults to a temp directory
+PRODUCT_IMPORT_EAGER = False  # run imports inline (tests / debugging)
+PRODUCT_IMPORT_STALE_AFTER = 60 * 60  # seconds a job may run before resume_product_imports retries it
+
+# Share of requests that get a Server-Timing header (api/timing.py); staff can
+# force it per request with ?_debug=timing
+SERVER_TIMING_SAMPLE_RATE = float(os.getenv("SERVER_TIMING_SAMPLE_RATE", 0.1))
+
+# Prometheus metrics (api/metrics.py). Set PROMETHEUS_MULTIPROC_DIR in the
+# environment when running several worker processes.
+METRICS_ENABLED = True
+METRICS_TOKEN = os.getenv("METRICS_TOKEN")  # bearer token to scrape /api/_metrics (without it: DEBUG only)
+
+# URLconf for requests served through backend/asgi.py (async catalog reads)
+ASGI_URLCONF = 'backend.asgi_urls'
+
+# Read replicas (api/replicas.py): DB_REPLICAS=host1,host2 adds replica1,
+# replica2 with the primary's credentials (file paths when DB_ENGINE=sqlite).
+# Tests mirror them onto the test database. Run `manage.py replica_heartbeat --loop`
+# alongside the web workers, once per deployment, so lag can be measured.
+DATABASE_REPLICAS = []
+for n, replica in enumerate(filter(None, os.getenv("DB_REPLICAS", "").split(",")), 1):
+    location = 'NAME' if DATABASES['default']['ENGINE'].endswith('sqlite3') else 'HOST'
+    DATABASES[f'replica{n}'] = {**DATABASES['default'], location: replica.strip(), 'TEST': {'MIRROR': 'default'}}
+    DATABASE_REPLICAS.append(f'replica{n}')
+DATABASE_ROUTERS = ['api.replicas.ReplicaRouter']
+REPLICA_STICKY_SECONDS = 5  # a user's reads stay on the primary this long after they write
+REPLICA_MAX_LAG = 10        # seconds behind the primary before a replica leaves rotation (keep above the interval)
+REPLICA_CHECK_INTERVAL = 5  # seconds between heartbeats and between each process's background checks; None: no checker thread
+
+# Shared cache for every worker (carts, auth state, stamps, pins); locmem, per process, otherwise.
+# Without it the features that need every worker to see the same entries
+# (write-behind carts, conditional GET) stay off.
+if os.getenv("REDIS_URL"):
+    CACHES = {'default': {'BACKEND': 'django.core.cache.backends.redis.RedisCache', 'LOCATION': os.getenv("REDIS_URL")}}
+
+# Cache-backed carts (api/carts.py). Run `manage.py flush_carts` from cron to
+# write carts a crashed worker left in the cache.
+CART_WRITE_BEHIND = bool(os.getenv("REDIS_URL"))  # off: carts go straight to the database
+CART_CACHE_TTL = 60 * 60 * 24 * 7
+CART_FLUSH_DELAY = 2      # seconds from a cart change to the background write; None: only checkout and flush_carts write
+CART_FLUSH_EAGER = False  # write carts inline (tests / debugging)
+CART_BATCH_MAX_OPERATIONS = 100  # per POST /api/cart/batch/
+
+# Cached wishlist product ids (api/wishlists.py); wishlist writes invalidate it explicitly
+WISHLIST_IDS_TTL = 300
+
+# Cached product cards behind GET /api/products/batch/ (api/cards.py); writes
+# invalidate them on commit in the shared cache, the TTL bounds a card refilled
+# by a read that raced a write (and staleness with the per-process cache)
+PRODUCT_CARD_TTL = 60 * 60 if os.getenv("REDIS_URL") else 300
+PRODUCT_BATCH_MAX_IDS = 100
@@ -49,7 +49,11 @@ export const AuthProvider = ({ children }) => {
         }
     };
 
-    const logout = () => {
+    const logout = async () => {
+        // Revoke the token server-side; sign out locally even if that fails
+        if (localStorage.getItem('token')) {
+            await authService.logout().catch((err) => console.log(err));
+        }
         localStorage.removeItem('token');
         localStorage.removeItem('username');
         localStorage.removeItem('is_staff'); // Clear permission
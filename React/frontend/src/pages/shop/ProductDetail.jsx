@@ -14,7 +14,7 @@ const ProductDetail = () => {
 
     useEffect(() => {
         productService.getOne(id).then(res => setProduct(res.data));
-        reviewService.getByProduct(id).then(res => setReviews(res.data));
+        reviewService.getByProduct(id).then(res => setReviews(res.data.results)); // First page only
     }, [id]);
 
     const submitReview = async (e) => {
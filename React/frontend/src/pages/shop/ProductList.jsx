@@ -1,5 +1,5 @@
 import { useEffect, useState, useContext } from 'react';
-import { Container, Row, Col, Spinner, Form, Card, Badge } from 'react-bootstrap';
+import { Container, Row, Col, Spinner, Form, Card, Badge, Button } from 'react-bootstrap';
 import { toast } from 'react-toastify';
 import { productService, cartService } from '../../services/api';
 import AuthContext from '../../context/AuthContext';
@@ -10,6 +10,8 @@ const ProductList = () => {
     const [allProducts, setAllProducts] = useState([]); 
     const [filteredProducts, setFilteredProducts] = useState([]);
     const [loading, setLoading] = useState(true); 
+    const [nextCursor, setNextCursor] = useState(null); // null once the last page is loaded
+    const [loadingMore, setLoadingMore] = useState(false);
     
     // 2. Filter States
     const [categories, setCategories] = useState([]); // List of unique category names
@@ -20,36 +22,40 @@ const ProductList = () => {
 
     const { user } = useContext(AuthContext);
 
+    // Fetch one page and append it; filters apply to everything loaded so far
+    const loadPage = (cursor) => productService.getAll(cursor ? { cursor } : {})
+        .then(res => {
+            // Pre-process data: Add random rating if missing (so filtering works)
+            const processedData = res.data.results.map(p => ({
+                ...p,
+                price: parseFloat(p.price), // Ensure price is a number
+                rating: p.rating_summary?.count ? p.rating_summary.average.toFixed(1) : (Math.random() * (5 - 3.5) + 3.5).toFixed(1) // consistent rating
+            }));
+            const loaded = cursor ? [...allProducts, ...processedData] : processedData;
+
+            setAllProducts(loaded);
+            setNextCursor(res.data.next_cursor);
+            
+            // Extract unique categories from data
+            const uniqueCats = [...new Set(loaded.map(p => p.category?.name).filter(Boolean))];
+            setCategories(uniqueCats);
+
+            // Find highest price for the slider max value; keep a narrowed slider where it is
+            const highestPrice = Math.max(0, ...loaded.map(p => p.price));
+            if (priceRange === maxPriceInDB || !cursor) setPriceRange(highestPrice);
+            setMaxPriceInDB(highestPrice);
+        })
+        .catch(err => console.error(err));
+
     useEffect(() => {
-        productService.getAll()
-            .then(res => {
-                // Pre-process data: Add random rating if missing (so filtering works)
-                const processedData = res.data.map(p => ({
-                    ...p,
-                    price: parseFloat(p.price), // Ensure price is a number
-                    rating: p.rating || (Math.random() * (5 - 3.5) + 3.5).toFixed(1) // consistent rating
-                }));
-
-                setAllProducts(processedData);
-                setFilteredProducts(processedData);
-                
-                // Extract unique categories from data
-                const uniqueCats = [...new Set(processedData.map(p => p.category?.name).filter(Boolean))];
-                setCategories(uniqueCats);
-
-                // Find highest price for the slider max value
-                const highestPrice = Math.max(...processedData.map(p => p.price));
-                setMaxPriceInDB(highestPrice);
-                setPriceRange(highestPrice);
-
-                setLoading(false); 
-            })
-            .catch(err => {
-                console.error(err);
-                setLoading(false);
-            });
+        loadPage(null).finally(() => setLoading(false));
     }, []);
 
+    const loadMore = () => {
+        setLoadingMore(true);
+        loadPage(nextCursor).finally(() => setLoadingMore(false));
+    };
+
     // 3. The Filter Logic (Runs whenever a filter changes)
     useEffect(() => {
         let result = allProducts;
@@ -191,6 +197,14 @@ const ProductList = () => {
                             </div>
                         )}
                     </Row>
+
+                    {nextCursor && (
+                        <div className="text-center my-3">
+                            <Button variant="outline-primary" onClick={loadMore} disabled={loadingMore}>
+                                {loadingMore ? <Spinner animation="border" size="sm" /> : "Load more products"}
+                            </Button>
+                        </div>
+                    )}
                 </Col>
             </Row>
         </Container>
@@ -16,11 +16,14 @@ export const authService = {
     register: (data) => api.post('/auth/register/', data),
     adminRegister: (data) => api.post('/auth/admin/register/', data),
     adminLogin: (creds) => api.post('/auth/admin/login/', creds),
+    logout: () => api.post('/auth/logout/'), // Revokes every token of the user
+    changePassword: (data) => api.post('/auth/password/', data), // { old_password, new_password } -> { token }
 };
 
 export const productService = {
-    getAll: () => api.get('/products/'),
+    getAll: (params = {}) => api.get('/products/', { params: { limit: 100, ...params } }), // Paginated: { results, next_cursor }
     getOne: (id) => api.get(`/products/${id}/`),
+    getMany: (ids) => api.get('/products/batch/', { params: { ids: ids.join(',') } }), // { results, missing }
     getMyProducts: () => api.get('/products/my/'), // To view Admin's Products
     create: (data) => api.post('/products/', data), 
     update: (id, data) => api.put(`/products/${id}/`, data), //  Edit Admin's Products
@@ -29,7 +32,7 @@ export const productService = {
 
 export const reviewService = {
     add: (data) => api.post('/reviews/add/', data),
-    getByProduct: (productId) => api.get(`/products/${productId}/reviews/`),
+    getByProduct: (productId, params = {}) => api.get(`/products/${productId}/reviews/`, { params }), // { results, next_cursor }
 };
 
 export const cartService = {
@@ -37,10 +40,13 @@ export const cartService = {
     add: (product_id, quantity) => api.post('/cart/', { product_id, quantity }),
     remove: (item_id) => api.delete('/cart/', { data: { item_id } }),
     clear: () => api.delete('/cart/'),
+    batch: (operations) => api.post('/cart/batch/', { operations }), // [{op: 'add'|'set'|'remove', product_id, quantity}]
 };
 
 export const wishlistService = {
     get: () => api.get('/wishlist/'),
+    page: (cursor, limit) => api.get('/wishlist/items/', { params: { cursor, limit } }), // { results, next_cursor }
+    ids: () => api.get('/wishlist/ids/'), // { product_ids }
     add: (product_id) => api.post('/wishlist/add/', { product_id }),
     remove: (product_id) => api.delete(`/wishlist/remove/${product_id}/`),
 };